@@ -1,18 +1,183 @@
 '''
 Supporting code common to all animation programs.
+
+Also the Animation class used by core1 to manage the pool of animation modules.
+
+Animation modules implement one of two protocols:
+
+Module functions (the original one): The module has a function update(frame_ms, first_frame) that
+returns a list of doorsign.pixel_count pixels for the frame and keeps its state in module globals.
+
+Renderer classes: The module binds a class to the name renderer. core1 creates an instance when
+the animation starts and calls its method render(frame_ms, out) for each frame. It writes all
+doorsign.pixel_count pixels into the frame buffer out provided by the caller, see
+doorsign.newFrame(). Its state lives in the instance, declared in __slots__, so restarting just
+means creating a new instance. If a frame is the same as the one before render() can return False
+instead of writing it again, out then still holds the previous frame. Rendering into the same
+buffers every frame and keeping colors in preallocated tuples means (almost) nothing is allocated
+per frame, which keeps the garbage collector quiet. New animations should use this protocol, see
+animation_template._py.
+
+Animations that just blend between colors do not need code at all. They can be keyframe data files
+animation_*.json instead, compiled and rendered by keyframes.py.
 '''
 
+import sys
 import time
+import ujson
 import doorsign
 import logger
 
 '''
-Called with a programs updateFunc will simulate the use in the main framework and thus
-test the program stand-alone.
+Read the configuration values of an animation module from its source without importing it.
+
+By convention the configuration comes first in the module, each value on a line of its own
+as 'name = value', before the first import. Values can be True, False, an integer or a
+product of integers. Returns a dictionary of the values found.
+'''
+def readConfig(filename):
+    config = {}
+    
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line.startswith('import ') or line.startswith('from '):
+                break
+            
+            i = line.find('=')
+            if i == -1:
+                continue
+            
+            name = line[:i].strip()
+            value = line[i+1:].strip()
+            
+            if value == 'True':
+                config[name] = True
+            elif value == 'False':
+                config[name] = False
+            else:
+                try:
+                    product = 1
+                    for factor in value.split('*'):
+                        product *= int(factor)
+                    config[name] = product
+                except ValueError:
+                    pass
+    
+    return config
+
+'''
+Is filename one of the animation files that core1 picks up? Modules animation_*.py or keyframe
+files animation_*.json.
+'''
+def isAnimationFile(filename):
+    return filename.startswith('animation_') and (filename.endswith('.py') or filename.endswith('.json'))
+
+def isKeyframeFile(filename):
+    return (filename is not None) and filename.endswith('.json')
+
+'''
+Stands in for an animation module or keyframe file in the pool of animations. It knows the name
+and configuration of the animation without having it loaded. The module is imported, or the
+keyframe file compiled, the first time render() is called and can be unloaded again to free its
+memory.
+'''
+class Animation:
+    
+    def __init__(self, name, enabled, preferred_duration_ms, filename = None):
+        self.name = name
+        self.filename = filename
+        self.enabled = enabled
+        self.preferred_duration_ms = preferred_duration_ms
+        self.module = None
+        self.renderer = None # Instance of the module's renderer class, if it has one.
+        self.first_frame = True
+
+    # Create from the source file of an animation module or a keyframe file. Falls back to
+    # importing the module if its configuration cannot be read from the source.
+    @staticmethod
+    def fromFile(filename):
+        name = filename.split('.')[0]
+        
+        if isKeyframeFile(filename):
+            with open(filename) as f:
+                config = ujson.load(f)
+            return Animation(name, config.get('enabled', True), config.get('preferred_duration_ms', 60 * 60 * 1000), filename)
+        
+        config = readConfig(filename)
+        
+        if ('enabled' in config) and ('preferred_duration_ms' in config):
+            return Animation(name, config['enabled'], config['preferred_duration_ms'])
+        
+        logger.write('Importing ' + name + ' to read its configuration')
+        animation = Animation(name, False, 0)
+        module = animation.load()
+        animation.enabled = module.enabled
+        animation.preferred_duration_ms = module.preferred_duration_ms
+        animation.unload()
+        
+        return animation
+
+    # For keyframe files the "module" is the compiled keyframes.Program.
+    def load(self):
+        if self.module is None:
+            if isKeyframeFile(self.filename):
+                import keyframes
+                self.module = keyframes.load(self.filename)
+            else:
+                self.module = __import__(self.name)
+            self.restart()
+            
+        return self.module
+
+    # Drop the module. The caller should gc.collect() to actually free the memory. The next call
+    # to render() will import it fresh and it will start from its first frame.
+    def unload(self):
+        if self.module is not None:
+            self.module = None
+            self.renderer = None
+            if self.name in sys.modules:
+                del sys.modules[self.name]
+
+    def loaded(self):
+        return self.module is not None
+
+    # Start from the first frame on the next call to render().
+    def restart(self):
+        self.renderer = None
+        self.first_frame = True
+
+    # Render the next frame into the frame buffer out, with either protocol. Returns False if
+    # the frame did not change and out was left alone.
+    def render(self, frame_ms, out):
+        module = self.load()
+        
+        if hasattr(module, 'renderer'):
+            if self.renderer is None:
+                self.renderer = module.renderer()
+            changed = (self.renderer.render(frame_ms, out) is not False) or self.first_frame
+        else:
+            doorsign.copyPixelsInto(module.update(frame_ms, self.first_frame), out)
+            changed = True
+            
+        self.first_frame = False
+        return changed
+
+'''
+Called with a programs updateFunc or renderer class will simulate the use in the main framework
+and thus test the program stand-alone.
 ''' 
 def sample(updateFunc):
     start_ms = time.ticks_ms()
     
+    if hasattr(updateFunc, 'render'):
+        renderer = updateFunc()
+        frame = doorsign.newFrame()
+        
+        def updateFunc(frame_ms):
+            renderer.render(frame_ms, frame)
+            return frame
+    
     while True:
         frame_ms = time.ticks_ms()
         pixels = updateFunc(frame_ms)        
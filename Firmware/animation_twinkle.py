@@ -12,39 +12,37 @@ import doorsign
 import logger
 import animation
 
-lastframe_ms = None
-pixels = None
+OFF = (0, 0, 0)
+ON = (255, 255, 255)
 
-def update(frame_ms, first_frame = False):
-    global lastframe_ms
-    global pixels
+class Twinkle:
+    __slots__ = ('started', 'lit')
     
-    if first_frame or (lastframe_ms == None):        
-        # First frame. Initialize to all black
-        pixels = [[0,0,0]] * doorsign.pixel_count
-        offtimes_ms = [0] * doorsign.pixel_count
-    
-        # Turn on a random pixel.
-        pixelindex = random.randrange(doorsign.pixel_count)
-        pixels[pixelindex] = [255, 255, 255]
-
-        result = pixels
-    else:
-        # Consecutive frame
+    def __init__(self):
+        self.started = False
+        self.lit = False
+        
+    def render(self, frame_ms, out):
+        # Turn on a random pixel on the first frame, maybe on consecutive frames. randrange()
+        # rather than random() because it does not allocate a float.
+        lit = (not self.started) or (random.randrange(10) >= 6)
+        
+        # All dark as before? Then there is nothing to do.
+        if self.started and not (lit or self.lit):
+            return False
         
         # Turn off all pixels
-        pixels = [[0, 0, 0]] * doorsign.pixel_count
-                
-        # Maybe turn on a random pixel
-        if random.random() > 0.6:
-            pixelindex = random.randrange(doorsign.pixel_count)
-            pixels[pixelindex] = [255, 255, 255]
+        for pixelindex in range(doorsign.pixel_count):
+            out[pixelindex] = OFF
+        
+        if lit:
+            out[random.randrange(doorsign.pixel_count)] = ON
             
-    lastframe_ms = frame_ms
-    
-    return pixels
+        self.started = True
+        self.lit = lit
+
+renderer = Twinkle
 
 if __name__ == '__main__':
    
-   animation.sample(update)
-   
\ No newline at end of file
+   animation.sample(renderer)
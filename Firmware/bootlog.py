@@ -0,0 +1,30 @@
+'''
+Records how long the phases of booting take.
+
+Each call to mark() notes the time since reset at which a phase was completed, logs it and
+keeps it around for the API. Phases are marked by whoever completes them:
+
+  imports      main.py has imported all modules.
+  config       core0 has read config.json.
+  animations   core1 has loaded the animation modules.
+  first_frame  core1 has sent the first frame to the pixels.
+  wifi         The WiFi link is up for the first time.
+  ntp          The RTC has been synced with network time for the first time.
+'''
+
+import time
+import logger
+
+phases = [] # (name, ms since reset)
+
+def mark(name):
+    for phase in phases:
+        if phase[0] == name:
+            return
+
+    ms = time.ticks_ms()
+    phases.append((name, ms))
+    logger.write('Boot phase ' + name + ' completed at ' + str(ms) + ' ms')
+
+def stats():
+    return dict(phases)
@@ -0,0 +1,95 @@
+'''
+This module answers the connectivity checks phones and computers send as soon as they join
+a WiFi network. In AP mode all names resolve to us (see dnsserver.py), so these requests
+land on our web server. Treating them as static files costs flash access and produces 404s
+which makes the clients retry aggressively.
+
+Instead the complete responses are precomputed once and sent straight from memory, without
+logging. What they say depends on the mode configured in config.json as AP.probes:
+
+  'portal' (default)  Redirect to our index page. The client opens it as captive portal.
+  'online'            Send the answer the client expects from the real internet. The client
+                      stays quiet and considers the network connected.
+
+Counts of the probes answered are kept, see stats().
+'''
+
+# Path -> (status, content-type, body) for answering as if we were online.
+_online = {
+    '/generate_204':              ('204 No Content', None, ''), # Android
+    '/gen_204':                   ('204 No Content', None, ''), # Android
+    '/hotspot-detect.html':       ('200 OK', 'text/html', '<HTML><HEAD><TITLE>Success</TITLE></HEAD><BODY>Success</BODY></HTML>'), # Apple
+    '/library/test/success.html': ('200 OK', 'text/html', '<HTML><HEAD><TITLE>Success</TITLE></HEAD><BODY>Success</BODY></HTML>'), # Apple
+    '/connecttest.txt':           ('200 OK', 'text/plain', 'Microsoft Connect Test'), # Windows 10+
+    '/ncsi.txt':                  ('200 OK', 'text/plain', 'Microsoft NCSI'), # Windows
+    '/redirect':                  ('200 OK', 'text/plain', ''), # Windows
+    '/success.txt':               ('200 OK', 'text/plain', 'success\n'), # Firefox
+    '/canonical.html':            ('200 OK', 'text/html', '<meta http-equiv="refresh" content="0;url=https://support.mozilla.org/kb/captive-portal"/>'), # Firefox
+}
+
+import logger
+
+_responses = None
+_counts = {}
+
+total = 0
+
+'''
+Precompute the responses. ip is our address, mode as described above.
+'''
+def setup(ip, mode = 'portal'):
+    global _responses
+
+    _responses = {}
+    for path, (status, contenttype, body) in _online.items():
+        if mode == 'online':
+            response = 'HTTP/1.0 ' + status
+            if contenttype:
+                response += '\r\nContent-Type: ' + contenttype
+            response += '\r\nContent-Length: ' + str(len(body)) + '\r\n\r\n' + body
+        else:
+            response = 'HTTP/1.0 302 Found\r\nLocation: http://' + ip + '/index.html\r\nContent-Length: 0\r\n\r\n'
+
+        _responses[path.encode()] = response.encode()
+
+'''
+Look at the raw request and return the complete precomputed response if it is a known probe.
+Returns None otherwise, also when not set up.
+'''
+def response(request_data):
+    global total
+
+    if not _responses:
+        return None
+
+    # Request line: METHOD PATH[?QUERY] VERSION
+    start = request_data.find(b' ')
+    if start == -1:
+        return None
+    end = request_data.find(b' ', start + 1)
+    if end == -1:
+        return None
+    path = request_data[start + 1:end]
+    query = path.find(b'?')
+    if query != -1:
+        path = path[:query]
+
+    result = _responses.get(path)
+    if result:
+        total += 1
+        _counts[path] = _counts.get(path, 0) + 1
+
+    return result
+
+def stats():
+    result = {'total': total}
+    for path, count in _counts.items():
+        result[path.decode()] = count
+
+    return result
+
+if __name__ == '__main__':
+
+    setup('192.168.4.1')
+    logger.write(str(response(b'GET /generate_204 HTTP/1.1\r\nHost: connectivitycheck.gstatic.com\r\n\r\n')))
+    logger.write(str(stats()))
@@ -0,0 +1,105 @@
+'''
+This module stacks layers of animations on top of each other.
+
+The bottom of the stack is whatever core1 has scheduled, possibly a blend of two animations. On
+top of that come the layers configured in the LAYERS section of config.json, for example
+animation_twinkle sparkling over the others:
+
+    "LAYERS": [
+        {"animation": "animation_twinkle", "mode": "screen", "opacity": 0.6, "mask": [1, 3, 5, 7]}
+    ]
+
+animation  The name of an animation, enabled or not.
+mode       How the layer combines with what is below it, one of the modes below. Default: normal.
+opacity    0.0 to 1.0. Default: 1.0.
+mask       The pixels the layer covers. Default: All.
+
+Each layer renders into its own frame buffer. An animation that reports an unchanged frame (see
+animation.py) is not rendered again, and if nothing changed at all core1 skips compositing. When
+it does composite it goes over the pixels once, folding in all layers and the dimmer with
+integer arithmetic.
+'''
+
+import doorsign
+
+# Blend modes, computing the result for one channel from the one below (c) and the layer (t).
+NORMAL = 0   # t
+ADD = 1      # c + t
+MULTIPLY = 2 # c * t, darkens
+SCREEN = 3   # Inverse of multiplying the inverses, lightens
+LIGHTEN = 4  # The brighter of the two
+
+modes = ['normal', 'add', 'multiply', 'screen', 'lighten']
+
+class Layer:
+    __slots__ = ('animation', 'mode', 'alpha', 'pixels')
+
+    def __init__(self, animation, mode = 'normal', opacity = 1.0, mask = None):
+        if mode not in modes:
+            raise RuntimeError('Unknown blend mode ' + str(mode) + ' for layer ' + animation.name)
+
+        self.animation = animation
+        self.mode = modes.index(mode)
+
+        # Opacity per pixel as 0..255. 0 outside the mask.
+        alpha = doorsign.clamp(round(opacity * 255))
+        self.alpha = bytearray((alpha if (mask is None) or (i in mask) else 0) for i in range(doorsign.pixel_count))
+
+        self.pixels = doorsign.newFrame()
+
+    # Render the next frame of the layer's animation. Returns False if it did not change.
+    def render(self, frame_ms):
+        return self.animation.render(frame_ms, self.pixels)
+
+'''
+Combine one channel of the layer (t) with the one below (c) with opacity a.
+'''
+def blendChannel(mode, c, t, a):
+    if mode == ADD:
+        t = c + t
+        if t > 255:
+            t = 255
+    elif mode == MULTIPLY:
+        t = c * t // 255
+    elif mode == SCREEN:
+        t = 255 - (255 - c) * (255 - t) // 255
+    elif mode == LIGHTEN:
+        if c > t:
+            t = c
+
+    if a == 255:
+        return t
+    return c + (t - c) * a // 255
+
+'''
+Stack layers on top of the pixels in base, scale by dimmer and write the result into out.
+'''
+def composite(base, layers, dimmer, out):
+    scale = int(dimmer * 256)
+
+    for i in range(doorsign.pixel_count):
+        (r, g, b) = base[i]
+
+        for layer in layers:
+            a = layer.alpha[i]
+            if a:
+                mode = layer.mode
+                (tr, tg, tb) = layer.pixels[i]
+                r = blendChannel(mode, r, tr, a)
+                g = blendChannel(mode, g, tg, a)
+                b = blendChannel(mode, b, tb, a)
+
+        if scale != 256:
+            r = r * scale >> 8
+            g = g * scale >> 8
+            b = b * scale >> 8
+            if r > 255:
+                r = 255
+            if g > 255:
+                g = 255
+            if b > 255:
+                b = 255
+
+        out[i] = (r, g, b)
+
+    return out
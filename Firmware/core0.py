@@ -4,14 +4,14 @@ This implements the network task.
 Sets up WiFi as STA (Client) or AP (Access point) as _configured in _config.json
 
 If set up as AP also runs a DNS server to implement a captive portal. The implementation
-of that is right here and trivial.
+of that is in dnsserver.py.
 
 Then it starts a primitive web server also implemented here. The web server supports
 delivery of static resources and API endpoints all hardcoded.
 
 The network task controls the _onboard LED. When setting up the LED is on, when setup
-is completed sucessfully it turns off. If an error is encountered connecting in STA mode
-a code is blinked. 
+is completed sucessfully it turns off. In STA mode it is also on while the WiFi link is
+down and being reconnected, see wifi.py. On a configuration error a code is blinked.
 
 In operation the onboard LED turns on while network requests are being serviced.
 '''
@@ -21,22 +21,66 @@ import os
 import machine
 import network
 import ubinascii
+import errno
 import time
 import socket
 import select
 import ujson
+import gc
 import watchdog
-import struct
 import core1
 import logger
 import doorsign
+import ota
+import dnsserver
+import captiveportal
+import ntpclient
+import wifi
+import powersave
+import bootlog
+import sensors
+import doorbell
+import journal
+import crashlog
+import metrics
+import httptrace
+import profiler
 
 _onboard = machine.Pin('LED', machine.Pin.OUT)
 _myip = None
 _config = None
-_nextNTPSync = None
 _boot_ms = time.ticks_ms()
 
+_http_ok = metrics.counter('http_requests_total', 'HTTP requests answered, by class of the status code.', 'code="2xx"')
+_http_client_errors = metrics.counter('http_requests_total', 'HTTP requests answered, by class of the status code.', 'code="4xx"')
+_http_server_errors = metrics.counter('http_requests_total', 'HTTP requests answered, by class of the status code.', 'code="5xx"')
+_http_malformed = metrics.counter('http_malformed_total', 'HTTP requests too short to parse.')
+_http_sent = metrics.counter('http_sent_bytes_total', 'Bytes sent in HTTP responses.')
+_upload_bytes = metrics.counter('upload_bytes_total', 'Bytes written by file and bundle uploads.')
+
+# Kept by other modules, copied in by collectMetrics().
+_captive_probes = metrics.counter('captive_probes_total', 'Connectivity checks answered from memory.')
+_dns_queries = metrics.counter('dns_queries_total', 'DNS queries received.')
+_dns_ratelimited = metrics.counter('dns_ratelimited_total', 'DNS queries ignored because of the rate limit.')
+_ntp_syncs = metrics.counter('ntp_syncs_total', 'Successful syncs with the NTP server.')
+_ntp_failures = metrics.counter('ntp_failures_total', 'Failed syncs with the NTP server.')
+_wifi_losses = metrics.counter('wifi_losses_total', 'Times the WiFi link went down.')
+_frames = metrics.counter('frames_total', 'Frames rendered by the animation task.')
+_frame_overruns = metrics.counter('frame_overruns_total', 'Frames that took longer than the frame interval.')
+_frames_composited = metrics.counter('frames_composited_total', 'Frames that changed and had to be composited.')
+_gc_collections = metrics.counter('gc_collections_total', 'Garbage collections run deliberately in idle time.')
+_gc_auto_collections = metrics.counter('gc_auto_collections_total', 'Garbage collections the allocator had to run by itself.')
+_doorbell_presses = metrics.counter('doorbell_presses_total', 'Presses of the door bell.')
+_journal_records = metrics.counter('journal_records_total', 'Journal records written to flash.')
+_journal_dropped = metrics.counter('journal_dropped_total', 'Journal records lost because the buffer was full.')
+
+_uptime = metrics.gauge('uptime_seconds', 'Time since boot.')
+_mem_free = metrics.gauge('mem_free_bytes', 'Free heap.')
+_mem_alloc = metrics.gauge('mem_alloc_bytes', 'Allocated heap.')
+_fs_free = metrics.gauge('fs_free_bytes', 'Free space on the file system.')
+_dimmer = metrics.gauge('dimmer', 'Brightness of the animations, 0 to 1.')
+_ntp_synced = metrics.gauge('ntp_synced', '1 once the clock has been set by NTP.')
+
 def setup():
     global _config
     
@@ -45,6 +89,11 @@ def setup():
     with open('config.json') as fp:
         _config = ujson.load(fp)
     
+    bootlog.mark('config')
+    
+def config():
+    return _config
+
 '''
 When the task fails to make a connection it blinks an error code on the
 onboard LED
@@ -63,113 +112,12 @@ def fatalConnectionError(code, message):
     raise RuntimeError(message)    
 
 '''
-Single function to handle a DNS request.
-
-Packet decoding adapted from #https://stackoverflow.com/questions/65060776/reading-dns-packet-in-python
-
-We decode the request just for giggles. We don't even use it and always respond the same.
+Handle a DNS request. See dnsserver.py.
 '''
-
-OpCodeStrs = [
-        'QUERY', 
-        'IQUERY', 
-        'STATUS', 
-        '(reserved)', 
-        'NOTIFY', 
-        'UPDATE'
-]
-
-RCodeStrs = [
-    'No Error', 
-    'Format Error', 
-    'Server Failure', 
-    'Name Error', 
-    'Not Implemented', 
-    'Refused', 
-    'XY Domain', 
-    'XY RR Set', 
-    'NX RR Set', 
-    'Not Auth', 
-    'Not Zone'
-]
-    
 def handleDNS(socket):
     try:
         _onboard.on()
-
-        request, client = socket.recvfrom(1024) # Big enough for anyone?
-
-        # Decode DNS header.
-        l = len(request)
-        dnsDict = dict(
-            ID      = request[0]*256+request[1],
-            QR      = bool(request[2] & int('10000000', 2)),
-            Opcode  =     (request[2] & int('01111000', 2))>>3,            
-            AA      = bool(request[2] & int('00000100', 2)),
-            TC      = bool(request[2] & int('00000010', 2)),
-            RD      = bool(request[2] & int('00000001', 2)),
-            RA      = bool(request[3] & int('10000000', 2)),
-            Z       =     (request[3] & int('01110000', 2)),
-            RCode   =     (request[3] & int('00001111', 2)),
-            QDCOUNT = request[4]*256+request[5],
-            ANCOUNT = request[6]*256+request[7],
-            NSCOUNT = request[8]*256+request[9],
-            ARCOUNT = request[10]*256 + request[11],
-            # --
-            QTYPE   = request[l-4]*256+request[l-3],
-            QCLASS  = request[l-2]*256+request[l-2]
-        )
-
-        # Decode some values to strings.
-        OpCode = dnsDict['Opcode']
-        if (OpCode >= 0) and (OpCode < len(OpCodeStrs)):
-            dnsDict['OpcodeStr'] = OpCodeStrs[OpCode]
-        else:
-            dnsDict['OpcodeStr'] = str(OpCode) + '?'
-            
-        RCode = dnsDict['RCode']
-        if (RCode >= 0) and (RCode < len(RCodeStrs)):
-            dnsDict['RCodeStr'] = RCodeStrs[RCode]
-        else:
-            dnsDict['RCodeStr'] = str(RCode) + '?'
-
-        # Parse QNAME starting at byte #12.        
-        n = 12
-        qname = ''
-        
-        # Get field size.
-        argSize = int(request[n])
-        n += 1
-        
-        # Are there more fields?
-        while (argSize != 0) and (n < len(request)):
-            # Yes. Extract the substring and apped a period.
-            qname += request[n:n+argSize].decode() + '.'
-            n += argSize
-                
-            # Get next field size.
-            argSize = int(request[n])
-            n += 1
-            
-        dnsDict['QNAME'] = qname[:-1] # Chop off extra period we have added.
-
-        logger.write('DNS query for \"' + dnsDict['QNAME'] + '\" from ' + client[0])
-
-        # Build the response.
-        response = bytearray()
-        response = request[:2] 							# Request ID
-        response += b'\x81\x80' 						# Response flags
-        response += request[4:6] + request[4:6] 		# QD/AN count
-        response += b'\x00\x00\x00\x00' 				# NS/AR count
-        response += request[12:] 						# Original request body
-        response += b'\xC0\x0C' 						# Pointer to domain name at byte 12
-        response += b'\x00\x01\x00\x01' 				# Type and class (A record / IN class)
-        response += b'\x00\x00\x00\x3C' 				# Time to live 60 seconds
-        response += b'\x00\x04' 						# Response length (4 bytes = 1 ipv4 address)
-        response += bytes(map(int, _myip.split('.'))) 	# IP address parts
-        
-        # And deliver it.
-        socket.sendto(response, client)
+        dnsserver.handle(socket)
 
     except Exception as e:
         logger.write('Error handling DNS request ' + str(e))
@@ -177,6 +125,39 @@ def handleDNS(socket):
     finally:
         _onboard.off()
 
+'''
+Copy the values kept by other modules into their metrics before rendering them.
+'''
+def collectMetrics():
+    metrics.store(_captive_probes, captiveportal.total)
+    metrics.store(_dns_queries, dnsserver.queries)
+    metrics.store(_dns_ratelimited, dnsserver.ratelimited)
+    metrics.store(_ntp_syncs, ntpclient.syncs)
+    metrics.store(_ntp_failures, ntpclient.failures)
+    metrics.store(_wifi_losses, wifi.losses)
+    metrics.store(_frames, core1.frame_count)
+    metrics.store(_frame_overruns, core1.frame_overruns)
+    metrics.store(_frames_composited, core1.frames_composited)
+    metrics.store(_gc_collections, core1.gc_collections)
+    metrics.store(_gc_auto_collections, core1.gc_auto_collections)
+    metrics.store(_doorbell_presses, doorbell.presses)
+    metrics.store(_journal_records, journal.records)
+    metrics.store(_journal_dropped, journal.dropped)
+
+    metrics.setGauge(_uptime, time.ticks_diff(time.ticks_ms(), _boot_ms) // 1000)
+    metrics.setGauge(_mem_free, gc.mem_free())
+    metrics.setGauge(_mem_alloc, gc.mem_alloc())
+    metrics.setGauge(_fs_free, ota.fsStats()[1])
+    metrics.setGauge(_dimmer, core1.final_dimmer)
+    metrics.setGauge(_ntp_synced, 1 if ntpclient.synced else 0)
+
+'''
+Send data to the client, counting the bytes.
+'''
+def send(cl, data):
+    cl.sendall(data)
+    metrics.inc(_http_sent, len(data))
+
 '''
 Build a representation of the sensors and led settings
 '''
@@ -189,37 +170,319 @@ def pluralize(n, unit):
     else:
         return str(n) + ' ' + unit + 's '
 
-def apiData():
+'''
+Build the API data object. Pass a collection of field names to only compute those, or None for
+all of them.
+
+This does not lock out the animation task. Pixels are read from the snapshot core1 publishes at
+each frame boundary, everything else is either a simple reference or cached.
+'''
+_api_us = 0 # Time it took to build the last API data object.
+
+def apiData(fields = None):
+    global _api_us
+    
+    start_us = time.ticks_us()
     result = {}
     
-    doorsign.beginUpdate()
-    try:
-        # Get filesystem information.
-        v = os.statvfs('/')
-        size_bytes = v[1]*v[2]
-        free_bytes = v[0]*v[3]
-        
+    if (fields is None) or ('uptime' in fields):
         # Get uptime. May wrap around and give values that are too short.
         ticks = time.ticks_diff(time.ticks_ms(), _boot_ms)
         s, ms = divmod(ticks, 1000)
         m, s = divmod(s, 60)
         h, m = divmod(m, 60)
         d, h = divmod(h, 24)
-        
+    
         result['uptime'] = (pluralize(d, 'day') + pluralize(h, 'hour') + pluralize(m, 'minute') + pluralize(s, 'second')).strip()
+    
+    if (fields is None) or ('firmware_version' in fields):
         result['firmware_version'] = doorsign.firmware_version
+    
+    if (fields is None) or ('manual_control' in fields):
         result['manual_control'] = doorsign.manual_control
-        result['pixels'] = [{'R': p[0], 'G': p[1], 'B': p[2]} for p in doorsign.getPixels()]            
-        result['adc'] = doorsign.readADC()
-        result['animations'] = [a.__name__ for a in core1.animations]
-        result['active_animation'] = (core1.active_animation.__name__ if core1.active_animation else None);
-        result['size_bytes'] = size_bytes
-        result['free_bytes'] = free_bytes
-    finally:
-        doorsign.endUpdate()
+    
+    if (fields is None) or ('pixels' in fields):
+        # Under manual control core1 does not publish pixels. They are then set by us and can be
+        # read back directly.
+        pixels = core1.snapshot_pixels
+        if doorsign.manual_control or (pixels is None):
+            pixels = doorsign.getPixels()
+        result['pixels'] = [{'R': p[0], 'G': p[1], 'B': p[2]} for p in pixels]
+    
+    if (fields is None) or ('adc' in fields):
+        result['adc'] = sensors.values()
+    
+    if (fields is None) or ('animations' in fields):
+        result['animations'] = [a.name for a in core1.animations]
+    
+    if (fields is None) or ('active_animation' in fields):
+        active_animation = core1.active_animation
+        result['active_animation'] = (active_animation.name if active_animation else None)
+    
+    if (fields is None) or ('size_bytes' in fields) or ('free_bytes' in fields):
+        result['size_bytes'], result['free_bytes'] = ota.fsStats()
+    
+    if (fields is None) or ('frames' in fields):
+        result['frames'] = core1.frame_count
+        result['frame_overruns'] = core1.frame_overruns
+        result['frames_composited'] = core1.frames_composited
+        
+    if (fields is None) or ('sensors' in fields):
+        result['sensors'] = sensors.stats()
+        
+    if (fields is None) or ('doorbell' in fields):
+        result['doorbell'] = doorbell.stats()
+        
+    if (fields is None) or ('journal' in fields):
+        result['journal'] = journal.stats()
+        
+    if (fields is None) or ('http' in fields):
+        result['http'] = httptrace.stats()
+        
+    if (fields is None) or ('dns' in fields):
+        result['dns'] = dnsserver.stats()
+        
+    if (fields is None) or ('probes' in fields):
+        result['probes'] = captiveportal.stats()
+        
+    if (fields is None) or ('ntp' in fields):
+        result['ntp'] = ntpclient.stats()
+        
+    if (fields is None) or ('wifi' in fields):
+        result['wifi'] = wifi.stats()
+        
+    if (fields is None) or ('powersave' in fields):
+        result['powersave'] = powersave.stats()
+        
+    if (fields is None) or ('boot' in fields):
+        result['boot'] = bootlog.stats()
+        
+    if (fields is None) or ('heap' in fields):
+        result['heap'] = core1.heapStats()
+        
+    if (fields is None) or ('api_us' in fields):
+        result['api_us'] = _api_us # Reports the previous request, this one is not finished yet.
+    
+    _api_us = time.ticks_diff(time.ticks_us(), start_us)
     
     return result
 
+'''
+Parse the fields-parameter of an API request into a list of field names or None for all fields.
+'''
+def apiFields(params):
+    fields = params.get('fields', '')
+    if fields:
+        return fields.split(',')
+    else:
+        return None
+
+'''
+Parse a pixel index for the pixel API. Negative indices would wrap around, so anything outside
+0..pixel_count-1 is rejected.
+'''
+def parsePixelIndex(s):
+    i = int(s)
+    if (i < 0) or (i >= doorsign.pixel_count):
+        raise ValueError('Pixel index out of range: ' + s)
+    return i
+
+'''
+Compact pixel API. All operations of one request are applied inside a single
+beginUpdate()/endUpdate() pair so they show up atomically in one frame.
+
+Query parameters, applied in this order:
+  fill=rrggbb                 Set all pixels to one color.
+  (request body)              Raw pixel bytes, three per pixel (R, G, B), starting at pixel
+                              #offset (default 0). With format=hex the body is hex digits instead.
+  range=first-last&color=rrggbb  Set an inclusive range of pixels.
+  index=1,3,5,7&color=rrggbb  Set a list of pixels.
+  manual=0|1                  Explicitly en- or disable manual control.
+
+Setting any pixel data implies manual control. The response is the resulting pixel data
+in the same format as the request: raw bytes or, with format=hex, hex digits. An offset or
+index outside the pixels is a ValueError, nothing is changed then.
+'''
+def pixelsApi(method, params, body):
+    hexformat = params.get('format', '') == 'hex'
+    
+    if method == 'POST':
+        # Check all indices before touching any pixel.
+        offset = parsePixelIndex(params.get('offset', '0'))
+        if 'range' in params:
+            first, last = params['range'].split('-')
+            first = parsePixelIndex(first)
+            last = parsePixelIndex(last)
+            if first > last:
+                raise ValueError('Empty pixel range: ' + params['range'])
+        if 'index' in params:
+            indices = [parsePixelIndex(i) for i in params['index'].split(',')]
+        
+        doorsign.beginUpdate()
+        try:
+            pixels = doorsign.getPixels()
+            hasPixelData = False
+            
+            if 'fill' in params:
+                pixel = doorsign.parsePixel(params['fill'])
+                for i in range(doorsign.pixel_count):
+                    pixels[i] = pixel
+                hasPixelData = True
+                
+            if body:
+                if hexformat:
+                    body = ubinascii.unhexlify(body.strip())
+                if doorsign.unpackPixels(body, pixels, offset):
+                    hasPixelData = True
+            
+            if 'range' in params:
+                pixel = doorsign.parsePixel(params['color'])
+                for i in range(first, last + 1):
+                    pixels[i] = pixel
+                hasPixelData = True
+                
+            if 'index' in params:
+                pixel = doorsign.parsePixel(params['color'])
+                for i in indices:
+                    pixels[i] = pixel
+                hasPixelData = True
+            
+            if hasPixelData:
+                doorsign.setPixels(pixels)
+                doorsign.setManualControl(True)
+            elif 'manual' in params:
+                doorsign.setManualControl(params['manual'] in ['true', 'True', 'TRUE', '1'])
+        finally:
+            # End pixel update phase. This will send the data out to the LEDs.
+            doorsign.endUpdate()
+            
+    response = doorsign.packPixels(doorsign.getPixels())
+    
+    if hexformat:
+        return ubinascii.hexlify(response).decode(), 'text/plain'
+    else:
+        return response, 'application/octet-stream'
+
+'''
+The profile of the animation task, see profiler.py. POST to change it with these parameters:
+
+  enabled=0|1   Account for the time per stage and animation.
+  sampling=0|1  Sample the stage the animation task is in.
+  reset=1       Start over.
+
+The response is the profile.
+'''
+def profileApi(method, params):
+    if method == 'POST':
+        if 'enabled' in params:
+            enabled = params['enabled'] in ['true', 'True', 'TRUE', '1']
+        else:
+            enabled = profiler.enabled
+            
+        if 'sampling' in params:
+            profiler.enable(enabled, params['sampling'] in ['true', 'True', 'TRUE', '1'])
+        else:
+            profiler.enable(enabled)
+            
+        if params.get('reset') in ['true', 'True', 'TRUE', '1']:
+            profiler.reset()
+            
+    return ujson.dumps(profiler.stats())
+
+'''
+Read the complete body of a request given the part already received with the headers. Refuses
+bodies larger than maxlength.
+'''
+def readBody(cl, request_header, request_body, maxlength):
+    contentlength = extractHeader(request_header, b'Content-Length')
+    if not contentlength:
+        return request_body
+    
+    contentlength = int(contentlength)
+    if contentlength > maxlength:
+        raise RuntimeError('Request body too large')
+    
+    while len(request_body) < contentlength:
+        data = cl.recv(contentlength - len(request_body))
+        if not data:
+            break
+        request_body += data
+        
+    return request_body
+
+'''
+Wrap the body of an upload request in a reader for the ota module. If the client sends an
+X-Content-SHA256 or X-Content-CRC32 header (hex digits) the data will be checked against it.
+'''
+def bodyReader(cl, request_header, request_body):
+    return ota.BodyReader(
+        cl,
+        request_body,
+        int(extractHeader(request_header, b'Content-Length')),
+        extractHeader(request_header, b'X-Content-SHA256'),
+        extractHeader(request_header, b'X-Content-CRC32')
+    )
+
+'''
+Generate a directory listing as a JSON array of objects with name, type ('f' or 'd') and size
+in chunks so it can be streamed out without holding the complete list in memory. The caller
+parses the query parameters before, this only runs while the response is sent:
+
+  offset=n     Skip the first n entries.
+  limit=n      Return at most n entries.
+  recursive=1  Include the contents of subfolders. Their names are relative to the listed folder.
+'''
+def listingChunks(folder, offset, limit, recursive):
+    yield '['
+    
+    index = 0
+    count = 0
+    for name, type, size in ota.iterDir(folder, recursive):
+        if index >= offset:
+            if count == limit:
+                break
+            yield (',' if count else '') + ujson.dumps({'name': name, 'type': type, 'size': size})
+            count += 1
+        index += 1
+        
+    yield ']'
+
+'''
+Generate the JSON array of the files on the device with size and hash, see ota.manifest(), in
+chunks as the files are hashed.
+'''
+def manifestChunks():
+    yield '['
+    
+    count = 0
+    for entry in ota.manifest():
+        yield (',' if count else '') + ujson.dumps(entry)
+        count += 1
+        
+    yield ']'
+
+'''
+Generate the JSON array of journal events since since_s, in seconds like time.time(), and after
+sequence number after_seq. At most limit events, continue after the seq of the last one. Parse
+the parameters before, this only runs while the response is sent.
+'''
+def eventChunks(since_s, after_seq, limit):
+    yield '['
+    
+    count = 0
+    for seq, time_s, uptime_ms, type, arg, value in journal.query(since_s, limit, after_seq):
+        yield (',' if count else '') + ujson.dumps({
+            'seq': seq,
+            'time': time_s,
+            'uptime_ms': uptime_ms,
+            'type': journal.names.get(type, type),
+            'arg': arg,
+            'value': value
+        })
+        count += 1
+        
+    yield ']'
+
 def extractHeader(data, header):
     search = b'\r\n' + header + b': '
     headerpos = data.find(search)
@@ -243,11 +506,23 @@ This function implements the complete handling of a http request.
 def handleHttp(socket):
     _onboard.on()
     try:
+        httptrace.begin()
         cl, addr = socket.accept()    
-        logger.write('Client connected from '+ str(addr))
+        httptrace.phase(httptrace.ACCEPT)
         
         cl.settimeout(10)
         request_data = cl.recv(1024) # Only read this much data. We don't care if they send any more.
+        httptrace.phase(httptrace.RECV)
+        
+        # Connectivity checks from clients of our AP are answered from memory without further ado.
+        probe_response = captiveportal.response(request_data)
+        if probe_response:
+            send(cl, probe_response)
+            cl.close()
+            httptrace.end(httptrace.SEND, 'probe')
+            return
+        
+        logger.write('Client connected from '+ str(addr))
         
         # Minimal sanity-check.
         if len(request_data) > 6:
@@ -257,6 +532,7 @@ def handleHttp(socket):
             resource = None
             response = None
             responsefilesize = None 
+            responsechunks = None
 
             try:
                 # Split the request into headers and body.
@@ -315,6 +591,8 @@ def handleHttp(socket):
                     contenttype = 'text/javascript'
                 else:
                     contenttype = 'application/octet-stream'
+                
+                httptrace.phase(httptrace.PARSE)
         
                 if (method == 'GET') or (method == 'HEAD'):        
                     # GET or HEAD: First test for the special endpoints that implement the
@@ -322,12 +600,44 @@ def handleHttp(socket):
 
                     if resource == '/api':
                         # Return sensor data and LED status.
-                        response = ujson.dumps(apiData())
+                        response = ujson.dumps(apiData(apiFields(params)))
                         contenttype = 'application/json'            
                         
+                    elif resource == '/api/pixels':
+                        # Return the raw pixel data.
+                        response, contenttype = pixelsApi(method, params, None)
+                        
+                    elif resource == '/api/events':
+                        # Events from the journal, paged by sequence number.
+                        responsechunks = eventChunks(int(params.get('since', 0)), int(params.get('after', -1)), int(params.get('limit', 100)))
+                        contenttype = 'application/json'
+                        
+                    elif resource == '/api/profile':
+                        # Profile of the animation task.
+                        response = profileApi(method, params)
+                        contenttype = 'application/json'
+                        
+                    elif resource == '/api/crashes':
+                        # Crash and reset records.
+                        response = ujson.dumps(crashlog.records())
+                        contenttype = 'application/json'
+                        
+                    elif resource == '/metrics':
+                        # Everything in metrics.py for Prometheus to scrape.
+                        collectMetrics()
+                        responsechunks = metrics.chunks()
+                        contenttype = 'text/plain; version=0.0.4'
+                        
+                    elif resource == '/manifest':
+                        # List all files with size and hash for the host-side update tool.
+                        responsechunks = manifestChunks()
+                        contenttype = 'application/json'
+                        
                     elif resource.endswith('/'):
-                        # List directory.
-                        response = ujson.dumps(os.listdir('/www/' + resource))
+                        # List directory. Stat it first so a missing folder produces a 404 before
+                        # we start sending.
+                        os.stat('/www/' + resource)
+                        responsechunks = listingChunks('/www/' + resource, int(params.get('offset', 0)), int(params.get('limit', -1)), params.get('recursive', '') in ['true', 'True', 'TRUE', '1'])
                         contenttype = 'application/json'
                         
                     else:   
@@ -340,8 +650,12 @@ def handleHttp(socket):
                     statustext = 'OK'
             
                 elif method == 'DELETE':
-                    # DELETE: Just attempt it and face the consequences.
-                    os.remove('/www/' + resource)
+                    if resource == '/api/crashes':
+                        crashlog.clear()
+                    else:
+                        # DELETE: Just attempt it and face the consequences.
+                        os.remove('/www/' + resource)
+                        ota.invalidateFSStats()
                     
                     statuscode = 200
                     statustext = 'OK'
@@ -353,6 +667,8 @@ def handleHttp(socket):
                     if resource == '/reset':
                         # Well. This will not even produce a http result, just hit itself 
                         # over the head with a hammer right now.
+                        journal.log(journal.RESET)
+                        journal.flush()
                         machine.reset()
 
                     elif resource == '/animation':
@@ -361,12 +677,37 @@ def handleHttp(socket):
                         core1.request_animation = params.get('name', '')
                         
                         # Build response                                 
-                        response = ujson.dumps([a.__name__ for a in core1.animations])
+                        response = ujson.dumps([a.name for a in core1.animations])
                         
                         contenttype = 'application/json'            
                         statuscode = 200
                         statustext = 'OK'
                         
+                    elif resource == '/bundle':
+                        # Many files in one tar archive, applied all or nothing.
+                        files, written, ms = ota.receiveBundle(bodyReader(cl, request_header, request_body))
+                        metrics.inc(_upload_bytes, written)
+                        
+                        statuscode = 200
+                        statustext = 'OK (' + str(files) + ' files, ' + str(written) + ' bytes written in ' + str(ms) + ' ms)'
+                        
+                    elif resource == '/api/profile':
+                        # Switch profiling the animation task on or off.
+                        response = profileApi(method, params)
+                        
+                        contenttype = 'application/json'
+                        statuscode = 200
+                        statustext = 'OK'
+                        
+                    elif resource == '/api/pixels':
+                        # Compact pixel update. The body is at most a hex-encoded full frame, give or
+                        # take a line break.
+                        request_body = readBody(cl, request_header, request_body, 6 * doorsign.pixel_count + 4)
+                        response, contenttype = pixelsApi(method, params, request_body)
+                        
+                        statuscode = 200
+                        statustext = 'OK'
+                        
                     elif resource == '/api':
                         # Read each pixel and update if there is data for that channel.
                         hasChannelData = False
@@ -399,11 +740,11 @@ def handleHttp(socket):
                             if hasChannelData:
                                 doorsign.setManualControl(True)
                         
-                        # Build response                                 
-                        response = ujson.dumps(apiData())
+                            # End pixel update phase. This will send the data out to the LEDs.
+                            doorsign.endUpdate()                    
                         
-                        # End pixel update phase. This will send the data out to the LEDs.
-                        doorsign.endUpdate()                    
+                        # Build response                                 
+                        response = ujson.dumps(apiData(apiFields(params)))
 
                         contenttype = 'application/json'            
                         statuscode = 200
@@ -413,25 +754,11 @@ def handleHttp(socket):
                         # the filename is simply the resource POSTed to and the data is the whole
                         # body of the request.
                         
-                        contentlength = int(extractHeader(request_header, b'Content-Length'))
+                        written, ms = ota.receiveFile(bodyReader(cl, request_header, request_body), '/www/' + resource)
+                        metrics.inc(_upload_bytes, written)
                         
-                        written = 0
-                        with open('/www/' + resource, "wb") as dest:                            
-                            # We have only received the start of the data when we looked at the
-                            # request. Save and read and save and read the rest...
-                            while True:
-                                dest.write(request_body)
-
-                                written += len(request_body)
-                                if written >= contentlength:
-                                    break
-                            
-                                request_body = cl.recv(2048)
-                                if not request_body:
-                                    time.sleep(0.1)
-                            
                         statuscode = 200
-                        statustext = 'OK (' + str(written) + ' bytes written to \"' + resource + '\")' 
+                        statustext = 'OK (' + str(written) + ' bytes written to \"' + resource + '\" in ' + str(ms) + ' ms, ' + str(written // max(ms, 1)) + ' KB/s)' 
                 else:
                     raise RuntimeError('Unsupported http-method: \"' + method + '\"')
                                                     
@@ -450,6 +777,12 @@ def handleHttp(socket):
                     statuscode = 500
                     statustext = 'Internal Server Error (' + str(e) + ')'
                             
+            except ValueError as e:
+                # Malformed parameters or body.
+                response = ''
+                statuscode = 400
+                statustext = 'Bad Request (' + str(e) + ')'
+                
             except Exception as e:
                 response = ''
                 statuscode = 500
@@ -468,36 +801,74 @@ def handleHttp(socket):
                     contentlength = None
 
                 # Print something resembling common log format.
+                if statuscode >= 500:
+                    metrics.inc(_http_server_errors)
+                elif statuscode >= 400:
+                    metrics.inc(_http_client_errors)
+                else:
+                    metrics.inc(_http_ok)
+                
                 logger.write(addr[0] + ' ' + method + ' \"' + resource + (('?' + paramstr) if paramstr else '') + '\" ' + str(statuscode) + ' ' + statustext + ((' (' + str(contentlength) + ' bytes of ' + contenttype + ')') if contentlength else '')) 
+                httptrace.phase(httptrace.HANDLE)
                 
                 # Send http header with status.
-                cl.sendall('HTTP/1.0 ' + str(statuscode) + ' ' + statustext)
+                send(cl, 'HTTP/1.0 ' + str(statuscode) + ' ' + statustext)
                 
                 if contentlength:
-                    cl.sendall('\r\nContent-Length: ' + str(contentlength) + '\r\nContent-Type: ' + contenttype)
+                    send(cl, '\r\nContent-Length: ' + str(contentlength) + '\r\nContent-Type: ' + contenttype)
+                elif responsechunks:
+                    # Length unknown. The end of the body is marked by closing the connection.
+                    send(cl, '\r\nContent-Type: ' + contenttype)
                 
-                cl.sendall('\r\n\r\n')
+                send(cl, '\r\n\r\n')
                     
                 # Send body.
                 if method != 'HEAD': # HEAD: The server MUST NOT return a content-body
                     if responsefilesize:
                         # Open file and send it in chunks.
+                        httptrace.phase(httptrace.SEND)
                         with open('/www/' + resource, 'rb') as f:
                             while True:
                                 buf = f.read(2048)
+                                httptrace.phase(httptrace.READ)
                                 if not buf:
                                     # No more bytes read. We are done.
                                     break
-                                cl.sendall(buf)
+                                send(cl, buf)
+                                httptrace.phase(httptrace.SEND)
                                 
                     elif response:
                         # Just answer with the prepared content.
-                        cl.sendall(response)
+                        send(cl, response)
+                    
+                    elif responsechunks:
+                        # Send generated content as it is produced, collected into packets of
+                        # a reasonable size.
+                        # Producing the chunks counts as handling the request. The header is
+                        # out, so if this fails all we can do is drop the connection.
+                        httptrace.phase(httptrace.SEND)
+                        try:
+                            buf = ''
+                            for chunk in responsechunks:
+                                buf += chunk
+                                if len(buf) >= 1024:
+                                    httptrace.phase(httptrace.HANDLE)
+                                    send(cl, buf)
+                                    httptrace.phase(httptrace.SEND)
+                                    buf = ''
+                            if buf:
+                                httptrace.phase(httptrace.HANDLE)
+                                send(cl, buf)
+                        except Exception as e:
+                            logger.write('Error sending response, dropping connection (' + str(e) + ')')
                 
                 cl.close()
+                httptrace.end(httptrace.SEND, httptrace.classify(method, resource), method, resource, statuscode)
                 logger.write('Connection closed')
         else:
             cl.close()
+            httptrace.end(httptrace.RECV, 'other')
+            metrics.inc(_http_malformed)
             logger.write('Mutilated request')
 
     finally:
@@ -505,74 +876,50 @@ def handleHttp(socket):
 
     # End of handleHttp()
 
-def syncNTP():
-    global _nextNTPSync
-    
-    # We can only query the NTP server if we are a WIFI client (STA)
-    # and a ntp host is _configured. Otherwise this is a NOP.
-    if not (('STA' in _config) and ('ntpserver' in _config['STA'])):
-        return
-
-    logger.write('Syncing RTC with network time')
-        
-    '''
-    At its most basic, the NTP protocol is a clock request transaction, where a client requests the current time from a server,
-    passing its own time with the request. The server adds its time to the data packet and passes the packet back to the client.
-    When the client receives the packet, the client can derive two essential pieces of information: the reference time at the
-    server and the elapsed time, as measured by the local clock, for a signal to pass from the client to the server and back again.
-    Repeated iterations of this procedure allow the local client to remove the effects of network jitter and thereby gain a
-    stable value for the delay between the local clock and the reference clock standard at the server. This value can then be
-    used to adjust the local clock so that it is synchronized with the server. Further iterations of this protocol exchange
-    can allow the local client to continuously correct the local clock to address local clock skew.
-    
-    ...
-    
-    Nah, we'll just send an emtpy request and pick the time out of the respone. Fair?
-    '''
-    
-    ntpserver = _config['STA']['ntpserver']
-    
-    NTP_DELTA = 2208988800
-    
-    request = bytearray(48)
-    request[0] = 0x1B
+'''
+Set up the server sockets. Returns the http and dns sockets, dns is None if not in AP mode.
+'''
+def openServers():
+    dns = None
     
-    _onboard.on()
-            
-    addr = socket.getaddrinfo(ntpserver, 123)[0][-1]
-    ntp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        # Send request and read response.
-        ntp.sendto(request, addr)
-        response = ntp.recv(48)
-        
-        # Decode response from packet and decompose into a time tuple.
-        ntp_time = struct.unpack("!I", response[40:44])[0]        
-        tm = time.gmtime(ntp_time - NTP_DELTA)
+    if 'AP' in _config:
+        # Set up DNS server socket for captive portal.
+        dnsserver.setup(_myip)
+        captiveportal.setup(_myip, _config['AP'].get('probes', 'portal'))
         
-        # Update RTC
-        rtc = machine.RTC()
-        rtc.datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+        addr = socket.getaddrinfo('0.0.0.0', 53, 0, socket.SOCK_DGRAM)[0][-1]
 
-        # Schedule the next sync in 24 hours.
-        _nextNTPSync = time.ticks_add(time.ticks_ms(), 1000 * 60 * 60 * 24)
-        
-        logger.write('RTC synced with network time')
+        dns = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        dns.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        dns.setblocking(False)
     
-    except Exception as e:
-        logger.write('Error requesting network time from ' + ntpserver + ' (' + str(e) + ')')
+        dns.bind(addr)
         
-        # Schedule the next sync using the RTC alarm.
-        _nextNTPSync = time.ticks_add(time.ticks_ms(), 1000 * 60)
+        logger.write('DNS server listening on ' + str(addr))
         
-    finally:
-        _onboard.off()
-        ntp.close()
+    # Set up HTTP server socket.
+    addr = socket.getaddrinfo('0.0.0.0', 80)[0][-1]
+
+    http = socket.socket()
+    http.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    http.bind(addr)
+    http.listen(1)
+
+    logger.write('Http server listening on ' + str(addr))
     
+    return http, dns
+
+def closeServers(http, dns):
+    for s in (http, dns):
+        if s:
+            try:
+                s.close()
+            except OSError:
+                pass
+
 def task():
 
     global _myip
-    global _nextNTPSync
     
     logger.register_thread_name('NET ')
     watchdog.feed() # First feed to make us known to the WDT
@@ -591,9 +938,9 @@ def task():
         wlan = network.WLAN(network.AP_IF)
         #wlan._config(security = 3)
         #wlan._config(authmode = 3)
-        wlan._config(essid = _config['AP']['essid'])
+        wlan.config(essid = _config['AP']['essid'])
         if _config['AP']['pw']:
-            wlan._config(password = _config['AP']['pw'])
+            wlan.config(password = _config['AP']['pw'])
     else:
         _onboard.off()
         logger.write('Neither STA nor AP defined in _config. Network is done.')
@@ -604,8 +951,12 @@ def task():
 
     # logger.write(str(wlan.scan()))
         
-    # Disable power-saving because this is a server
-    wlan.config(pm = 0xa11140)
+    if 'STA' in _config:
+        # Power-saving is off while we are serving requests and turned on when idle.
+        powersave.setup(wlan, _config['STA'].get('powersave_idle_s', 300))
+    else:
+        # Disable power-saving because this is a server
+        wlan.config(pm = powersave.PM_PERFORMANCE)
 
     logger.write('MAC = ' + ubinascii.hexlify(network.WLAN().config('mac'),':').decode())
 
@@ -624,97 +975,84 @@ def task():
             time.sleep(1)
         
     if 'STA' in _config:
-        logger.write('Connecting to: ' + _config['STA']['ssid'] + (' /w password' if _config['STA']['pw'] else ''))
-
-        wlan.connect(_config['STA']['ssid'], _config['STA']['pw'])
-
-        # Wait for connection with 10 second timeout
-        timeout = 100
-        while timeout > 0:
-            if wlan.status() < 0 or wlan.status() >= 3:
-                break
-            timeout -= 1
-            logger.write('Waiting for connection...')
-            time.sleep(1)
-            watchdog.feed()
-            
-        _onboard.off()
-            
-        # Handle connection error
-        # Error meanings
-        # 0  Link Down
-        # 1  Link Join
-        # 2  Link NoIp
-        # 3  Link Up
-        # -1 Link Fail
-        # -2 Link NoNet
-        # -3 Link BadAuth
-
-        if wlan.status() != 3:
-            fatalConnectionError(4, 'Wi-Fi connection failed status = ' + str(wlan.status()))
-        else:
-            _onboard.off()
-            logger.write('Connected')
-            
-            syncNTP()
-            
-    else:
-        # Immediately ready as AP. Indicate by turning off _onboard-LED.
-        _onboard.off()
-
-    try:
-        # Where am I?
-        _myip = wlan.ifconfig()[0]
-        logger.write('IP = ' + _myip)
-        
-        inputsockets = []
-        
-        http = None
-        dns = None
+        # Connecting happens in the background, see wifi.py.
+        wifi.setup(wlan, _config['STA']['ssid'], _config['STA']['pw'])
         
+    http = None
+    dns = None
+    
+    try:
         if 'AP' in _config:
-            # Set up DNS server socket for captive portal.
-            addr = socket.getaddrinfo('0.0.0.0', 53, 0, socket.SOCK_DGRAM)[0][-1]
-
-            dns = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            dns.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            dns.setblocking(False)
-        
-            dns.bind(addr)
+            # Immediately ready as AP. Indicate by turning off _onboard-LED.
+            _onboard.off()
             
-            inputsockets.append(dns)
-
-            logger.write('DNS server listening on ' + str(addr))
+            # Where am I?
+            _myip = wlan.ifconfig()[0]
+            logger.write('IP = ' + _myip)
             
-        # Set up HTTP server socket.
-        addr = socket.getaddrinfo('0.0.0.0', 80)[0][-1]
-
-        http = socket.socket()
-        http.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        http.bind(addr)
-        http.listen(1)
-
-        inputsockets.append(http)
-
-        logger.write('Http server listening on ' + str(addr))
+            http, dns = openServers()
+            bootlog.mark('wifi')
         
         # Main loop: Wait for connections and service them.
         while True:
             watchdog.feed()
+            
+            # Follow the state of the link in STA mode. The servers are set up fresh each time it
+            # comes up.
+            event = wifi.poll()
+            if event == wifi.UP:
+                _onboard.off()
+                bootlog.mark('wifi')
+                journal.log(journal.WIFI_UP)
+                
+                _myip = wlan.ifconfig()[0]
+                logger.write('IP = ' + _myip)
+                
+                closeServers(http, dns)
+                http, dns = openServers()
+                
+                # We can only query the NTP server if we are a WIFI client (STA)
+                # and a ntp host is configured.
+                if 'ntpserver' in _config['STA']:
+                    ntpclient.start(_config['STA']['ntpserver'])
+                    
+            elif event == wifi.DOWN:
+                _onboard.on()
+                journal.log(journal.WIFI_DOWN, 0, wifi.last_status)
+                
+                closeServers(http, dns)
+                http = None
+                dns = None
+                ntpclient.stop()
 
-            if _nextNTPSync and (time.ticks_diff(_nextNTPSync, time.ticks_ms())) <= 0:
-                syncNTP()
+            powersave.poll()
+            journal.poll()
+            
+            # The NTP client only has a socket while waiting for an answer.
+            ntp = ntpclient.poll()
+            
+            inputsockets = [s for s in (http, dns, ntp) if s]
+            if not inputsockets:
+                # Nothing to serve while the link is down.
+                time.sleep_ms(200)
+                continue
             
             readable, writeable, errored = select.select(inputsockets, [], [], 1)
             
             for s in readable:
                 if (s is http):
+                    powersave.activity()
                     handleHttp(s)
                 elif (s is dns):
+                    powersave.activity()
                     handleDNS(s)
+                elif (s is ntp):
+                    ntpclient.receive()
                 else:
                     raise RuntimeError('select() returned unknown readable socket')    
     finally:
+        closeServers(http, dns)
+        
         if wlan.isconnected():
             logger.write('Disconnecting')
             wlan.disconnect()
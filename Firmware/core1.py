@@ -1,8 +1,9 @@
 '''
 This module implements the animation task.
 
-It loads all modules named animation_*.py found in the current folder and checks their enabled-value. If
-enabled the animation is added to a pool of available animations.
+It finds all modules named animation_*.py and keyframe files named animation_*.json (see keyframes.py)
+in the current folder and reads their enabled-value from the source. If enabled the animation is added to a pool of available animations. Modules are only imported
+while they are active or about to become active and are unloaded afterwards to free their memory.
 
 If there aren't any enabled animations the task ends. Otherwise one is selected at random as the active
 animation.
@@ -11,6 +12,11 @@ If there are two or more animations enabled the task will after a while select a
 the pool and blend between the two.
 
 Care is taken that all enabled animations are used and never back-to-back.
+
+Additional animations can be stacked on top as layers, see compositor.py. When the door bell rings
+a ring animation goes on top of everything for a while, see doorbell.py.
+
+What each stage of a frame and each animation costs can be profiled at runtime, see profiler.py.
 '''
 
 preferred_animation_blend_ms = 60 * 1000 # Blend time between animations. It may turn out shorter if an animation requests to be runs for a short time. 
@@ -19,7 +25,7 @@ preferred_animation_blend_ms = 60 * 1000 # Blend time between animations. It may
 # possible moment or set to the name of an animation to run next.
 request_animation = None 
 
-final_dimmer = 1.0
+final_dimmer = 1.0 # Set by sensors.py if dimming automatically with ambient light.
 
 import machine
 import time
@@ -28,33 +34,156 @@ import doorsign
 import random
 import os
 import watchdog
+import bootlog
+import animation
+import compositor
+import sensors
+import doorbell
+import journal
+import metrics
+import profiler
+import gc
 
 animations = []
 active_animation = None
+layers = [] # compositor.Layer, bottom to top.
+ring_layer = None # Put on top of the layers while the door bell rings.
+
+# State published at each frame boundary so the network task can read it without
+# locking us out. snapshot_pixels is only updated while not under manual control.
+# It is one of two output frame buffers used alternately, the next frame is rendered
+# into the other one.
+snapshot_pixels = None
+frame_count = 0
+frame_overruns = 0 # Frames that took longer than doorsign.frame_intervall_ms.
+frames_composited = 0 # Frames that changed and had to be composited. The others are copies.
+
+# Garbage collection. Instead of waiting for the allocator to run out of memory at some random
+# point, possibly in the middle of a frame, we collect deliberately in the idle remainder of a
+# frame once enough has been allocated since the last collection.
+gc_after_bytes = 16 * 1024 # Collect once this much has been allocated since the last collection...
+gc_min_idle_ms = 10 # ...and there is at least this much time left in the frame.
+
+sensors_min_idle_ms = 2 # Sample the sensors if there is at least this much time left in the frame.
+
+_frame_busy = metrics.histogram('frame_busy_ms', 'Time each frame took to render and output, before the idle work.', (5, 10, 20, 30, 40, 60, 100))
 
+# Heap statistics.
+heap_alloc_frame = 0 # Bytes allocated during the last frame.
+heap_alloc_frame_max = 0
+gc_collections = 0 # Collections we ran deliberately.
+gc_pause_us_max = 0 # Longest of those.
+gc_auto_collections = 0 # Collections we did not run here. Detected by mem_alloc() going down.
+gc_auto_frame_ms_max = 0 # Longest frame with an automatic collection in it.
+
+'''
+Heap and garbage collection statistics for the API.
 '''
-Set up the animations by dynamically loading modules according to a naming convention
+def heapStats():
+    return {
+        'mem_free': gc.mem_free(),
+        'mem_alloc': gc.mem_alloc(),
+        'alloc_frame': heap_alloc_frame,
+        'alloc_frame_max': heap_alloc_frame_max,
+        'collections': gc_collections,
+        'pause_us_max': gc_pause_us_max,
+        'auto_collections': gc_auto_collections,
+        'auto_frame_ms_max': gc_auto_frame_ms_max
+    }
+
 '''
-def setup():
+Unload all animation modules except the active and next ones to free their memory.
+'''
+def unloadInactive(active_animation, next_animation):
+    unloaded = False
+    for a in animations:
+        if a.loaded() and (a is not active_animation) and (a is not next_animation):
+            a.unload()
+            unloaded = True
+    
+    if unloaded:
+        before = gc.mem_free()
+        gc.collect()
+        logger.write('Unloaded inactive animations, ' + str(gc.mem_free() - before) + ' bytes freed, ' + str(gc.mem_free()) + ' free')
+
+'''
+Set up the animations by dynamically loading modules according to a naming convention, and
+the layers on top of them from their configuration, the LAYERS section of config.json.
+'''
+def setup(layerconfig = []):
     global animations
+    global layers
+    global ring_layer
+    
+    # Find all modules named animation_*.py and keyframe files named animation_*.json:
+    # List files, filter by name, read their configuration without importing them and finally filter by their enabled variable.
+    # The modules are imported only when they are scheduled, see animation.Animation.
+    logger.write('Reading animation modules')
+    # An animation can be there as a module and a keyframe file with the same name, when it was
+    # ported to keyframes and the old module is still on the doorsign: Updates don't delete files.
+    # The keyframe file wins.
+    animationfiles = []
+    for filename in filter(animation.isAnimationFile, os.listdir()):
+        name = filename.split('.')[0]
+        for i in range(len(animationfiles)):
+            if animationfiles[i].split('.')[0] == name:
+                if animation.isKeyframeFile(filename):
+                    logger.write('Ignoring ' + animationfiles[i] + ', superseded by ' + filename)
+                    animationfiles[i] = filename
+                else:
+                    logger.write('Ignoring ' + filename + ', superseded by ' + animationfiles[i])
+                break
+        else:
+            animationfiles.append(filename)
+    
+    animations = list(map(animation.Animation.fromFile, animationfiles))
+    profiler.setup([a.name for a in animations])
+    
+    # Layers can use any animation, enabled or not. Each gets its own instance so it can run
+    # alongside the same animation scheduled below.
+    layers = []
+    for spec in layerconfig:
+        for a in animations:
+            if a.name == spec.get('animation'):
+                layers.append(compositor.Layer(animation.Animation(a.name, True, a.preferred_duration_ms, a.filename), spec.get('mode', 'normal'), spec.get('opacity', 1.0), spec.get('mask')))
+                logger.write('Layer ' + str(len(layers)) + ': ' + a.name)
+                break
+        else:
+            logger.write('Layer animation \"' + str(spec.get('animation')) + '\" not found')
+    
+    ring_layer = None
+    if doorbell.animation_name:
+        for a in animations:
+            if a.name == doorbell.animation_name:
+                ring_layer = compositor.Layer(animation.Animation(a.name, True, a.preferred_duration_ms, a.filename))
+                break
+        else:
+            logger.write('Door bell animation \"' + doorbell.animation_name + '\" not found')
     
-    # Import all modules named animation_*.py:
-    # List files, filter by name, strip off the .py extension, load as module and finally filter by their enabled variable.
-    logger.write('Loading animation modules')
-    animationfiles = filter(lambda file: file.startswith('animation_') and file.endswith('.py'), os.listdir())        
-    modulenames = list(map(lambda file: file.split('.')[0], animationfiles))
-    animations = list(map(__import__, modulenames))        
     animations = list(filter(lambda animation: animation.enabled, animations))
     
+    bootlog.mark('animations')
+    
     if len(animations) == 0:
         logger.write('No animations available')
         return
     elif len(animations) > 1:
-        logger.write('Available animations: ' + ', '.join(animation.__name__ for animation in animations))
+        logger.write('Available animations: ' + ', '.join(animation.name for animation in animations))
     
 def task():
     global active_animation
     global request_animation
+    global final_dimmer
+    global snapshot_pixels
+    global frame_count
+    global frame_overruns
+    global frames_composited
+    global heap_alloc_frame
+    global heap_alloc_frame_max
+    global gc_collections
+    global gc_pause_us_max
+    global gc_auto_collections
+    global gc_auto_frame_ms_max
      
     logger.register_thread_name('ANIM')
     watchdog.feed() # First feed to make us known to the WDT
@@ -84,12 +213,28 @@ def task():
             old_animations = []
         active_animation_start_ms = time.ticks_ms()
         
-        logger.write(('First' if len(animations) > 1 else 'Active') + ' animation: ' + active_animation.__name__)
+        logger.write(('First' if len(animations) > 1 else 'Active') + ' animation: ' + active_animation.name)
     else:
         logger.write('No animation module enabled')
         
     next_animation = None
 
+    # Frame buffers for the animations to render into, allocated once. See animation.Animation.
+    active_pixels = doorsign.newFrame()
+    next_pixels = doorsign.newFrame()
+    blend_pixels = doorsign.newFrame()
+    black_pixels = doorsign.newFrame()
+    output_pixels = [doorsign.newFrame(), doorsign.newFrame()]
+    composited_dimmer = None # final_dimmer at the last composite. None to force one.
+
+    ring_until_ms = None # Ringing until then.
+    ring_edge_us = None # Edge of the press until its first frame is out.
+
+    # Start with a clean heap.
+    gc.collect()
+    last_alloc = gc.mem_alloc()
+    alloc_since_gc = 0
+    
     '''
     Main animation loop
     '''
@@ -98,6 +243,24 @@ def task():
 
         frame_ms = time.ticks_ms()
         
+        profiling = profiler.enabled or profiler.sampling
+        if profiling:
+            profiler.enter(profiler.SCHEDULE)
+        
+        # Door bell? Put the ring animation on top right away, or take it off when it's done.
+        restacked = False
+        pressed_us = doorbell.poll()
+        if (pressed_us is not None) and ring_layer:
+            ring_layer.animation.restart()
+            if ring_layer not in layers:
+                layers.append(ring_layer)
+            ring_until_ms = time.ticks_add(frame_ms, doorbell.duration_ms)
+            ring_edge_us = pressed_us
+        elif (ring_until_ms is not None) and (time.ticks_diff(frame_ms, ring_until_ms) >= 0):
+            layers.remove(ring_layer)
+            ring_until_ms = None
+            restacked = True
+        
         if (active_animation):
             
             # Is there a requested for an animation switch? If so execute it immediately. 
@@ -117,7 +280,7 @@ def task():
                 else:
                     # Pick the next animation by name.
                     for animation in animations:
-                        if animation.__name__.upper() == request_animation.upper():
+                        if animation.name.upper() == request_animation.upper():
                             candidate_animation = animation
                             break
                     if not candidate_animation:
@@ -133,6 +296,7 @@ def task():
                         doorsign.endUpdate()
                         
                     active_animation_start_ms = frame_ms
+                    active_animation.restart()
                     next_animation = None
                     
                     if active_animation in new_animations:
@@ -143,7 +307,9 @@ def task():
                             old_animations = []
                     doorsign.setManualControl(False)
             
-                    logger.write('Switching to ' + ('random ' if not request_animation else '') + 'requested ' + active_animation.__name__)
+                    logger.write('Switching to ' + ('random ' if not request_animation else '') + 'requested ' + active_animation.name)
+                    journal.log(journal.ANIMATION, animations.index(active_animation))
+                    unloadInactive(active_animation, next_animation)
                 else:
                     logger.write('Could not honour request for ' + ('random ' if request_animation == '' else '') + 'next animation ' + request_animation)
                     
@@ -151,12 +317,21 @@ def task():
                 request_animation = None                    
             
             # Get the pixels for the active animation.
-            active_pixels = active_animation.update(frame_ms)
+            if profiling:
+                profiler.enter(profiler.RENDER, active_animation.name)
+            changed = active_animation.render(frame_ms, active_pixels)
+            if profiling:
+                profiler.enter(profiler.SCHEDULE)
     
             # Are we running a next animation?
             if (next_animation):
                 # Yes. Get their pixels.
-                next_pixels = next_animation.update(frame_ms)
+                if profiling:
+                    profiler.enter(profiler.RENDER, next_animation.name)
+                next_animation.render(frame_ms, next_pixels)
+                changed = True
+                if profiling:
+                    profiler.enter(profiler.SCHEDULE)
             
                 # Blend between the two animations in interval milliseconds
                 diff = time.ticks_diff(frame_ms, next_animation_start_ms)
@@ -175,12 +350,20 @@ def task():
                         
                     active_animation_start_ms = frame_ms
                     next_animation = None
+                    unloadInactive(active_animation, next_animation)
+                    journal.log(journal.ANIMATION, animations.index(active_animation))
 
-                    # Use the pixels of the next animation directly.
+                    # Use the pixels of the next animation directly. From now on they
+                    # are the active pixels.
                     pixels = next_pixels
+                    active_pixels, next_pixels = next_pixels, active_pixels
                 else:
                     # Blend between the two animations' pixel arrays.
-                    pixels = doorsign.blendPixels(active_pixels, next_pixels, blend)
+                    if profiling:
+                        profiler.enter(profiler.BLEND)
+                    pixels = doorsign.blendPixelsInto(active_pixels, next_pixels, blend, blend_pixels)
+                    if profiling:
+                        profiler.enter(profiler.SCHEDULE)
             else:
                 # No next animation scheduled at the moment. The pixels for the active animation
                 # get used directly.
@@ -201,8 +384,9 @@ def task():
                         new_animations = old_animations
                         old_animations = []
                     next_animation_start_ms = frame_ms
+                    next_animation.restart()
 
-                    logger.write('Next animation: ' + next_animation.__name__)
+                    logger.write('Next animation: ' + next_animation.name)
 
                     # Calculate how long to blend between active and next animation. Typically this will be the preferred
                     # value. But if the runtimes of the active or next animations are short trim it.
@@ -210,22 +394,103 @@ def task():
             
         else:
             # No animation at all. All off.
-            pixels = [[0, 0, 0]] * doorsign.pixel_count
+            pixels = black_pixels
+            changed = False
+        
+        # Render the layers on top.
+        for layer in layers:
+            if profiling:
+                profiler.enter(profiler.LAYERS, layer.animation.name)
+            if layer.render(frame_ms):
+                changed = True
         
-        pixels = doorsign.scalePixels(pixels, final_dimmer);
+        # Stack it all up and dim, unless nothing changed. Then the last frame can be reused.
+        if profiling:
+            profiler.enter(profiler.COMPOSITE)
+        output = output_pixels[frame_count & 1]
+        if changed or restacked or (final_dimmer != composited_dimmer):
+            pixels = compositor.composite(pixels, layers, final_dimmer, output)
+            composited_dimmer = final_dimmer
+            frames_composited += 1
+        else:
+            pixels = doorsign.copyPixelsInto(output_pixels[(frame_count + 1) & 1], output)
         
         # Output the pixels only if currently not under manual control. Animation
         # keeps running.
+        if profiling:
+            profiler.enter(profiler.OUTPUT)
         if not doorsign.manual_control:
             doorsign.setPixels(pixels)
+            
+            # Publish. This buffer is not written to during the next frame.
+            snapshot_pixels = pixels
+            
+            if ring_edge_us is not None:
+                doorbell.latency(time.ticks_diff(time.ticks_us(), ring_edge_us))
+        ring_edge_us = None
+        if profiling:
+            profiler.enter(profiler.SCHEDULE)
+            
+        if frame_count == 0:
+            bootlog.mark('first_frame')
+        frame_count += 1
+        
+        # Account for the memory allocated in this frame. The heap is shared with the network task,
+        # its allocations are included. If mem_alloc() went down a collection ran somewhere else,
+        # typically the allocator had to collect by itself.
+        alloc = gc.mem_alloc()
+        if alloc >= last_alloc:
+            heap_alloc_frame = alloc - last_alloc
+            heap_alloc_frame_max = max(heap_alloc_frame_max, heap_alloc_frame)
+            alloc_since_gc += heap_alloc_frame
+        else:
+            gc_auto_collections += 1
+            gc_auto_frame_ms_max = max(gc_auto_frame_ms_max, time.ticks_diff(time.ticks_ms(), frame_ms))
+            
+            # We don't know what was allocated between the collection and now, start counting anew.
+            alloc_since_gc = 0
+        last_alloc = alloc
         
         # Sleep for the remainder of the frame if any.
         now_ms = time.ticks_ms()
         used_ms = time.ticks_diff(now_ms, frame_ms)
         remaining_ms = doorsign.frame_intervall_ms - used_ms
+        metrics.observe(_frame_busy, used_ms)
+        
+        # Use the time left to sample the sensors.
+        if remaining_ms >= sensors_min_idle_ms:
+            if profiling:
+                profiler.enter(profiler.SENSORS)
+            if sensors.poll():
+                final_dimmer = sensors.dimmer
+            
+            now_ms = time.ticks_ms()
+            used_ms = time.ticks_diff(now_ms, frame_ms)
+            remaining_ms = doorsign.frame_intervall_ms - used_ms
+        
+        # Use the time left to collect garbage if it's due.
+        if (alloc_since_gc >= gc_after_bytes) and (remaining_ms >= gc_min_idle_ms):
+            if profiling:
+                profiler.enter(profiler.GC)
+            start_us = time.ticks_us()
+            gc.collect()
+            gc_pause_us_max = max(gc_pause_us_max, time.ticks_diff(time.ticks_us(), start_us))
+            gc_collections += 1
+            
+            last_alloc = gc.mem_alloc()
+            alloc_since_gc = 0
+            
+            now_ms = time.ticks_ms()
+            used_ms = time.ticks_diff(now_ms, frame_ms)
+            remaining_ms = doorsign.frame_intervall_ms - used_ms
    
+        # Sleep, but wake up early for the door bell.
+        if profiling:
+            profiler.enter(profiler.SLEEP)
         if remaining_ms > 0:
-            time.sleep_ms(remaining_ms)
+            doorbell.wait(remaining_ms)
+        else:
+            frame_overruns += 1
    
 if __name__ == '__main__':
     
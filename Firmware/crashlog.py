@@ -0,0 +1,94 @@
+'''
+This module keeps structured records of resets and crashes on flash.
+
+Each boot is counted and recorded with the cause of the reset. An exception that ends one of the
+tasks is recorded with the task, boot, uptime, time and its full traceback. Both lists are bounded
+to the latest max_records entries. They can be fetched and cleared via /api/crashes.
+'''
+
+max_records = 8
+filename = 'crashlog.json'
+
+import sys
+import io
+import time
+import ujson
+import lock
+import logger
+import journal
+
+_lock = lock.RecursiveLock()
+_data = None
+
+def _save():
+    try:
+        with open(filename, 'w') as f:
+            ujson.dump(_data, f)
+    except Exception as e:
+        logger.write('Error writing ' + filename + ' (' + str(e) + ')')
+
+'''
+Load the records and count this boot, caused by reset_cause.
+'''
+def setup(reset_cause):
+    global _data
+
+    try:
+        with open(filename) as f:
+            _data = ujson.load(f)
+    except Exception:
+        _data = {'boots': 0, 'resets': [], 'crashes': []}
+
+    _data['boots'] += 1
+    _data['resets'].append({'boot': _data['boots'], 'time': time.time(), 'cause': reset_cause})
+    while len(_data['resets']) > max_records:
+        _data['resets'].pop(0)
+    _save()
+
+    logger.write('Boot #' + str(_data['boots']) + ', ' + str(len(_data['crashes'])) + ' crashes on record')
+
+'''
+Record exception e that ended task, 0 for the network and 1 for the animation task.
+'''
+def record(task, e):
+    _lock.acquire()
+    try:
+        buf = io.StringIO()
+        sys.print_exception(e, buf)
+
+        _data['crashes'].append({
+            'boot': _data['boots'],
+            'uptime_ms': time.ticks_ms(),
+            'time': time.time(),
+            'task': task,
+            'thread': logger.get_thread_id(),
+            'type': type(e).__name__,
+            'message': str(e),
+            'traceback': buf.getvalue()
+        })
+        while len(_data['crashes']) > max_records:
+            _data['crashes'].pop(0)
+        _save()
+
+        journal.log(journal.CRASH, task)
+        journal.flush()
+    except Exception as e2:
+        # Don't make matters worse, we are probably low on memory.
+        logger.write('Error recording crash (' + str(e2) + ')')
+    finally:
+        _lock.release()
+
+def records():
+    return _data
+
+'''
+Forget the crashes and resets, but keep counting boots.
+'''
+def clear():
+    _lock.acquire()
+    try:
+        _data['resets'] = []
+        _data['crashes'] = []
+        _save()
+    finally:
+        _lock.release()
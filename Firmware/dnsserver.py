@@ -0,0 +1,156 @@
+'''
+This module implements the DNS server for the captive portal in AP mode.
+
+Every name resolves to our own IP address. Because that is all we ever do the responses are
+precomputed: The question section of a query is used as key into a small LRU cache of complete
+responses minus the ID. A hit costs a header check, a dict lookup and a concatenation.
+
+Only A queries get an answer record. Any other type (AAAA, HTTPS, ...) gets an empty answer
+so the client does not wait for a timeout or try to use that type instead.
+
+Clients that send more than rate_limit queries per second are ignored for the rest of that
+second. No query is logged, we keep counters instead. See stats().
+'''
+
+cache_size = 16
+rate_limit = 20 # Queries per second and client.
+ttl_s = 60
+
+import struct
+import time
+
+_ip = None
+_cache = {}
+_cache_order = [] # Least recently used first.
+_clients = {}
+
+queries = 0
+cache_hits = 0
+nodata = 0
+ratelimited = 0
+malformed = 0
+
+'''
+Set the IP address to answer with. Drops all cached responses.
+'''
+def setup(ip):
+    global _ip
+
+    _ip = bytes(map(int, ip.split('.')))
+    _cache.clear()
+    del _cache_order[:]
+
+'''
+Build the response for a question. Everything but the ID.
+'''
+def _buildResponse(question, qtype):
+    if qtype == 1: # A
+        return (
+            b'\x81\x80' +                           # Response flags
+            b'\x00\x01\x00\x01\x00\x00\x00\x00' +   # QD/AN/NS/AR count
+            question +                              # Original question
+            b'\xC0\x0C' +                           # Pointer to domain name at byte 12
+            b'\x00\x01\x00\x01' +                   # Type and class (A record / IN class)
+            struct.pack('!I', ttl_s) +              # Time to live
+            b'\x00\x04' +                           # Response length (4 bytes = 1 ipv4 address)
+            _ip                                     # IP address
+        )
+    else:
+        return (
+            b'\x81\x80' +                           # Response flags
+            b'\x00\x01\x00\x00\x00\x00\x00\x00' +   # QD/AN/NS/AR count
+            question                                # Original question
+        )
+
+'''
+Returns True if client is within its rate limit.
+'''
+def _allowed(client, now_ms):
+    entry = _clients.get(client)
+    if (entry is None) or (time.ticks_diff(now_ms, entry[0]) >= 1000):
+        if len(_clients) >= 32:
+            # Don't let the table grow unbounded. Forgetting everybody is fine.
+            _clients.clear()
+        _clients[client] = [now_ms, 1]
+        return True
+
+    entry[1] += 1
+    return entry[1] <= rate_limit
+
+'''
+Build the response to a query. Returns None if the query is to be ignored.
+'''
+def respond(request, client = None):
+    global queries
+    global cache_hits
+    global nodata
+    global ratelimited
+    global malformed
+
+    queries += 1
+
+    # Header: ID, flags, QDCOUNT, ANCOUNT, NSCOUNT, ARCOUNT. We only answer standard queries
+    # (QR = 0, OPCODE = 0) for exactly one question.
+    if len(request) < 17:
+        malformed += 1
+        return None
+
+    _, flags, qdcount = struct.unpack_from('!HHH', request)
+    if (flags & 0xF800) or (qdcount != 1):
+        malformed += 1
+        return None
+
+    if (client is not None) and not _allowed(client, time.ticks_ms()):
+        ratelimited += 1
+        return None
+
+    # Find the end of QNAME by skipping over the labels. No need to decode it.
+    n = 12
+    l = len(request)
+    while (n < l) and request[n]:
+        n += request[n] + 1
+    n += 1
+
+    if n + 4 > l:
+        malformed += 1
+        return None
+
+    question = request[12:n + 4]
+
+    response = _cache.get(question)
+    if response is None:
+        response = _buildResponse(question, struct.unpack_from('!H', request, n)[0])
+
+        if len(_cache) >= cache_size:
+            del _cache[_cache_order.pop(0)]
+        _cache[question] = response
+        _cache_order.append(question)
+    else:
+        cache_hits += 1
+        if _cache_order[-1] != question:
+            _cache_order.remove(question)
+            _cache_order.append(question)
+
+    if response[5] == 0: # ANCOUNT
+        nodata += 1
+
+    return request[:2] + response
+
+'''
+Handle one request waiting on socket.
+'''
+def handle(socket):
+    request, client = socket.recvfrom(512)
+
+    response = respond(request, client[0])
+    if response:
+        socket.sendto(response, client)
+
+def stats():
+    return {
+        'queries': queries,
+        'cache_hits': cache_hits,
+        'nodata': nodata,
+        'ratelimited': ratelimited,
+        'malformed': malformed
+    }
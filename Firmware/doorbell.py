@@ -0,0 +1,153 @@
+'''
+This module detects presses of the door bell button.
+
+The ringer detector (see Schematic-Klingeldetektor.jpg) drives an optocoupler from the AC of the
+bell transformer. It pulls its pin low on every half-wave while the button is held, so a press is
+a burst of falling edges 20 ms apart rather than one clean edge. The IRQ handler debounces: An
+edge only starts a new press if there was no edge for release_ms before it.
+
+Presses are handed to core1 through a queue of timestamps (ticks_us of the first edge). It is a
+ring buffer with one writer and one reader: The handler only moves the head and core1 only moves
+the tail, so no lock is needed and the handler never waits. core1 shows the ring animation from
+the next frame on and sleeps through the rest of a frame with wait(), which returns early when
+a press comes in. Configured in the DOORBELL section of config.json:
+
+    "DOORBELL": {"pin": 0, "animation": "animation_ring", "duration_ms": 10000}
+
+core1 reports back how long it took from the edge to the first frame of the ring animation on the
+pixels, see latency().
+'''
+
+release_ms = 100 # No edges for this long and the button has been released.
+queue_size = 8
+history_size = 10 # Remember the times of this many presses.
+wait_slice_ms = 2 # How often wait() checks for a press.
+
+import machine
+import array
+import time
+import logger
+import journal
+
+_pin = None
+_queue = array.array('L', [0] * queue_size)
+_head = 0 # Written by the handler only.
+_tail = 0 # Written by poll() only.
+_last_edge_ms = None
+
+animation_name = None
+duration_ms = 0
+
+# Results. See stats().
+presses = 0
+dropped = 0 # Presses lost because the queue was full.
+history = [] # Wall clock time of the last presses, newest last.
+latency_us_last = None
+latency_us_max = 0
+rings = 0 # Presses shown, each reported with its latency.
+
+'''
+Configure from the DOORBELL section of config.json and start listening on the pin.
+'''
+def setup(config):
+    global _pin
+    global animation_name
+    global duration_ms
+
+    if config.get('pin') is None:
+        return
+
+    animation_name = config.get('animation')
+    duration_ms = config.get('duration_ms', 10 * 1000)
+
+    _pin = machine.Pin(config['pin'], machine.Pin.IN, machine.Pin.PULL_UP)
+    _pin.irq(handler = _irq, trigger = machine.Pin.IRQ_FALLING)
+    logger.write('Listening for the door bell on pin ' + str(config['pin']))
+
+# IRQ handler. Keep it short and don't allocate.
+def _irq(pin):
+    global _head
+    global _last_edge_ms
+    global presses
+    global dropped
+
+    now_us = time.ticks_us()
+    now_ms = time.ticks_ms()
+
+    last_edge_ms = _last_edge_ms
+    _last_edge_ms = now_ms
+    if (last_edge_ms is not None) and (time.ticks_diff(now_ms, last_edge_ms) < release_ms):
+        return
+
+    head = (_head + 1) % queue_size
+    if head == _tail:
+        dropped += 1
+        return
+
+    _queue[_head] = now_us
+    _head = head
+    presses += 1
+
+'''
+Is there a press that poll() has not returned yet?
+'''
+def pending():
+    return _head != _tail
+
+'''
+Take the presses from the queue. Returns the ticks_us of the latest, None if there was none.
+'''
+def poll():
+    global _tail
+
+    pressed_us = None
+    while _tail != _head:
+        pressed_us = _queue[_tail]
+        _tail = (_tail + 1) % queue_size
+
+        history.append(time.time())
+        if len(history) > history_size:
+            history.pop(0)
+        journal.log(journal.DOORBELL)
+
+    if pressed_us is not None:
+        logger.write('Door bell')
+
+    return pressed_us
+
+'''
+Sleep for ms, but return as soon as the button is pressed.
+'''
+def wait(ms):
+    if _pin is None:
+        time.sleep_ms(ms)
+        return
+
+    start_ms = time.ticks_ms()
+    while _head == _tail:
+        left_ms = ms - time.ticks_diff(time.ticks_ms(), start_ms)
+        if left_ms <= 0:
+            return
+        time.sleep_ms(min(left_ms, wait_slice_ms))
+
+'''
+Report the time from the edge to the first frame of the ring animation.
+'''
+def latency(us):
+    global latency_us_last
+    global latency_us_max
+    global rings
+
+    rings += 1
+    latency_us_last = us
+    latency_us_max = max(latency_us_max, us)
+
+def stats():
+    return {
+        'presses': presses,
+        'dropped': dropped,
+        'history': history,
+        'rings': rings,
+        'latency_us_last': latency_us_last,
+        'latency_us_max': latency_us_max
+    }
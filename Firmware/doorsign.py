@@ -25,6 +25,7 @@ from neopixel import NeoPixel
 import _thread
 import lock
 import logger
+import metrics
 
 # Set up gamma correction lookup table.
 _gamma_table = []
@@ -35,14 +36,17 @@ for input in range(256):
 
 _pixel_lock = lock.RecursiveLock()
 
+_pixel_writes = metrics.histogram('pixel_write_us', 'Time it takes to send the pixels out to the LEDs.', (250, 500, 1000, 2000, 5000))
+
 _rawpixels = [(0, 0, 0)] * pixel_count
 _np = NeoPixel(machine.Pin(4, machine.Pin.OUT), pixel_count)
 
 _adc_pins = [
-    machine.ADC(26), # ADC0
-    machine.ADC(28), # ADC1
+    machine.ADC(26), # ADC0, the LDR
+    machine.ADC(27), # ADC1
     machine.ADC(28)  # ADC2
 ]
+adc_count = len(_adc_pins)
 
 frame_intervall_ms = 1000//framerate # How many ms per frame?
 
@@ -57,7 +61,9 @@ def endUpdate():
     # Safe to query the lock. It is ours. If we are about to actually unlock send the final
     # pixel data out.
     if _pixel_lock.count() == 1:
+        start_us = time.ticks_us()
         _np.write()
+        metrics.observe(_pixel_writes, time.ticks_diff(time.ticks_us(), start_us))
         
     _pixel_lock.release()
 
@@ -77,6 +83,15 @@ def readADC():
 
     return result
 
+'''
+Read all ADC channels into values, a list or array of adc_count elements.
+'''
+def readADCInto(values):
+    for channel in range(adc_count):
+        values[channel] = _adc_pins[channel].read_u16()
+
+    return values
+
 '''
 Convert from RGB color space to HSV. 
 RGB is a tuple of three integers in the range 0..255. 
@@ -145,7 +160,10 @@ def HSVToRGB(hsv_color):
     return r, g, b
 
 def randomColor():
-    return HSVToRGB((random.randint(0,360), 255, random.randint(5,255)))
+    # S and V go beyond the 0..100 that HSVToRGB() expects. Clamp so the result is a valid
+    # pixel, a saturated and mostly bright color.
+    (r, g, b) = HSVToRGB((random.randint(0,360), 255, random.randint(5,255)))
+    return (clamp(r), clamp(g), clamp(b))
 
 def clamp(channel, min=0, max=255):
     if channel < min:
@@ -166,16 +184,41 @@ def scalePixel(pixel, scalefactor):
         clamp(math.trunc(pixel[2] * float(scalefactor)))
     )
 
+'''
+Allocate a frame buffer: A list of pixel_count pixels, all black. Pixels are replaced in the
+buffer, never modified in place, so they may be shared between buffers.
+'''
+def newFrame():
+    return [(0, 0, 0)] * pixel_count
+
 '''
 Scale all pixels by a floating point scalefactor. The factor is arbitrary,
 the results are truncated and clamped.
 '''
 def scalePixels(pixels , scalefactor):
-    result = [(0, 0, 0)] * pixel_count
+    return scalePixelsInto(pixels, scalefactor, newFrame())
+
+'''
+Scale all pixels by a floating point scalefactor into the frame buffer out, which may be
+pixels itself. A factor of 1.0 just copies.
+'''
+def scalePixelsInto(pixels, scalefactor, out):
+    if scalefactor == 1.0:
+        return copyPixelsInto(pixels, out)
+
     for pixelIndex in range(pixel_count):
-        result[pixelIndex] = scalePixel(pixels[pixelIndex], scalefactor)
+        out[pixelIndex] = scalePixel(pixels[pixelIndex], scalefactor)
         
-    return result
+    return out
+
+'''
+Copy all pixels into the frame buffer out.
+'''
+def copyPixelsInto(pixels, out):
+    for pixelIndex in range(pixel_count):
+        out[pixelIndex] = pixels[pixelIndex]
+        
+    return out
 
 ''' 
 Linear blend between two single pixels, blend is a float between 0 and 1.
@@ -257,11 +300,22 @@ More clever blend between two single pixels, blend is a float between 0 and 1.
 The blend happens in HSV space with H going the "short way".
 '''
 def blendPixels(pixels1, pixels2, blend):
-    result = [(0, 0, 0)] * pixel_count
+    return blendPixelsInto(pixels1, pixels2, blend, newFrame())
+
+'''
+Like blendPixels() but into the frame buffer out, which may be one of the inputs. Pixels that
+are the same in both do not need blending, typically the ones that are off.
+'''
+def blendPixelsInto(pixels1, pixels2, blend, out):
     for pixelIndex in range(pixel_count):
-        result[pixelIndex] = blendPixel(pixels1[pixelIndex], pixels2[pixelIndex], blend)
+        pixel1 = pixels1[pixelIndex]
+        pixel2 = pixels2[pixelIndex]
+        if pixel1 == pixel2:
+            out[pixelIndex] = pixel1
+        else:
+            out[pixelIndex] = blendPixel(pixel1, pixel2, blend)
         
-    return result
+    return out
 
 ''' 
 Set a single pixel.
@@ -330,6 +384,42 @@ Format a pixel array for string output.
 def formatPixels(pixels):
     return '<' + ','.join([formatPixel(pixel) for pixel in pixels]) + '>'
 
+'''
+Parse a six-digit hex string into a pixel. This is the inverse of formatPixel().
+'''
+def parsePixel(s):
+    value = int(s, 16)
+    return ((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
+'''
+Pack a pixel array into a compact bytearray of three bytes (R, G, B) per pixel.
+'''
+def packPixels(pixels):
+    buf = bytearray(3 * len(pixels))
+    i = 0
+    for pixel in pixels:
+        buf[i] = pixel[0]
+        buf[i + 1] = pixel[1]
+        buf[i + 2] = pixel[2]
+        i += 3
+        
+    return buf
+
+'''
+Unpack three bytes per pixel from buf into pixels starting at pixel index offset. Extra
+bytes that would go beyond the last pixel or do not form a complete pixel are ignored.
+Returns the number of pixels set. A negative offset raises ValueError instead of wrapping
+around to the last pixels.
+'''
+def unpackPixels(buf, pixels, offset = 0):
+    if offset < 0:
+        raise ValueError('Negative pixel offset')
+    count = max(0, min(len(buf) // 3, pixel_count - offset))
+    for i in range(count):
+        pixels[offset + i] = (buf[3 * i], buf[3 * i + 1], buf[3 * i + 2])
+        
+    return count
+
 if __name__ == '__main__':
 
     logger.write('__main__: All pixels off')
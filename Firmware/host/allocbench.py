@@ -0,0 +1,71 @@
+'''
+Host-side benchmark: How much memory does each animation allocate per frame?
+
+Runs every animation, modules animation_*.py and keyframe files animation_*.json, for a number of
+frames on a virtual clock and traces the memory allocated while rendering each frame with
+tracemalloc. Reported are the bytes allocated during a frame (peak above the state before the
+frame) and the number of frames run. CPython objects are larger than MicroPython's, so compare
+animations with each other rather than with the heap statistics reported by the doorsign itself
+(see core1.heapStats()).
+
+Usage: python allocbench.py [--frames N] [animation_name ...]
+'''
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+import hostport
+
+def benchmark(animation, frames, frame_ms):
+    import doorsign
+
+    # Run one frame to import the module and set up its state outside of the measurement.
+    out = doorsign.newFrame()
+    animation.render(0, out)
+
+    total = 0
+    worst = 0
+    tracemalloc.start()
+    for i in range(1, frames + 1):
+        hostport.advance(frame_ms)
+
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        animation.render(i * frame_ms, out)
+        allocated = tracemalloc.get_traced_memory()[1] - before
+
+        total += allocated
+        worst = max(worst, allocated)
+    tracemalloc.stop()
+
+    return total / frames, worst
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Count bytes allocated per frame for each animation.')
+    parser.add_argument('animations', nargs = '*', help = 'Animation module names. Default: All.')
+    parser.add_argument('--frames', type = int, default = 1000)
+    args = parser.parse_args()
+
+    hostport.install(virtual_clock = True)
+
+    import doorsign
+    import animation
+
+    os.chdir(hostport.FIRMWARE_FOLDER)
+    files = sorted(f for f in os.listdir() if animation.isAnimationFile(f))
+    if args.animations:
+        files = [f for f in files if f.split('.')[0] in args.animations]
+
+    print('{:32s} {:>12s} {:>12s}'.format('animation', 'avg B/frame', 'max B/frame'))
+    for f in files:
+        a = animation.Animation.fromFile(f)
+        avg, worst = benchmark(a, args.frames, doorsign.frame_intervall_ms)
+        print('{:32s} {:12.0f} {:12d}'.format(a.name, avg, worst))
+        a.unload()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+'''
+Host-side benchmark: What does compositing cost per frame with more layers?
+
+Stacks N layers over a base animation, cycling through the available animations and blend modes,
+and runs them for a number of frames on a virtual clock the way core1 does. Reported per layer
+count are the time compositing takes when every frame is composited, the time a whole frame takes
+including rendering the layers, and how many frames actually needed compositing because something
+changed. Times are CPython's, compare them with each other rather than with the doorsign.
+
+Usage: python compositebench.py [--frames N] [--layers N ...]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import hostport
+
+def benchmark(base, stack, frames, frame_ms):
+    import doorsign
+    import compositor
+
+    base_pixels = doorsign.newFrame()
+    output_pixels = [doorsign.newFrame(), doorsign.newFrame()]
+
+    # Compositing alone.
+    base.render(0, base_pixels)
+    for layer in stack:
+        layer.render(0)
+    start = time.perf_counter()
+    for i in range(frames):
+        compositor.composite(base_pixels, stack, 0.8, output_pixels[i & 1])
+    composite_us = (time.perf_counter() - start) / frames * 1e6
+
+    # Whole frames, only compositing what changed.
+    composited = 0
+    start = time.perf_counter()
+    for i in range(1, frames + 1):
+        hostport.advance(frame_ms)
+        changed = base.render(i * frame_ms, base_pixels)
+        for layer in stack:
+            if layer.render(i * frame_ms):
+                changed = True
+        if changed:
+            compositor.composite(base_pixels, stack, 0.8, output_pixels[i & 1])
+            composited += 1
+        else:
+            doorsign.copyPixelsInto(output_pixels[(i + 1) & 1], output_pixels[i & 1])
+    frame_us = (time.perf_counter() - start) / frames * 1e6
+
+    return composite_us, frame_us, composited
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Time compositing for different numbers of layers.')
+    parser.add_argument('--frames', type = int, default = 5000)
+    parser.add_argument('--layers', type = int, nargs = '+', default = [2, 4, 8])
+    args = parser.parse_args()
+
+    hostport.install(virtual_clock = True)
+
+    import doorsign
+    import animation
+    import compositor
+
+    os.chdir(hostport.FIRMWARE_FOLDER)
+    files = sorted(f for f in os.listdir() if animation.isAnimationFile(f))
+
+    print('{:>6s} {:>14s} {:>14s} {:>12s}'.format('layers', 'composite us', 'frame us', 'composited'))
+    for count in args.layers:
+        base = animation.Animation.fromFile(files[0])
+        stack = []
+        for i in range(count):
+            a = animation.Animation.fromFile(files[(i + 1) % len(files)])
+            mask = list(range(i % 2, doorsign.pixel_count, 2)) if i % 3 == 2 else None
+            stack.append(compositor.Layer(a, compositor.modes[i % len(compositor.modes)], 0.5 + 0.5 * (i % 2), mask))
+
+        composite_us, frame_us, composited = benchmark(base, stack, args.frames, doorsign.frame_intervall_ms)
+        print('{:6d} {:14.1f} {:14.1f} {:11.0f}%'.format(count, composite_us, frame_us, 100 * composited / args.frames))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
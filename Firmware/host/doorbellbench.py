@@ -0,0 +1,78 @@
+'''
+Host-side benchmark: How quickly does the ring animation show after the door bell is pressed?
+
+Runs the animation task in a thread on the real clock and presses the bell on a simulated pin at
+random points of the frames. For each press the time from the edge to the first frame of the ring
+animation being sent to the pixels is measured, as reported by core1 to doorbell.latency(). Like
+on the doorsign a press is a burst of edges, one per half-wave of the AC, and the bell is pressed
+again only after the ring animation has finished.
+
+Usage: python doorbellbench.py [--presses N] [--pin N]
+'''
+
+import argparse
+import random
+import sys
+import time
+import _thread
+
+import hostport
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure the latency from a door bell press to the ring animation.')
+    parser.add_argument('--presses', type = int, default = 50)
+    parser.add_argument('--pin', type = int, default = 0)
+    args = parser.parse_args()
+
+    hostport.install(virtual_clock = False)
+
+    import os
+    import machine
+    import doorsign
+    import doorbell
+    import core1
+
+    os.chdir(hostport.FIRMWARE_FOLDER)
+
+    doorbell.setup({'pin': args.pin, 'animation': 'animation_ring', 'duration_ms': 200})
+    core1.setup()
+    _thread.start_new_thread(core1.task, ())
+    time.sleep(0.5)
+
+    pin = machine.Pin.pins[args.pin]
+    latencies = []
+    missed = 0
+    for i in range(args.presses):
+        # Somewhere in a frame.
+        time.sleep(random.uniform(0, doorsign.frame_intervall_ms) / 1000)
+
+        reported = doorbell.rings
+        for halfwave in range(5):
+            pin.value(0)
+            time.sleep(0.005)
+            pin.value(1)
+            time.sleep(0.015)
+            if halfwave == 0:
+                # Two presses can have the same latency, wait for the ring to be reported.
+                timeout = time.monotonic() + 1
+                while (doorbell.rings == reported) and (time.monotonic() < timeout):
+                    time.sleep(0.001)
+                if doorbell.rings != reported:
+                    latencies.append(doorbell.latency_us_last)
+                else:
+                    missed += 1
+
+        # Let the ring animation end.
+        time.sleep(0.4)
+
+    latencies.sort()
+    print('presses {:d}, counted {:d}, not shown within 1 s {:d}, frame {:d} ms'.format(args.presses, doorbell.presses, missed, doorsign.frame_intervall_ms))
+    if not latencies:
+        return 1
+    print('latency us: min {:d}, median {:d}, 90% {:d}, max {:d}'.format(
+        latencies[0], latencies[len(latencies) // 2], latencies[len(latencies) * 9 // 10], latencies[-1]))
+
+    return 0 if not missed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+'''
+Stand-ins for the MicroPython specific modules so the firmware modules can be imported and run
+on the host with CPython. Used by the host-side tools in this folder, none of this is uploaded
+to the doorsign.
+
+Call install() before importing any firmware module. With a virtual clock time only advances
+when told to via advance() or time.sleep_ms(), so animations can be rendered as fast as the CPU
+allows.
+'''
+
+import os
+import sys
+import gc
+import json
+import time
+import types
+import binascii
+
+FIRMWARE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_virtual = False
+_now_us = 0
+
+def ticks_us():
+    if _virtual:
+        return _now_us
+    return time.perf_counter_ns() // 1000
+
+def ticks_ms():
+    return ticks_us() // 1000
+
+def ticks_diff(a, b):
+    return a - b
+
+def ticks_add(a, b):
+    return a + b
+
+'''
+Advance the virtual clock. Does nothing with the real clock.
+'''
+def advance(ms):
+    global _now_us
+
+    _now_us += int(ms * 1000)
+
+_gmtime = time.gmtime
+
+_time = time.time
+
+# MicroPython's time() returns whole seconds.
+def whole_seconds():
+    return int(_time())
+
+# MicroPython's gmtime() returns a plain 8-tuple.
+def gmtime(secs = None):
+    return tuple(_gmtime(secs))[:8]
+
+def sleep_ms(ms):
+    if _virtual:
+        advance(ms)
+    elif ms > 0:
+        time.sleep(ms / 1000)
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    # All pins created, by id. Tools can look at or change their state.
+    pins = {}
+
+    def __init__(self, id, mode = -1, pull = -1, value = None):
+        self.id = id
+        self._value = 1 if pull == Pin.PULL_UP else 0
+        if value is not None:
+            self._value = value
+        self._handler = None
+        self._trigger = 0
+        Pin.pins[id] = self
+
+    def value(self, value = None):
+        if value is None:
+            return self._value
+
+        # Simulate an edge, calling the IRQ handler if there is one for this edge.
+        edge = Pin.IRQ_RISING if value and not self._value else Pin.IRQ_FALLING if self._value and not value else 0
+        self._value = value
+        if self._handler and (edge & self._trigger):
+            self._handler(self)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler = None, trigger = IRQ_FALLING | IRQ_RISING):
+        self._handler = handler
+        self._trigger = trigger
+
+class ADC:
+    # Raw readings by channel. Tools can change them.
+    values = {}
+
+    def __init__(self, id):
+        self.id = id
+
+    def read_u16(self):
+        return ADC.values.get(self.id, 0)
+
+class RTC:
+    def datetime(self, datetimetuple = None):
+        if datetimetuple is None:
+            tm = time.gmtime()
+            return (tm[0], tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], 0)
+
+class WDT:
+    def __init__(self, id = 0, timeout = 5000):
+        pass
+
+    def feed(self):
+        pass
+
+'''
+A WLAN interface that joins the network join_ms after connect() and then reports outcome as its
+status, 3 (got IP) unless a tool sets a failure like -2 (no network) or 1 to never finish
+joining. drop() loses the link.
+'''
+class WLAN:
+    def __init__(self, interface = 0):
+        self.interface = interface
+        self.outcome = 3
+        self.join_ms = 500
+        self.connects = 0
+        self._active = False
+        self._status = 0
+        self._since_ms = 0
+        self._config = {'mac': b'\x28\xcd\xc1\x00\x00\x01', 'essid': '', 'pm': 0}
+
+    def active(self, active = None):
+        if active is None:
+            return self._active
+        self._active = active
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def connect(self, ssid = None, key = None):
+        self.connects += 1
+        self._config['essid'] = ssid
+        self._status = 1
+        self._since_ms = ticks_ms()
+
+    def disconnect(self):
+        self._status = 0
+
+    def drop(self, status = 0):
+        self._status = status
+
+    def status(self):
+        if (self._status == 1) and (ticks_diff(ticks_ms(), self._since_ms) >= self.join_ms):
+            self._status = self.outcome
+        return self._status
+
+    def isconnected(self):
+        return self.status() == 3
+
+    def ifconfig(self):
+        if self.isconnected():
+            return ('192.168.0.113', '255.255.255.0', '192.168.0.1', '192.168.0.1')
+        return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
+
+class NeoPixel:
+    def __init__(self, pin, n):
+        self.n = n
+        self.pixels = [(0, 0, 0)] * n
+        self.writes = 0
+
+    def __setitem__(self, index, value):
+        self.pixels[index] = value
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def __len__(self):
+        return self.n
+
+    def write(self):
+        self.writes += 1
+
+'''
+Replace the MicroPython specific modules and functions with stand-ins and make the firmware
+modules importable.
+'''
+def install(virtual_clock = False):
+    global _virtual
+
+    _virtual = virtual_clock
+
+    time.ticks_us = ticks_us
+    time.ticks_ms = ticks_ms
+    time.ticks_diff = ticks_diff
+    time.ticks_add = ticks_add
+    time.sleep_ms = sleep_ms
+    time.gmtime = gmtime
+    time.time = whole_seconds
+
+    # There is no MicroPython heap here. Report something plausible.
+    if not hasattr(gc, 'mem_free'):
+        gc.mem_free = lambda: 100 * 1024
+        gc.mem_alloc = lambda: 0
+
+    _module('machine',
+        Pin = Pin,
+        ADC = ADC,
+        RTC = RTC,
+        WDT = WDT,
+        reset = lambda: sys.exit('machine.reset()'),
+        reset_cause = lambda: 1,
+        PWRON_RESET = 1,
+        WDT_RESET = 3,
+        DEEPSLEEP_RESET = 4,
+        SOFT_RESET = 5
+    )
+    _module('neopixel', NeoPixel = NeoPixel)
+    _module('network',
+        WLAN = WLAN,
+        STA_IF = 0,
+        AP_IF = 1,
+        STAT_IDLE = 0,
+        STAT_CONNECTING = 1,
+        STAT_GOT_IP = 3,
+        STAT_CONNECT_FAIL = -1,
+        STAT_NO_AP_FOUND = -2,
+        STAT_WRONG_PASSWORD = -3
+    )
+    _module('rp2', country = lambda country = None: None)
+    _module('micropython', const = lambda value: value)
+    sys.modules['ujson'] = json
+    sys.modules['ubinascii'] = binascii
+
+    if FIRMWARE_FOLDER not in sys.path:
+        sys.path.insert(0, FIRMWARE_FOLDER)
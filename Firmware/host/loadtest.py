@@ -0,0 +1,269 @@
+'''
+Host-side tool: Put the network task of a doorsign under load and see how it copes.
+
+A number of concurrent clients send requests for a while, drawn at random from a mix of the
+kinds of traffic the doorsign sees:
+
+  status  Polling /api like the status page does every second.
+  slider  Setting all pixels via POST /api like the sliders on the page do.
+  static  Fetching the page and its assets.
+  upload  Uploading a file, deleted again at the end.
+  dns     Querying the DNS server of the captive portal, only answered in AP mode.
+
+Reported per kind are the number of requests, requests per second, the error rate and the
+latency at the 50th, 95th and 99th percentile and the worst. The frame counters of the animation
+task are read before and after the run to show the frame overruns the load caused. The results can
+be written to a JSON file, and one from an earlier run (e.g. with the previous firmware) can be
+given to compare with.
+
+Sliders take the pixels under manual control. Control is handed back to the animations at the
+end.
+
+Usage: python loadtest.py [--mix NAME] [--concurrency N] [--duration S] [--output FILE]
+                          [--compare FILE] [host]
+'''
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+
+default_host = '192.168.0.113'
+
+# Relative weights of the kinds of requests.
+MIXES = {
+    'poll': {'status': 1},
+    'page': {'static': 1, 'status': 4},
+    'sliders': {'slider': 1, 'status': 1},
+    'mixed': {'status': 10, 'static': 3, 'slider': 3, 'upload': 1},
+    'upload': {'upload': 1},
+    'dns': {'dns': 1}
+}
+
+STATIC_PATHS = ['/', '/jquery-3.6.1.min.js', '/favicon.ico', '/site.webmanifest']
+UPLOAD_PATH = '/loadtest.bin'
+
+class Target:
+    def __init__(self, address, timeout, pixel_count, upload_bytes):
+        host, _, port = address.partition(':')
+        self.host = host
+        self.port = int(port) if port else 80
+        self.timeout = timeout
+        self.pixel_count = pixel_count
+        self.upload = bytes(random.randrange(256) for i in range(upload_bytes))
+        self.dns_id = 0
+
+    '''
+    Send a request and read the response up to the end of the connection. Returns the status
+    code and the number of bytes received.
+    '''
+    async def http(self, method, path, body = b''):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            head = method + ' ' + path + ' HTTP/1.0\r\nHost: ' + self.host
+            if body:
+                head += '\r\nContent-Length: ' + str(len(body))
+            writer.write(head.encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+
+            data = await asyncio.wait_for(reader.read(), self.timeout)
+        finally:
+            writer.close()
+
+        status = data.split(b' ', 2)[1] if data.startswith(b'HTTP/') else b''
+        return int(status) if status.isdigit() else 0, len(data)
+
+    async def json(self, path):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            writer.write(('GET ' + path + ' HTTP/1.0\r\nHost: ' + self.host + '\r\n\r\n').encode())
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(), self.timeout)
+        finally:
+            writer.close()
+
+        return json.loads(data[data.find(b'\r\n\r\n') + 4:])
+
+    async def dns(self):
+        self.dns_id = (self.dns_id + 1) & 0xFFFF
+        name = 'loadtest' + str(self.dns_id) + '.example.com'
+        query = struct.pack('!HHHHHH', self.dns_id, 0x0100, 1, 0, 0, 0)
+        for label in name.split('.'):
+            query += bytes([len(label)]) + label.encode()
+        query += b'\x00' + struct.pack('!HH', 1, 1)
+
+        loop = asyncio.get_running_loop()
+        answer = loop.create_future()
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                if not answer.done():
+                    answer.set_result(data)
+
+        transport, _ = await loop.create_datagram_endpoint(Protocol, remote_addr = (self.host, 53))
+        try:
+            transport.sendto(query)
+            data = await asyncio.wait_for(answer, self.timeout)
+        finally:
+            transport.close()
+
+        return (0 if (data[3] & 0x0F) else 200), len(data)
+
+    async def request(self, kind):
+        if kind == 'status':
+            return await self.http('GET', '/api?fields=uptime,manual_control,active_animation,adc')
+        elif kind == 'slider':
+            params = '&'.join('r{0:d}={1:d}&g{0:d}={2:d}&b{0:d}={3:d}'.format(i, random.randrange(256), random.randrange(256), random.randrange(256)) for i in range(self.pixel_count))
+            return await self.http('POST', '/api?' + params)
+        elif kind == 'static':
+            return await self.http('GET', random.choice(STATIC_PATHS))
+        elif kind == 'upload':
+            return await self.http('POST', UPLOAD_PATH, self.upload)
+        elif kind == 'dns':
+            return await self.dns()
+        else:
+            raise RuntimeError('Unknown kind of request \"' + kind + '\"')
+
+async def client(target, mix, until, results):
+    kinds = list(mix.keys())
+    weights = list(mix.values())
+
+    while time.monotonic() < until:
+        kind = random.choices(kinds, weights)[0]
+        start = time.monotonic()
+        try:
+            status, received = await target.request(kind)
+            error = None if 200 <= status < 300 else 'status ' + str(status)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError) as e:
+            received = 0
+            error = type(e).__name__
+        results.append((kind, time.monotonic() - start, received, error))
+
+def percentile(values, p):
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+def summarize(results, duration_s):
+    kinds = {}
+    for kind in sorted(set(r[0] for r in results)):
+        latencies = sorted(r[1] * 1000 for r in results if r[0] == kind)
+        errors = [r[3] for r in results if (r[0] == kind) and r[3]]
+        kinds[kind] = {
+            'count': len(latencies),
+            'rps': round(len(latencies) / duration_s, 2),
+            'errors': len(errors),
+            'error_rate': round(len(errors) / len(latencies), 4),
+            'error_kinds': {e: errors.count(e) for e in set(errors)},
+            'bytes': sum(r[2] for r in results if r[0] == kind),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'max_ms': round(latencies[-1], 1)
+        }
+
+    return kinds
+
+async def frames(target):
+    try:
+        return await target.json('/api?fields=frames,firmware_version')
+    except (OSError, asyncio.TimeoutError, ValueError) as e:
+        print('Could not read the frame counters (' + type(e).__name__ + ')')
+        return None
+
+async def run(args):
+    mix = MIXES[args.mix]
+    target = Target(args.host, args.timeout, args.pixels, args.upload_kb * 1024)
+
+    before = await frames(target)
+
+    results = []
+    start = time.monotonic()
+    until = start + args.duration
+    await asyncio.gather(*(client(target, mix, until, results) for i in range(args.concurrency)))
+    duration_s = time.monotonic() - start
+
+    after = await frames(target)
+
+    # Clean up after ourselves.
+    try:
+        if 'slider' in mix:
+            await target.http('POST', '/api?manual=0')
+        if 'upload' in mix:
+            await target.http('DELETE', UPLOAD_PATH)
+    except (OSError, asyncio.TimeoutError) as e:
+        print('Could not clean up (' + type(e).__name__ + ')')
+
+    errors = sum(1 for r in results if r[3])
+    return {
+        'target': args.host,
+        'mix': args.mix,
+        'concurrency': args.concurrency,
+        'duration_s': round(duration_s, 1),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - duration_s)),
+        'firmware_version': after.get('firmware_version') if after else None,
+        'requests': len(results),
+        'rps': round(len(results) / duration_s, 2),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else None,
+        'kinds': summarize(results, duration_s),
+        'frames': (after['frames'] - before['frames']) if (before and after) else None,
+        'frame_overruns': (after['frame_overruns'] - before['frame_overruns']) if (before and after) else None
+    }
+
+def report(result, previous = None):
+    def compare(value, key, kind = None):
+        if previous is None:
+            return ''
+        old = previous['kinds'].get(kind, {}).get(key) if kind else previous.get(key)
+        if old is None:
+            return ' (-)'
+        return ' (' + str(old) + ')'
+
+    print('{:s} with mix \"{:s}\", {:d} clients for {:.0f} s, firmware {:s}'.format(result['target'], result['mix'], result['concurrency'], result['duration_s'], str(result['firmware_version'])))
+    if previous:
+        print('In brackets: ' + previous['target'] + ', firmware ' + str(previous['firmware_version']) + ', started ' + previous['started'])
+    print()
+    print('{:8s} {:>14s} {:>14s} {:>14s} {:>14s} {:>14s} {:>14s}'.format('kind', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for kind, k in result['kinds'].items():
+        print('{:8s} {:>14s} {:>14s} {:>14s} {:>14s} {:>14s} {:>14s}'.format(kind,
+            str(k['rps']) + compare(k['rps'], 'rps', kind),
+            str(k['errors']) + compare(k['errors'], 'errors', kind),
+            str(k['p50_ms']) + compare(k['p50_ms'], 'p50_ms', kind),
+            str(k['p95_ms']) + compare(k['p95_ms'], 'p95_ms', kind),
+            str(k['p99_ms']) + compare(k['p99_ms'], 'p99_ms', kind),
+            str(k['max_ms']) + compare(k['max_ms'], 'max_ms', kind)))
+    print()
+    print('Total: ' + str(result['rps']) + compare(result['rps'], 'rps') + ' req/s, ' + str(result['errors']) + compare(result['errors'], 'errors') + ' errors')
+    print('Frames: ' + str(result['frames']) + compare(result['frames'], 'frames') + ', overruns: ' + str(result['frame_overruns']) + compare(result['frame_overruns'], 'frame_overruns'))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Load-test the web and DNS server of the doorsign.')
+    parser.add_argument('host', nargs = '?', default = default_host, help = 'Address of the doorsign, host[:port].')
+    parser.add_argument('--mix', choices = sorted(MIXES.keys()), default = 'mixed')
+    parser.add_argument('--concurrency', type = int, default = 2)
+    parser.add_argument('--duration', type = float, default = 30, help = 'Seconds.')
+    parser.add_argument('--timeout', type = float, default = 10, help = 'Seconds per request.')
+    parser.add_argument('--pixels', type = int, default = 8, help = 'Number of pixels to set with the sliders.')
+    parser.add_argument('--upload-kb', type = int, default = 16)
+    parser.add_argument('--output', help = 'Write the results to this JSON file.')
+    parser.add_argument('--compare', help = 'Show the results of an earlier run from this JSON file alongside.')
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    result = asyncio.run(run(args))
+    report(result, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent = 2)
+
+    return 0 if result['requests'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+'''
+Host-side test: Sync the NTP client against a local stand-in server.
+
+Runs a small NTP server on a UDP port of the loopback interface in a thread and drives
+ntpclient.py the way the network task does, poll() and select() on the real clock. The server
+answers like a synchronized stratum 2 server whose clock is ahead of ours by --offset ms, or
+misbehaves as each scenario requires:
+
+  sync      A plain sync. The offset is found and 4 requests are sent.
+  resync    A second sync. The clock kept time, so the error is close to 0 and the interval grows.
+  stale     Each request first gets an answer to some other request. Those are dropped.
+  silent    No answers. The sync fails after 4 timeouts and is retried later.
+  linkdown  The link goes away in the middle of a sync, sending the next request fails. The sync
+            fails without raising.
+  stop      stop() drops a sync in progress. No socket is left open.
+
+Usage: python ntptest.py [--offset MS]
+'''
+
+import argparse
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+import hostport
+
+NTP_DELTA = 2208988800
+
+class Server:
+    def __init__(self, offset_ms):
+        self.offset_ms = offset_ms
+        self.mode = 'ok' # 'ok', 'stale' or 'silent'
+        self.requests = 0
+        self.stale = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.port = self.socket.getsockname()[1]
+        threading.Thread(target = self.serve, daemon = True).start()
+
+    def timestamp(self):
+        t = hostport._time() + self.offset_ms / 1000 + NTP_DELTA
+        return struct.pack('!II', int(t), int((t % 1) * (1 << 32)))
+
+    def answer(self, originate):
+        data = bytearray(48)
+        data[0] = 0x24 # LI = 0, Version = 4, Mode = 4 (server)
+        data[1] = 2 # Stratum
+        now = self.timestamp()
+        data[24:32] = originate
+        data[32:40] = now
+        data[40:48] = now
+        return data
+
+    def serve(self):
+        while True:
+            request, addr = self.socket.recvfrom(48)
+            self.requests += 1
+            if self.mode == 'silent':
+                continue
+            if self.mode == 'stale':
+                self.stale += 1
+                self.socket.sendto(self.answer(random.randbytes(8)), addr)
+            self.socket.sendto(self.answer(request[40:48]), addr)
+
+'''
+Drive the client like core0.task() does until done() or timeout_s.
+'''
+def run(ntpclient, done, timeout_s = 10):
+    until = time.monotonic() + timeout_s
+    while (time.monotonic() < until) and not done():
+        s = ntpclient.poll()
+        if s is None:
+            time.sleep(0.01)
+            continue
+        readable, writeable, errored = select.select([s], [], [], 0.05)
+        if readable:
+            ntpclient.receive()
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Test the NTP client against a local stand-in server.')
+    parser.add_argument('--offset', type = int, default = 1500, help = 'How far the server is ahead, ms.')
+    args = parser.parse_args()
+
+    hostport.install(virtual_clock = False)
+
+    import ntpclient
+
+    server = Server(args.offset)
+    ntpclient.NTP_PORT = server.port
+    ntpclient.sample_timeout_ms = 200
+
+    failed = 0
+    def check(scenario, ok, detail):
+        nonlocal failed
+        print('{:8s} {:4s} {:s}'.format(scenario, 'ok' if ok else 'FAIL', detail))
+        if not ok:
+            failed += 1
+
+    # sync
+    ntpclient.start('127.0.0.1')
+    run(ntpclient, lambda: ntpclient.syncs == 1)
+    check('sync', ntpclient.synced and (server.requests == ntpclient.sample_count) and (abs(ntpclient.last_offset_ms - args.offset) <= 1000) and (ntpclient._socket is None),
+        'offset {} ms, round trip {} ms, {} requests'.format(ntpclient.last_offset_ms, ntpclient.last_delay_ms, server.requests))
+
+    # resync
+    interval_ms = ntpclient._interval_ms
+    time.sleep(0.5)
+    ntpclient.start('127.0.0.1')
+    run(ntpclient, lambda: ntpclient.syncs == 2)
+    check('resync', (ntpclient.syncs == 2) and (abs(ntpclient.last_error_ms) <= 50) and (ntpclient._interval_ms > interval_ms),
+        'error {} ms, drift {} ppm, interval {} s'.format(ntpclient.last_error_ms, ntpclient.drift_ppm, ntpclient._interval_ms // 1000))
+
+    # stale
+    server.mode = 'stale'
+    ntpclient.start('127.0.0.1')
+    run(ntpclient, lambda: ntpclient.syncs == 3)
+    check('stale', (ntpclient.syncs == 3) and (ntpclient.failures == 0) and (server.stale > 0) and (abs(ntpclient.last_offset_ms - args.offset) <= 1000),
+        '{} stale answers, offset {} ms'.format(server.stale, ntpclient.last_offset_ms))
+
+    # silent
+    server.mode = 'silent'
+    requests = server.requests
+    ntpclient.start('127.0.0.1')
+    run(ntpclient, lambda: ntpclient.failures == 1)
+    check('silent', (ntpclient.failures == 1) and (server.requests - requests == ntpclient.sample_count) and (ntpclient._socket is None) and (ntpclient._next_sync_ms is not None),
+        '{} requests, retry in {} s'.format(server.requests - requests, time.ticks_diff(ntpclient._next_sync_ms, time.ticks_ms()) // 1000))
+
+    # linkdown
+    ntpclient.start('127.0.0.1')
+    run(ntpclient, lambda: ntpclient._socket is not None)
+    ntpclient._addr = ('255.255.255.255', server.port) # sendto() fails like without a link.
+    try:
+        run(ntpclient, lambda: ntpclient.failures == 2)
+        check('linkdown', (ntpclient.failures == 2) and (ntpclient._socket is None), 'sync failed, no exception')
+    except OSError as e:
+        check('linkdown', False, 'raised ' + repr(e))
+
+    # stop
+    ntpclient.start('127.0.0.1')
+    run(ntpclient, lambda: ntpclient._socket is not None)
+    ntpclient.stop()
+    time.sleep(0.5)
+    check('stop', (ntpclient.poll() is None) and (ntpclient._socket is None) and (ntpclient.failures == 2), 'no socket, nothing scheduled')
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
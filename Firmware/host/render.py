@@ -0,0 +1,229 @@
+'''
+Host-side tool: Render an animation offline to look at it without uploading it to the doorsign.
+
+Imports an animation, a module animation_*.py or a keyframe file animation_*.json, with the
+stand-ins from hostport.py and renders it for a number of seconds on a virtual clock, as fast as
+the CPU allows. The frames are written to a file, the format follows from its extension:
+
+  .bin  Raw frames: A header (magic b'DSFR', pixel count, frame ms and frame count as '<HHI')
+        followed by three bytes per pixel and frame, the format of /api/pixels.
+  .png  A strip with one row per frame, the first at the top.
+  .gif  An animation that plays in real time. Frames that do not change are merged.
+
+Reported is the time rendering took per frame: Mean, 99th percentile and worst. Times are
+CPython's, compare them with each other rather than with the doorsign.
+
+Usage: python render.py animation_name [--seconds N] [--output FILE] [--scale N]
+'''
+
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+
+import hostport
+
+def render(animation, frames, frame_ms):
+    import doorsign
+
+    out = doorsign.newFrame()
+    result = []
+    costs = []
+    for i in range(frames):
+        start = time.perf_counter_ns()
+        animation.render(i * frame_ms, out)
+        costs.append((time.perf_counter_ns() - start) // 1000)
+
+        result.append(bytes(doorsign.packPixels(out)))
+        hostport.advance(frame_ms)
+
+    return result, costs
+
+def writeBin(filename, frames, pixel_count, frame_ms):
+    with open(filename, 'wb') as f:
+        f.write(b'DSFR' + struct.pack('<HHI', pixel_count, frame_ms, len(frames)))
+        for frame in frames:
+            f.write(frame)
+
+def _pngChunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def writePng(filename, frames, scale):
+    width = len(frames[0]) // 3 * scale
+    rows = bytearray()
+    for frame in frames:
+        rows.append(0) # Filter: None
+        for i in range(0, len(frame), 3):
+            rows += frame[i:i + 3] * scale
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_pngChunk(b'IHDR', struct.pack('>IIBBBBB', width, len(frames), 8, 2, 0, 0, 0)))
+        f.write(_pngChunk(b'IDAT', zlib.compress(bytes(rows), 9)))
+        f.write(_pngChunk(b'IEND', b''))
+
+'''
+LZW-compress the color indices in data for a GIF image with min_code_size bits per index.
+'''
+def _lzw(data, min_code_size):
+    clear = 1 << min_code_size
+    end = clear + 1
+
+    out = bytearray()
+    bits = 0
+    bit_count = 0
+
+    def write(code, size):
+        nonlocal bits
+        nonlocal bit_count
+        bits |= code << bit_count
+        bit_count += size
+        while bit_count >= 8:
+            out.append(bits & 0xFF)
+            bits >>= 8
+            bit_count -= 8
+
+    table = {}
+    next_code = end + 1
+    size = min_code_size + 1
+    write(clear, size)
+
+    prefix = data[0]
+    for index in data[1:]:
+        key = (prefix << 8) | index
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        write(prefix, size)
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << size):
+                size += 1
+        else:
+            # Table full. Start over.
+            write(clear, size)
+            table = {}
+            next_code = end + 1
+            size = min_code_size + 1
+        prefix = index
+
+    write(prefix, size)
+    write(end, size)
+    if bit_count:
+        out.append(bits & 0xFF)
+
+    return bytes(out)
+
+def _gifImage(frame, scale, delay_cs):
+    pixel_count = len(frame) // 3
+
+    # Few pixels, so few colors: Each frame gets its own color table.
+    colors = []
+    indices = []
+    for i in range(pixel_count):
+        color = frame[i * 3:i * 3 + 3]
+        if color not in colors:
+            colors.append(color)
+        indices.append(colors.index(color))
+
+    table_bits = max(1, (len(colors) - 1).bit_length())
+    colors += [b'\x00\x00\x00'] * ((1 << table_bits) - len(colors))
+
+    row = bytes(index for index in indices for _ in range(scale))
+    min_code_size = max(2, table_bits)
+    data = _lzw(row * scale, min_code_size)
+
+    result = bytearray()
+    result += b'\x21\xf9\x04\x00' + struct.pack('<H', delay_cs) + b'\x00\x00' # Graphic control extension
+    result += b'\x2c' + struct.pack('<HHHH', 0, 0, pixel_count * scale, scale) + bytes([0x80 | (table_bits - 1)])
+    result += b''.join(colors)
+    result.append(min_code_size)
+    for i in range(0, len(data), 255):
+        block = data[i:i + 255]
+        result.append(len(block))
+        result += block
+    result.append(0)
+
+    return result
+
+def writeGif(filename, frames, frame_ms, scale):
+    width = len(frames[0]) // 3 * scale
+
+    with open(filename, 'wb') as f:
+        f.write(b'GIF89a' + struct.pack('<HHBBB', width, scale, 0, 0, 0))
+        f.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00') # Loop forever.
+
+        # Merge runs of equal frames. Delays are in centiseconds, carry the rounding error over.
+        ms = 0
+        shown_ms = 0
+        i = 0
+        while i < len(frames):
+            j = i + 1
+            while (j < len(frames)) and (frames[j] == frames[i]):
+                j += 1
+
+            ms += (j - i) * frame_ms
+            delay_cs = min((ms - shown_ms) // 10, 0xFFFF)
+            shown_ms += delay_cs * 10
+
+            f.write(_gifImage(frames[i], scale, delay_cs))
+            i = j
+
+        f.write(b'\x3b')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Render an animation to a file as fast as possible.')
+    parser.add_argument('animation', help = 'Animation name, e.g. animation_twinkle.')
+    parser.add_argument('--seconds', type = float, default = 60)
+    parser.add_argument('--output', help = 'File to write, .bin, .png or .gif. Default: Only report the cost.')
+    parser.add_argument('--scale', type = int, default = 16, help = 'Size of a pixel in the images.')
+    args = parser.parse_args()
+
+    # Relative to where we were started, not the firmware folder.
+    output = os.path.abspath(args.output) if args.output else None
+
+    hostport.install(virtual_clock = True)
+
+    import doorsign
+    import animation
+
+    os.chdir(hostport.FIRMWARE_FOLDER)
+    files = [f for f in os.listdir() if animation.isAnimationFile(f) and (f.split('.')[0] == args.animation)]
+    if not files:
+        print('Animation \"' + args.animation + '\" not found')
+        return 1
+
+    a = animation.Animation.fromFile(files[0])
+    frame_ms = doorsign.frame_intervall_ms
+    count = int(args.seconds * 1000) // frame_ms
+
+    start = time.perf_counter()
+    frames, costs = render(a, count, frame_ms)
+    elapsed = time.perf_counter() - start
+
+    costs.sort()
+    print('{:d} frames ({:.0f} s) rendered in {:.2f} s'.format(count, count * frame_ms / 1000, elapsed))
+    print('us/frame: mean {:.1f}, p99 {:d}, max {:d}'.format(sum(costs) / len(costs), costs[len(costs) * 99 // 100], costs[-1]))
+
+    if output:
+        ext = os.path.splitext(output)[1].lower()
+        if ext == '.bin':
+            writeBin(output, frames, doorsign.pixel_count, frame_ms)
+        elif ext == '.png':
+            writePng(output, frames, args.scale)
+        elif ext == '.gif':
+            writeGif(output, frames, frame_ms, args.scale)
+        else:
+            print('Unknown format \"' + ext + '\", use .bin, .png or .gif')
+            return 1
+        print('Written to ' + output + ' (' + str(os.path.getsize(output)) + ' bytes)')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+'''
+Host-side test: Step the Wi-Fi supervisor through its states with the WLAN stand-in.
+
+Drives wifi.py the way the network task does, poll() every few ms, on a virtual clock so the
+backoff of minutes runs in no time. The stand-in WLAN from hostport.py joins or fails as told:
+
+  up        The first poll() connects right away and the link comes up. UP is reported once.
+  down      The link is lost. DOWN is reported and the reconnect starts right away.
+  backoff   The network is gone. Attempts fail and are retried after 2, 4, 8, ... s.
+  cap       The backoff stops growing at max_backoff_ms.
+  recover   The network is back. The link comes up and the backoff starts over at 2 s.
+  timeout   Joining never finishes. The attempt is given up after connect_timeout_ms.
+
+Usage: python wifitest.py
+'''
+
+import sys
+
+import hostport
+
+STEP_MS = 10
+
+'''
+Poll every STEP_MS until done() or for at most ms. Returns the events and the times of the
+connection attempts, relative to the start.
+'''
+def run(wifi, wlan, done, ms):
+    import time
+
+    start_ms = time.ticks_ms()
+    connects = wlan.connects
+    events = []
+    attempts = []
+    while time.ticks_diff(time.ticks_ms(), start_ms) < ms:
+        event = wifi.poll()
+        if event:
+            events.append(event)
+        if wlan.connects != connects:
+            connects = wlan.connects
+            attempts.append(time.ticks_diff(time.ticks_ms(), start_ms))
+        if done(events):
+            break
+        hostport.advance(STEP_MS)
+
+    return events, attempts
+
+def gaps(attempts):
+    return [(b - a) // 1000 for a, b in zip(attempts, attempts[1:])]
+
+def main():
+    hostport.install(virtual_clock = True)
+
+    import network
+    import wifi
+
+    failed = 0
+    def check(step, ok, detail):
+        nonlocal failed
+        print('{:8s} {:4s} {:s}'.format(step, 'ok' if ok else 'FAIL', detail))
+        if not ok:
+            failed += 1
+
+    wlan = network.WLAN(network.STA_IF)
+    wifi.setup(wlan, 'doorsign-test', 'secret')
+
+    # up
+    events, attempts = run(wifi, wlan, lambda events: events, 5000)
+    check('up', (events == [wifi.UP]) and (attempts == [0]) and wifi.isUp() and (wifi.connects == 1),
+        'state {}, first attempt after {} ms'.format(wifi.stats()['state'], attempts[0] if attempts else None))
+
+    events, attempts = run(wifi, wlan, lambda events: False, 60 * 1000)
+    check('up', (events == []) and (attempts == []), 'stays up, no further events')
+
+    # down
+    wlan.outcome = -2
+    wlan.drop()
+    events, attempts = run(wifi, wlan, lambda events: events, 1000)
+    check('down', (events == [wifi.DOWN]) and (wifi.losses == 1), 'state {}'.format(wifi.stats()['state']))
+
+    # backoff
+    events, attempts = run(wifi, wlan, lambda events: False, 40 * 1000)
+    expected = [2, 4, 8, 16]
+    check('backoff', (events == []) and (gaps(attempts)[:len(expected)] == expected) and (attempts[0] < 100),
+        'reconnect after {} ms, then every {} s'.format(attempts[0] if attempts else None, gaps(attempts)))
+
+    # cap
+    events, attempts = run(wifi, wlan, lambda events: False, 30 * 60 * 1000)
+    cap_s = wifi.max_backoff_ms // 1000
+    check('cap', max(gaps(attempts)) == cap_s, 'waits {} s'.format(gaps(attempts)))
+
+    # recover
+    wlan.outcome = 3
+    events, attempts = run(wifi, wlan, lambda events: events, 10 * 60 * 1000)
+    up_connects = wifi.connects
+    wlan.outcome = -2
+    wlan.drop()
+    events, attempts = run(wifi, wlan, lambda events: False, 10 * 1000)
+    check('recover', (up_connects == 2) and (events == [wifi.DOWN]) and (gaps(attempts)[:2] == [2, 4]),
+        'up again, then every {} s after the next loss'.format(gaps(attempts)))
+
+    # timeout
+    wlan.outcome = 3
+    run(wifi, wlan, lambda events: events, 60 * 1000)
+    wlan.outcome = 1
+    wlan.drop()
+    failures = wifi.failures
+    events, attempts = run(wifi, wlan, lambda events: False, wifi.connect_timeout_ms + 1000)
+    check('timeout', (wifi.failures == failures + 1) and (wifi.stats()['state'] == 'waiting'),
+        'gave up after {} s'.format(wifi.connect_timeout_ms // 1000))
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
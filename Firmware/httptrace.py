@@ -0,0 +1,128 @@
+'''
+This module times the phases of each HTTP request handled by core0.handleHttp().
+
+The handler calls begin() when a client is ready and phase() at the end of each stretch of work,
+naming the phase the time since the previous call went to. A phase can come up more than once,
+static files are sent alternating between reading from flash and sending. end() classifies the
+request by route and counts its total time in a histogram per route and the time per phase in
+counters, both exported via metrics.py. Requests that took longer than slow_ms are logged and
+kept with their breakdown in a short list for the API.
+
+Only the network task handles requests, so the state is not locked. All it costs per request is
+a few ticks_us() calls, additions into a preallocated array and a handful of metric updates.
+'''
+
+slow_ms = 250 # Log requests that take at least this long.
+slow_count = 8 # Keep this many of them for the API.
+
+import time
+import array
+import metrics
+import logger
+
+# Phases
+ACCEPT = 0 # Accepting the connection.
+RECV = 1 # Receiving the request.
+PARSE = 2 # Splitting up the request and its parameters.
+HANDLE = 3 # Producing the response, e.g. apiData(), a directory listing or writing an upload.
+READ = 4 # Reading a static file from flash.
+SEND = 5 # Sending the header and body.
+
+PHASES = ('accept', 'recv', 'parse', 'handle', 'read', 'send')
+ROUTES = ('api', 'animation', 'static', 'upload', 'probe', 'other')
+
+_bounds = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 1000000)
+_durations = [metrics.histogram('http_request_us', 'Time to handle an HTTP request, by route.', _bounds, 'route=\"' + route + '\"') for route in ROUTES]
+_phase_us = [metrics.counter('http_phase_us_total', 'Time spent handling HTTP requests, by phase.', 'phase=\"' + name + '\"') for name in PHASES]
+
+_us = array.array('l', [0] * len(PHASES)) # Of the current request.
+_last_us = 0
+
+# Results. See stats().
+requests = 0
+last = array.array('l', [0] * len(PHASES)) # Phases of the last complete request.
+last_route = None
+slow = [] # Breakdowns of the last slow requests, newest last.
+
+'''
+Start timing a request.
+'''
+def begin():
+    global _last_us
+
+    for i in range(len(PHASES)):
+        _us[i] = 0
+    _last_us = time.ticks_us()
+
+'''
+The time since the last call went to phase which.
+'''
+def phase(which):
+    global _last_us
+
+    now_us = time.ticks_us()
+    _us[which] += time.ticks_diff(now_us, _last_us)
+    _last_us = now_us
+
+'''
+Which route is a request for? One of ROUTES.
+'''
+def classify(method, resource):
+    if (resource is None) or (method is None):
+        return 'other'
+    elif resource.startswith('/api') or (resource == '/metrics') or (resource == '/manifest'):
+        return 'api'
+    elif resource == '/animation':
+        return 'animation'
+    elif method == 'POST':
+        return 'upload'
+    elif (method == 'GET') or (method == 'HEAD'):
+        return 'static'
+    else:
+        return 'other'
+
+'''
+Finish timing the request, the time since the last call went to phase final. Account for it
+under route, one of ROUTES, see classify().
+'''
+def end(final, route, method = None, resource = None, statuscode = None):
+    global requests
+    global last_route
+
+    phase(final)
+
+    total_us = 0
+    for i in range(len(PHASES)):
+        total_us += _us[i]
+        last[i] = _us[i]
+        metrics.inc(_phase_us[i], _us[i])
+
+    metrics.observe(_durations[ROUTES.index(route)], total_us)
+    requests += 1
+    last_route = route
+
+    if total_us >= slow_ms * 1000:
+        entry = _breakdown(_us)
+        entry['time'] = time.time()
+        entry['route'] = route
+        entry['request'] = str(method) + ' ' + str(resource)
+        entry['status'] = statuscode
+        entry['total_us'] = total_us
+
+        slow.append(entry)
+        while len(slow) > slow_count:
+            slow.pop(0)
+
+        logger.write('Slow request ' + entry['request'] + ': ' + str(total_us // 1000) + ' ms (' + ', '.join(PHASES[i] + ' ' + str(_us[i] // 1000) for i in range(len(PHASES))) + ')')
+
+def _breakdown(us):
+    return {PHASES[i] + '_us': us[i] for i in range(len(PHASES))}
+
+def stats():
+    return {
+        'requests': requests,
+        'last_route': last_route,
+        'last': _breakdown(last),
+        'slow_ms': slow_ms,
+        'slow': slow
+    }
@@ -0,0 +1,290 @@
+'''
+This module keeps a journal of important events on flash.
+
+Each event is a fixed size binary record: Wall clock time, uptime, type and two small arguments.
+Records are appended to segment files journal/NNNN.bin of segment_records each, the oldest
+segments are deleted to keep segment_count of them.
+
+Records are numbered across segments by their position, the sequence number: segment number
+times segment_records plus the index within the segment. It only goes up, unlike the time. The
+RTC starts over at 2021-01-01 on every boot and is only set by NTP later, so the BOOT record and
+anything before the first sync has a time in the past. So instead of searching by time, each
+segment is split into blocks of block_records and the latest time in each block is kept in RAM.
+setup() builds this index reading each segment in one go, the flushes keep it up to date. A query
+for the events since some time seeks to the first block that can hold them, reads it in one go
+and skips the blocks that can't. A query can also start after a sequence number, it then seeks
+right to it.
+
+log() can be called from any task and only appends the record to a buffer in RAM for
+batch_records records. The network task writes the buffer to flash with poll() once it is half
+full or the oldest record is flush_ms old, so the animation task never waits for the flash.
+
+Times are as good as the RTC: Before the first NTP sync they start at whatever the RTC says.
+'''
+
+segment_records = 256
+segment_count = 4
+block_records = 16
+batch_records = 16
+flush_ms = 10 * 1000
+folder = 'journal'
+
+import os
+import time
+import array
+import struct
+import lock
+import logger
+
+# Event types. Stored as a number, names for the API.
+BOOT = 1 # value: machine.reset_cause()
+DOORBELL = 2
+ANIMATION = 3 # arg: index in core1.animations at the time.
+WIFI_UP = 4
+WIFI_DOWN = 5 # value: wlan.status()
+RESET = 6 # Requested via the API.
+NTP_SYNC = 7 # value: Correction in ms, clamped to the range of the field.
+CRASH = 8 # arg: Index of the task, 0 or 1.
+
+names = {
+    BOOT: 'boot',
+    DOORBELL: 'doorbell',
+    ANIMATION: 'animation',
+    WIFI_UP: 'wifi_up',
+    WIFI_DOWN: 'wifi_down',
+    RESET: 'reset',
+    NTP_SYNC: 'ntp_sync',
+    CRASH: 'crash'
+}
+
+RECORD_FORMAT = '<IIHHi' # time_s, uptime_ms, type, arg, value
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+_lock = lock.RecursiveLock() # Protects the buffer.
+_flush_lock = lock.RecursiveLock() # Serializes writing to flash.
+_pending = bytearray(batch_records * RECORD_SIZE)
+_pending_count = 0
+_pending_ms = None # When the oldest pending record was logged.
+
+# One entry per segment on flash, oldest first: [number, record count, latest time_s per block]
+_index = []
+_torn = False # Is the last segment damaged? Then don't append to it.
+
+# Results. See stats().
+records = 0 # Written to flash since boot.
+flushes = 0
+dropped = 0 # Lost because the buffer was full.
+flush_us_max = 0
+
+def _filename(number):
+    return folder + '/' + '{:04d}'.format(number) + '.bin'
+
+def _blocks():
+    return array.array('I', [0] * ((segment_records + block_records - 1) // block_records))
+
+'''
+Account for a record with time_s at index i of a segment in its blocks.
+'''
+def _account(blocks, i, time_s):
+    b = i // block_records
+    if time_s > blocks[b]:
+        blocks[b] = time_s
+
+'''
+Build the index from the segments on flash.
+'''
+def setup():
+    global _torn
+
+    try:
+        os.mkdir(folder)
+    except OSError:
+        pass
+
+    buffer = None
+    numbers = sorted(int(f.split('.')[0]) for f in os.listdir(folder) if f.endswith('.bin'))
+    for number in numbers:
+        size = os.stat(_filename(number))[6]
+        count = min(size // RECORD_SIZE, segment_records)
+        if count == 0:
+            os.remove(_filename(number))
+            continue
+
+        if buffer is None:
+            buffer = bytearray(segment_records * RECORD_SIZE)
+        with open(_filename(number), 'rb') as f:
+            count = min(count, f.readinto(buffer) // RECORD_SIZE)
+
+        blocks = _blocks()
+        for i in range(count):
+            _account(blocks, i, struct.unpack_from('<I', buffer, i * RECORD_SIZE)[0])
+
+        # A torn record at the end means we lost power while writing. Don't append to this
+        # segment, the records would be misaligned.
+        _torn = (size % RECORD_SIZE) != 0
+
+        _index.append([number, count, blocks])
+
+    logger.write('Journal has ' + str(len(_index)) + ' segments')
+
+'''
+Record an event. Cheap, the record is written to flash later by poll().
+'''
+def log(type, arg = 0, value = 0):
+    global _pending_count
+    global _pending_ms
+    global dropped
+
+    _lock.acquire()
+    try:
+        if _pending_count == batch_records:
+            dropped += 1
+            return
+
+        struct.pack_into(RECORD_FORMAT, _pending, _pending_count * RECORD_SIZE, time.time(), time.ticks_ms(), type, arg, value)
+        if _pending_count == 0:
+            _pending_ms = time.ticks_ms()
+        _pending_count += 1
+    finally:
+        _lock.release()
+
+'''
+Write the pending records to flash.
+'''
+def flush():
+    _flush_lock.acquire()
+    try:
+        _flush()
+    finally:
+        _flush_lock.release()
+
+def _flush():
+    global _pending_count
+    global records
+    global flushes
+    global flush_us_max
+    global _torn
+
+    start_us = time.ticks_us()
+
+    # Take the records and release the lock before going to flash.
+    _lock.acquire()
+    try:
+        count = _pending_count
+        batch = bytes(_pending[:count * RECORD_SIZE])
+        _pending_count = 0
+    finally:
+        _lock.release()
+
+    i = 0
+    while i < count:
+        # Start a new segment if the last one is full.
+        if (not _index) or (_index[-1][1] >= segment_records) or _torn:
+            number = (_index[-1][0] + 1) if _index else 0
+            _index.append([number, 0, _blocks()])
+            _torn = False
+            while len(_index) > segment_count:
+                try:
+                    os.remove(_filename(_index.pop(0)[0]))
+                except OSError:
+                    pass
+
+        segment = _index[-1]
+        n = min(count - i, segment_records - segment[1])
+        with open(_filename(segment[0]), 'ab') as f:
+            f.write(batch[i * RECORD_SIZE:(i + n) * RECORD_SIZE])
+
+        for j in range(n):
+            _account(segment[2], segment[1] + j, struct.unpack_from('<I', batch, (i + j) * RECORD_SIZE)[0])
+        segment[1] += n
+        i += n
+
+    records += count
+    flushes += 1
+    flush_us_max = max(flush_us_max, time.ticks_diff(time.ticks_us(), start_us))
+
+'''
+Flush if it's due. Call on every pass of the network task's main loop.
+'''
+def poll():
+    if _pending_count and ((_pending_count >= batch_records // 2) or (time.ticks_diff(time.ticks_ms(), _pending_ms) >= flush_ms)):
+        flush()
+
+'''
+Yield the events at or after time since_s and after sequence number after_seq as tuples
+(seq, time_s, uptime_ms, type, arg, value), in the order they were logged, at most limit of them.
+To page through the journal continue after the seq of the last event returned.
+'''
+def query(since_s = 0, limit = 100, after_seq = -1):
+    count = 0
+    buffer = None
+
+    for number, records_in_segment, blocks in _index[:]:
+        first_seq = number * segment_records
+        start = max(0, after_seq + 1 - first_seq)
+
+        # The first block from start on that can hold events since since_s.
+        b = start // block_records
+        while (b * block_records < records_in_segment) and (blocks[b] < since_s):
+            b += 1
+        if b * block_records >= records_in_segment:
+            continue
+
+        try:
+            f = open(_filename(number), 'rb')
+        except OSError:
+            # Deleted by a flush in the meantime.
+            continue
+
+        if buffer is None:
+            buffer = bytearray(block_records * RECORD_SIZE)
+        with f:
+            while b * block_records < records_in_segment:
+                if blocks[b] < since_s:
+                    b += 1
+                    continue
+
+                first = max(start, b * block_records)
+                f.seek(first * RECORD_SIZE)
+                n = min(records_in_segment, (b + 1) * block_records) - first
+                n = min(n, f.readinto(memoryview(buffer)[:n * RECORD_SIZE]) // RECORD_SIZE)
+                for i in range(n):
+                    record = struct.unpack_from(RECORD_FORMAT, buffer, i * RECORD_SIZE)
+                    if record[0] < since_s:
+                        continue
+                    if count == limit:
+                        return
+                    yield (first_seq + first + i,) + record
+                    count += 1
+                b += 1
+
+    # And the ones not on flash yet. They go to the next segment if the last one is full or torn.
+    _lock.acquire()
+    try:
+        batch = bytes(_pending[:_pending_count * RECORD_SIZE])
+    finally:
+        _lock.release()
+
+    if not _index:
+        seq = 0
+    elif _torn:
+        seq = (_index[-1][0] + 1) * segment_records
+    else:
+        seq = _index[-1][0] * segment_records + _index[-1][1]
+    for i in range(len(batch) // RECORD_SIZE):
+        record = struct.unpack_from(RECORD_FORMAT, batch, i * RECORD_SIZE)
+        if (record[0] >= since_s) and (seq + i > after_seq):
+            if count == limit:
+                return
+            yield (seq + i,) + record
+            count += 1
+
+def stats():
+    return {
+        'segments': len(_index),
+        'pending': _pending_count,
+        'records': records,
+        'flushes': flushes,
+        'dropped': dropped,
+        'flush_us_max': flush_us_max
+    }
@@ -0,0 +1,238 @@
+'''
+This module implements declarative keyframe animations.
+
+Instead of a Python module an animation can be a data file animation_*.json describing a sequence
+of keyframes. The sequence starts with the colors of the first keyframe, blends to each following
+keyframe in turn and then loops back to the first one. Example:
+
+{
+    "enabled": true,
+    "preferred_duration_ms": 3600000,
+    "mask": [1, 3, 5, 7],
+    "steps": 64,
+    "keyframes": [
+        {"color": "random", "duration_ms": 120000, "easing": "inout", "blend": "hsv"}
+    ]
+}
+
+enabled, preferred_duration_ms  As for animation modules.
+mask                            The pixels the animation drives, the others stay off. Default: All.
+steps                           Resolution of a blend, 1 to 255. Default: 64.
+keyframes                       At least one keyframe, each with:
+  color                         The color of all pixels in the mask as 'rrggbb' or [r, g, b], or one of
+                                the generators 'random' (a random color for each pixel) and
+                                'random_uniform' (one random color for all of them). Generators pick
+                                new colors every time the keyframe comes round. Or instead:
+  colors                        A list of colors, one for each pixel in the mask.
+  duration_ms                   How long to blend into this keyframe from the previous one.
+  easing                        'linear' (default), 'in', 'out', 'inout' or 'step'.
+  blend                         'hsv' (default) blends like doorsign.blendPixel(), 'rgb' linearly.
+
+When a file is loaded it is compiled: The easing curves become tables mapping time to a blend step,
+and the blends between keyframes with fixed colors become tables of precomputed pixels. Blends
+involving generated colors get their tables when they start and fill them in as the steps are
+reached. Rendering a frame is then integer arithmetic and table lookups, nothing is allocated
+once a table is complete. Frames in between steps are reported as unchanged.
+'''
+
+default_steps = 64
+
+import time
+import ujson
+import doorsign
+
+OFF = (0, 0, 0)
+
+_generators = ('random', 'random_uniform')
+
+# Easing curves, mapping time (0.0 to 1.0) into the blend (0.0 to 1.0).
+_easings = {
+    'linear': lambda x: x,
+    'in': lambda x: x * x,
+    'out': lambda x: 1.0 - (1.0 - x) * (1.0 - x),
+    'inout': lambda x: x * x * (3.0 - 2.0 * x),
+    'step': lambda x: 1.0 if x >= 1.0 else 0.0
+}
+
+_blends = {
+    'hsv': doorsign.blendPixel,
+    'rgb': doorsign.blendPixelLinear
+}
+
+def _color(value):
+    if isinstance(value, str):
+        return doorsign.parsePixel(value.lstrip('#'))
+    return (doorsign.clamp(value[0]), doorsign.clamp(value[1]), doorsign.clamp(value[2]))
+
+'''
+A table of steps+1 pixels blending from start to end. The first and last entries are the end
+points, the others are filled in on demand by lookup().
+'''
+def _table(start, end, steps):
+    table = [None] * (steps + 1)
+    table[0] = start
+    table[steps] = end
+    if start == end:
+        for step in range(1, steps):
+            table[step] = start
+    return table
+
+'''
+Tables for blending each pixel from colors1 to colors2. Pixels with the same end points share a table.
+'''
+def _tables(colors1, colors2, steps):
+    shared = {}
+    tables = []
+    for i in range(len(colors1)):
+        key = (colors1[i], colors2[i])
+        if key not in shared:
+            shared[key] = _table(colors1[i], colors2[i], steps)
+        tables.append(shared[key])
+    return tables
+
+class Keyframe:
+
+    def __init__(self, spec, count, steps, name):
+        self.duration_ms = max(1, int(spec.get('duration_ms', 1000)))
+        self.tables = None # Precompiled blend into this keyframe, see Program.
+
+        if spec.get('easing', 'linear') not in _easings:
+            raise RuntimeError(name + ': Unknown easing ' + str(spec['easing']))
+        easing = _easings[spec.get('easing', 'linear')]
+        self.ease = bytearray(round(easing(t / steps) * steps) for t in range(steps + 1))
+
+        if spec.get('blend', 'hsv') not in _blends:
+            raise RuntimeError(name + ': Unknown blend ' + str(spec['blend']))
+        self.blend = _blends[spec.get('blend', 'hsv')]
+
+        if 'colors' in spec:
+            if len(spec['colors']) != count:
+                raise RuntimeError(name + ': Expected ' + str(count) + ' colors, got ' + str(len(spec['colors'])))
+            self.generator = None
+            self.colors = [_color(c) for c in spec['colors']]
+        elif spec.get('color') in _generators:
+            self.generator = spec['color']
+            self.colors = None
+        elif 'color' in spec:
+            self.generator = None
+            self.colors = [_color(spec['color'])] * count
+        else:
+            raise RuntimeError(name + ': Keyframe without color')
+
+    # The colors for this keyframe. Generators produce new ones on each call.
+    def generate(self, count):
+        if self.generator == 'random':
+            return [doorsign.randomColor() for i in range(count)]
+        elif self.generator == 'random_uniform':
+            return [doorsign.randomColor()] * count
+        return self.colors
+
+class Program:
+    '''
+    A compiled keyframe animation. Animation.render() treats it like an animation module with a
+    renderer class, see animation.py.
+    '''
+
+    def __init__(self, spec, name = ''):
+        self.mask = spec.get('mask') or list(range(doorsign.pixel_count))
+        for i in self.mask:
+            if (i < 0) or (i >= doorsign.pixel_count):
+                raise RuntimeError(name + ': Pixel ' + str(i) + ' in mask out of range')
+        self.unmasked = [i for i in range(doorsign.pixel_count) if i not in self.mask]
+
+        self.steps = min(max(1, int(spec.get('steps', default_steps))), 255)
+
+        if not spec.get('keyframes'):
+            raise RuntimeError(name + ': No keyframes')
+        count = len(self.mask)
+        self.keyframes = [Keyframe(k, count, self.steps, name) for k in spec['keyframes']]
+
+        # Precompute the blends between keyframes with fixed colors. They are the same every time round.
+        for i in range(len(self.keyframes)):
+            previous = self.keyframes[i - 1]
+            keyframe = self.keyframes[i]
+            if (previous.generator is None) and (keyframe.generator is None):
+                keyframe.tables = _tables(previous.colors, keyframe.colors, self.steps)
+                for table in keyframe.tables:
+                    for step in range(self.steps + 1):
+                        lookup(table, step, self.steps, keyframe.blend)
+
+    def renderer(self):
+        return Renderer(self)
+
+'''
+Look up a step in a table, computing it if it isn't there yet.
+'''
+def lookup(table, step, steps, blend):
+    pixel = table[step]
+    if pixel is None:
+        pixel = blend(table[0], table[steps], step / steps)
+        table[step] = pixel
+    return pixel
+
+class Renderer:
+    __slots__ = ('program', 'index', 'colors', 'tables', 'start_ms', 'step')
+
+    def __init__(self, program):
+        self.program = program
+        self.index = 0 # The keyframe we are blending into.
+        self.colors = None # The colors we are blending from.
+        self.tables = None
+        self.start_ms = None
+        self.step = None # The step rendered last.
+
+    # Start blending into the next keyframe.
+    def advance(self, frame_ms):
+        program = self.program
+
+        keyframe = program.keyframes[self.index]
+        if self.colors is None:
+            # First frame. Blend from the first keyframe.
+            self.colors = keyframe.generate(len(program.mask))
+        else:
+            self.colors = [table[program.steps] for table in self.tables]
+
+        self.index = (self.index + 1) % len(program.keyframes)
+        keyframe = program.keyframes[self.index]
+        if keyframe.tables is not None:
+            self.tables = keyframe.tables
+        else:
+            self.tables = _tables(self.colors, keyframe.generate(len(program.mask)), program.steps)
+
+        self.start_ms = frame_ms
+        self.step = None
+
+    def render(self, frame_ms, out):
+        program = self.program
+
+        if self.start_ms is None:
+            self.advance(frame_ms)
+
+        keyframe = program.keyframes[self.index]
+        elapsed = time.ticks_diff(frame_ms, self.start_ms)
+        if elapsed >= keyframe.duration_ms:
+            self.advance(frame_ms)
+            keyframe = program.keyframes[self.index]
+            elapsed = 0
+
+        steps = program.steps
+        step = keyframe.ease[elapsed * steps // keyframe.duration_ms]
+        if step == self.step:
+            return False
+        self.step = step
+        
+        mask = program.mask
+        tables = self.tables
+        for i in range(len(mask)):
+            out[mask[i]] = lookup(tables[i], step, steps, keyframe.blend)
+        for i in program.unmasked:
+            out[i] = OFF
+
+'''
+Read a keyframe animation file and compile it.
+'''
+def load(filename):
+    with open(filename) as f:
+        spec = ujson.load(f)
+
+    return Program(spec, filename)
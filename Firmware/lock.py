@@ -8,6 +8,10 @@ See __main__ for usage.
 import _thread
 import time
 import random
+import metrics
+
+_waits = metrics.counter('lock_waits_total', 'Lock acquisitions that had to wait for another thread.')
+_wait_us = metrics.counter('lock_wait_us_total', 'Time spent waiting for locks held by another thread.')
 
 class RecursiveLock:
     
@@ -57,8 +61,12 @@ class RecursiveLock:
                 # ..so we can aqcuire it here. This will block if another thread
                 # is holding the lock. But because we have released synclock1 if
                 # they want to release the actual lock they can and we can go on
-                # here.
-                self._lock.acquire()
+                # here. Try without blocking first to count the waits.
+                if not self._lock.acquire(0):
+                    start_us = time.ticks_us()
+                    self._lock.acquire()
+                    metrics.inc(_waits)
+                    metrics.inc(_wait_us, time.ticks_diff(time.ticks_us(), start_us))
                 
                 # ..we still have synclock2. So we still are alone here and and can
                 # update internal state to note it is ours.
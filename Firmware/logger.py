@@ -12,6 +12,9 @@ import os
 import time
 import _thread
 import lock
+import metrics
+
+_lines = metrics.counter('log_lines_total', 'Lines written to the log.')
 
 _logger_lock = lock.RecursiveLock()
 _thread_names = {}
@@ -77,6 +80,7 @@ def write(msg):
         )
         
         print(msg)
+        metrics.inc(_lines)
 
         if logfile_count:
             try:
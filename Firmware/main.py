@@ -6,19 +6,58 @@ The top-level architecture uses two threads hopefully run on the two cores of th
 core0, this main thread, is used to execute the network code.
 core1, started from here, runs the pixel animation.
 
-The code in this module does some simple initialization and then starts both threads.
+The code in this module does some simple initialization and then starts both threads. The
+animation is started as early as possible, the network connects in the background. See bootlog.py
+for the timing of the boot phases.
 '''
 
 import sys
 import os
 import rp2
 import time
+import machine
 import _thread
 import core0
 import core1
 import logger
 import doorsign
 import watchdog
+import bootlog
+import sensors
+import doorbell
+import journal
+import crashlog
+
+bootlog.mark('imports')
+
+'''
+Should we wait for a KeyboardInterrupt before starting up? Only if asked for in config.json
+with BOOT.standby_s or by holding the pin BOOT.standby_pin low while booting.
+'''
+def standbySeconds():
+    boot = core0.config().get('BOOT', {})
+    
+    standby_s = boot.get('standby_s', 0)
+    
+    if boot.get('standby_pin') is not None:
+        if machine.Pin(boot['standby_pin'], machine.Pin.IN, machine.Pin.PULL_UP).value() == 0:
+            logger.write('Standby pin held')
+            standby_s = max(standby_s, 4)
+            
+    return standby_s
+    
+'''
+Run the animation task, recording the exception if it fails. The watchdog resets us after
+that because the task no longer feeds it.
+'''
+def animationTask():
+    try:
+        core1.task()
+    except Exception as e:
+        logger.write('FATAL - {:s}: {:s}'.format(type(e).__name__, str(e)))
+        crashlog.record(1, e)
+        
+        raise e
     
 def Main():
 
@@ -59,23 +98,33 @@ def Main():
             mrc = str(mrc)
         logger.write('Last reset cause was ' + mrc)
 
+        # Give each task a chance to set up in a single threaded environment. The network
+        # only reads its configuration here and connects later in the background.
+        core0.setup()
+        
+        journal.setup()
+        journal.log(journal.BOOT, 0, machine.reset_cause())
+        crashlog.setup(mrc)
+        
         # Wait a while to allow for a CTRL-C in case the code is broken
         # and cannot be stopped later.
-        logger.write('Standing by for KeyboardInterrupt')
-        for _ in range(40):
-            time.sleep(0.1)
+        standby_s = standbySeconds()
+        if standby_s:
+            logger.write('Standing by for KeyboardInterrupt')
+            for _ in range(standby_s * 10):
+                time.sleep(0.1)
 
         logger.write('Starting up')
 
-        # Give each task a chance to set up in a single threaded environment.
-        core0.setup()
-        core1.setup()
+        sensors.setup(core0.config().get('SENSORS', {}))
+        doorbell.setup(core0.config().get('DOORBELL', {}))
+        core1.setup(core0.config().get('LAYERS', []))
 
         # Enable hardware watchdog timer.
         watchdog.enable()
 
         # Start both threads.
-        _thread.start_new_thread(core1.task, ()) # NO braces after core1.task, we are passing the function...
+        _thread.start_new_thread(animationTask, ()) # NO braces after animationTask, we are passing the function...
         core0.task()
 
         # We really don't expect to get here.
@@ -88,10 +137,7 @@ def Main():
     except Exception as e:
     
         logger.write('FATAL - {:s}: {:s}'.format(type(e).__name__, str(e)))
-        
-        with open('/core.txt', 'a+') as f:
-            y, mo, d, h, mi, s, _, _ = time.gmtime()
-            f.write('{:04d}.{:02d}.{:02d} {:02d}:{:02d}:{:02d}: {:s} - {:s}\n'.format(y, mo, d, h, mi, s, type(e).__name__, str(e)))
+        crashlog.record(0, e)
         
         raise e
     
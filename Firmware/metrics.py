@@ -0,0 +1,174 @@
+'''
+This module keeps counters, gauges and histograms for monitoring and renders them in the
+Prometheus text format for /metrics.
+
+Each metric is registered once when the module that updates it is imported and is then addressed
+by the index returned. Values live in arrays allocated up front, so updating a counter or
+histogram is an index and an add: No allocation and no lock. Both tasks may update the same
+metric, a race can then lose an increment now and then, which is fine for monitoring.
+
+Counters a module already keeps for its stats() are not duplicated. They are registered here too
+and copied over with store() by core0.collectMetrics() when /metrics is scraped, as are the
+gauges.
+
+Histograms have fixed integer bucket bounds given at registration. Observed values are integers,
+typically milliseconds or microseconds.
+'''
+
+max_counters = 48
+max_gauges = 16
+max_histograms = 16
+max_buckets = 160 # Over all histograms, including the +Inf bucket of each.
+prefix = 'doorsign_'
+
+import array
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+_counters = array.array('Q', [0] * max_counters)
+_counter_count = 0
+
+_gauges = [0] * max_gauges
+_gauge_count = 0
+
+_buckets = array.array('Q', [0] * max_buckets) # Per bucket, not cumulative.
+_bucket_count = 0
+_sums = array.array('Q', [0] * max_histograms)
+_bounds = [] # Per histogram: Tuple of the upper bounds of its buckets, excluding +Inf.
+_offsets = array.array('H', [0] * max_histograms) # Per histogram: Its first bucket in _buckets.
+
+# In order of registration: (kind, name, help, labels, index)
+_metrics = []
+
+def _register(kind, name, help, labels, index):
+    _metrics.append((kind, prefix + name, help, labels, index))
+    return index
+
+'''
+Register a counter and return its index for inc() and store(). labels is a preformatted label
+string like 'code="2xx"', metrics with the same name and different labels make up one family.
+'''
+def counter(name, help, labels = ''):
+    global _counter_count
+
+    if _counter_count == max_counters:
+        raise RuntimeError('Too many counters, raise metrics.max_counters')
+
+    _counter_count += 1
+    return _register(COUNTER, name, help, labels, _counter_count - 1)
+
+'''
+Register a gauge and return its index for setGauge().
+'''
+def gauge(name, help, labels = ''):
+    global _gauge_count
+
+    if _gauge_count == max_gauges:
+        raise RuntimeError('Too many gauges, raise metrics.max_gauges')
+
+    _gauge_count += 1
+    return _register(GAUGE, name, help, labels, _gauge_count - 1)
+
+'''
+Register a histogram with buckets for values up to each of the ascending bounds and one for
+everything above. Returns its index for observe().
+'''
+def histogram(name, help, bounds, labels = ''):
+    global _bucket_count
+
+    index = len(_bounds)
+    if index == max_histograms:
+        raise RuntimeError('Too many histograms, raise metrics.max_histograms')
+    if _bucket_count + len(bounds) + 1 > max_buckets:
+        raise RuntimeError('Too many buckets, raise metrics.max_buckets')
+
+    _bounds.append(tuple(bounds))
+    _offsets[index] = _bucket_count
+    _bucket_count += len(bounds) + 1
+    return _register(HISTOGRAM, name, help, labels, index)
+
+'''
+Add n to counter i.
+'''
+def inc(i, n = 1):
+    _counters[i] += n
+
+'''
+Set counter i to value. For counters kept elsewhere, see above.
+'''
+def store(i, value):
+    _counters[i] = value
+
+'''
+Set gauge i to value.
+'''
+def setGauge(i, value):
+    _gauges[i] = value
+
+'''
+Count value in histogram i.
+'''
+def observe(i, value):
+    bounds = _bounds[i]
+    n = len(bounds)
+    b = 0
+    while (b < n) and (value > bounds[b]):
+        b += 1
+
+    _buckets[_offsets[i] + b] += 1
+    _sums[i] += value
+
+'''
+Read histogram i back: Returns a list of (bound, count) with bound None for the +Inf bucket,
+counts not cumulative, and the sum of the values observed.
+'''
+def buckets(i):
+    offset = _offsets[i]
+    bounds = _bounds[i]
+    result = [(bounds[b], _buckets[offset + b]) for b in range(len(bounds))]
+    result.append((None, _buckets[offset + len(bounds)]))
+    return result, _sums[i]
+
+def _series(name, labels, value, extra = ''):
+    if labels and extra:
+        labels = labels + ',' + extra
+    elif extra:
+        labels = extra
+
+    if labels:
+        return name + '{' + labels + '} ' + str(value) + '\n'
+    return name + ' ' + str(value) + '\n'
+
+'''
+Yield the metrics in the Prometheus text format, one family at a time.
+'''
+def chunks():
+    done = []
+    for kind, name, help, labels, index in _metrics:
+        if name in done:
+            continue
+        done.append(name)
+
+        yield '# HELP ' + name + ' ' + help + '\n# TYPE ' + name + ' ' + kind + '\n'
+
+        for kind2, name2, help2, labels2, index2 in _metrics:
+            if name2 != name:
+                continue
+
+            if kind == COUNTER:
+                yield _series(name, labels2, _counters[index2])
+            elif kind == GAUGE:
+                yield _series(name, labels2, _gauges[index2])
+            else:
+                offset = _offsets[index2]
+                bounds = _bounds[index2]
+                count = 0
+                for b in range(len(bounds)):
+                    count += _buckets[offset + b]
+                    yield _series(name + '_bucket', labels2, count, 'le=\"' + str(bounds[b]) + '\"')
+                count += _buckets[offset + len(bounds)]
+                yield _series(name + '_bucket', labels2, count, 'le=\"+Inf\"')
+                yield _series(name + '_sum', labels2, _sums[index2])
+                yield _series(name + '_count', labels2, count)
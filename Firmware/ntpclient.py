@@ -0,0 +1,294 @@
+'''
+This module implements a non-blocking NTP client driven from the network task's select() loop.
+
+At its most basic, the NTP protocol is a clock request transaction, where a client requests the
+current time from a server, passing its own time with the request. The server adds its time to
+the data packet and passes the packet back to the client. When the client receives the packet,
+the client can derive two essential pieces of information: the reference time at the server and
+the elapsed time, as measured by the local clock, for a signal to pass from the client to the
+server and back again.
+
+We send a few requests per sync and keep the sample with the shortest round trip. Half of the
+round trip (minus the time the server took) is added to the server's transmit time to get the
+time at the moment we received the answer. Each request carries a random transmit timestamp
+that the server echoes back as the originate timestamp. Answers that don't match the latest
+request, e.g. late ones to a request that timed out, are dropped. Their round trip would be
+measured from the wrong send time.
+
+Usage: Call start() once with the server name. Then call poll() on every pass of the loop. If it
+returns a socket add it to the ones select() waits on and call receive() when it is readable.
+Call stop() when the network goes away and start() again when it is back.
+
+The RTC only has a resolution of seconds, too coarse to tell how well it keeps time. Instead
+the network time that passed between two syncs is compared with the ticks_ms() that passed
+locally, both in ms. Ticks and RTC run off the same crystal. The difference is the error the
+clock built up, it gives the drift. The interval to the next sync adapts: It doubles while the
+error stays within max_error_ms and halves when it does not. Failures are retried with an
+increasing backoff.
+'''
+
+sample_count = 4
+sample_timeout_ms = 2000
+max_error_ms = 500
+min_interval_ms = 60 * 60 * 1000
+max_interval_ms = 24 * 60 * 60 * 1000
+retry_interval_ms = 60 * 1000
+resolve_interval_ms = 24 * 60 * 60 * 1000 # Look up the server address again after this long.
+
+NTP_DELTA = 2208988800
+NTP_PORT = 123
+
+import machine
+import socket
+import struct
+import time
+import random
+import logger
+import journal
+import bootlog
+
+_server = None
+_addr = None
+_addr_ms = None
+
+_socket = None
+_request = None
+_sent_ms = None
+_nonce = bytearray(8) # Transmit timestamp of the latest request.
+_tries = 0
+_samples = [] # (delay_ms, server_ms, received_ms)
+
+_next_sync_ms = None
+_interval_ms = min_interval_ms
+_retry_ms = retry_interval_ms
+
+# Results. See stats().
+synced = False
+syncs = 0
+failures = 0
+last_sync_ms = None
+last_network_ms = None # Network time at the last sync.
+last_offset_ms = None
+last_error_ms = None
+last_delay_ms = None
+drift_ppm = None
+
+'''
+Start syncing with server as soon as possible. Call again to sync right away, e.g. after
+reconnecting to the network.
+'''
+def start(server):
+    global _server
+    global _next_sync_ms
+
+    _server = server
+    _next_sync_ms = time.ticks_ms()
+
+'''
+Stop syncing, e.g. when the network is lost. Drops an exchange in progress, start() resumes.
+'''
+def stop():
+    global _next_sync_ms
+
+    _close()
+    del _samples[:]
+    _next_sync_ms = None
+
+def _resolve(now_ms):
+    global _addr
+    global _addr_ms
+
+    # getaddrinfo() blocks for a DNS lookup. Only do that once in a while.
+    if (_addr is None) or (time.ticks_diff(now_ms, _addr_ms) >= resolve_interval_ms):
+        _addr = socket.getaddrinfo(_server, NTP_PORT)[0][-1]
+        _addr_ms = now_ms
+
+    return _addr
+
+def _send(now_ms):
+    global _sent_ms
+    global _tries
+
+    _tries += 1
+    _sent_ms = now_ms
+    struct.pack_into('!II', _nonce, 0, random.getrandbits(32), random.getrandbits(32))
+    _request[40:48] = _nonce
+    _socket.sendto(_request, _addr)
+
+'''
+Send the next request of a sync. If that fails, e.g. because the link just went down, the sync
+fails as a whole.
+'''
+def _next(now_ms):
+    try:
+        _send(now_ms)
+    except Exception as e:
+        logger.write('Error requesting network time (' + str(e) + ')')
+        del _samples[:]
+        _finish(now_ms)
+
+def _begin(now_ms):
+    global _socket
+    global _request
+    global _tries
+
+    _tries = 0
+    del _samples[:]
+
+    if _request is None:
+        _request = bytearray(48)
+        _request[0] = 0x1B # LI = 0, Version = 3, Mode = 3 (client)
+
+    _resolve(now_ms)
+    _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _socket.setblocking(False)
+    _send(now_ms)
+
+def _close():
+    global _socket
+
+    if _socket:
+        _socket.close()
+        _socket = None
+
+'''
+Convert a 64 bit NTP timestamp at offset in data to ms since the epoch used by time.time().
+'''
+def _timestamp_ms(data, offset):
+    seconds, fraction = struct.unpack_from('!II', data, offset)
+    return (seconds - NTP_DELTA) * 1000 + ((fraction * 1000) >> 32)
+
+def _finish(now_ms):
+    global _addr
+    global _next_sync_ms
+    global _interval_ms
+    global _retry_ms
+    global synced
+    global syncs
+    global failures
+    global last_sync_ms
+    global last_network_ms
+    global last_offset_ms
+    global last_error_ms
+    global last_delay_ms
+    global drift_ppm
+
+    _close()
+
+    if not _samples:
+        failures += 1
+        logger.write('Error requesting network time from ' + _server)
+
+        # Maybe the address has changed. Look it up again next time.
+        _addr = None
+
+        _next_sync_ms = time.ticks_add(now_ms, _retry_ms)
+        _retry_ms = min(_retry_ms * 2, min_interval_ms)
+        return
+
+    # Use the sample with the shortest round trip and advance it to now.
+    delay_ms, server_ms, received_ms = min(_samples)
+    network_ms = server_ms + time.ticks_diff(now_ms, received_ms)
+
+    # How far off was the RTC? It only has a resolution of seconds, so this is a rough number.
+    offset_ms = network_ms - time.time() * 1000
+
+    # How much did the clock gain or lose since the last sync? See above.
+    if synced:
+        elapsed_ms = max(time.ticks_diff(now_ms, last_sync_ms), 1)
+        last_error_ms = (network_ms - last_network_ms) - elapsed_ms
+        drift_ppm = last_error_ms * 1000000 // elapsed_ms
+
+    # Update RTC, rounded to the nearest second.
+    tm = time.gmtime((network_ms + 500) // 1000)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+    # Adapt the interval to how well the RTC kept time. The first sync after boot says nothing
+    # about that.
+    if synced:
+        if abs(last_error_ms) <= max_error_ms:
+            _interval_ms = min(_interval_ms * 2, max_interval_ms)
+        else:
+            _interval_ms = max(_interval_ms // 2, min_interval_ms)
+
+    bootlog.mark('ntp')
+    
+    synced = True
+    syncs += 1
+    last_sync_ms = now_ms
+    last_network_ms = network_ms
+    last_offset_ms = offset_ms
+    last_delay_ms = delay_ms
+    _retry_ms = retry_interval_ms
+    _next_sync_ms = time.ticks_add(now_ms, _interval_ms)
+
+    journal.log(journal.NTP_SYNC, 0, max(-0x7fffffff, min(offset_ms, 0x7fffffff)))
+    logger.write('RTC synced with network time, offset was ' + str(offset_ms) + ' ms, clock error ' + str(last_error_ms) + ' ms, round trip ' + str(delay_ms) + ' ms')
+
+'''
+Advance the state of the client. Returns the socket to wait on for an answer or None.
+'''
+def poll():
+    if _next_sync_ms is None:
+        return None
+
+    now_ms = time.ticks_ms()
+
+    if _socket is None:
+        if time.ticks_diff(_next_sync_ms, now_ms) <= 0:
+            try:
+                _begin(now_ms)
+            except Exception as e:
+                logger.write('Error starting network time sync (' + str(e) + ')')
+                del _samples[:]
+                _finish(now_ms)
+    elif time.ticks_diff(now_ms, _sent_ms) >= sample_timeout_ms:
+        # No answer to this request.
+        if _tries < sample_count:
+            _next(now_ms)
+        else:
+            _finish(now_ms)
+
+    return _socket
+
+'''
+Read an answer from the socket returned by poll().
+'''
+def receive():
+    now_ms = time.ticks_ms()
+
+    try:
+        data = _socket.recv(48)
+    except OSError:
+        return
+
+    # Only the answer to the latest request. Keep waiting for it otherwise.
+    if (len(data) < 48) or (data[24:32] != _nonce):
+        return
+
+    # Only accept answers from a server (mode 4) that is synchronized (stratum not 0).
+    if (len(data) >= 48) and ((data[0] & 0x07) == 4) and data[1]:
+        # Round trip minus the time the server took between receiving and sending.
+        server_received_ms = _timestamp_ms(data, 32)
+        server_sent_ms = _timestamp_ms(data, 40)
+        delay_ms = time.ticks_diff(now_ms, _sent_ms) - (server_sent_ms - server_received_ms)
+
+        _samples.append((delay_ms, server_sent_ms + delay_ms // 2, now_ms))
+
+    if (len(_samples) >= sample_count) or (_tries >= sample_count):
+        _finish(now_ms)
+    else:
+        _next(now_ms)
+
+def stats():
+    return {
+        'synced': synced,
+        'syncs': syncs,
+        'failures': failures,
+        'offset_ms': last_offset_ms,
+        'error_ms': last_error_ms,
+        'delay_ms': last_delay_ms,
+        'drift_ppm': drift_ppm,
+        'interval_s': _interval_ms // 1000,
+        'since_sync_s': (time.ticks_diff(time.ticks_ms(), last_sync_ms) // 1000) if synced else None
+    }
@@ -0,0 +1,377 @@
+'''
+This module implements the filesystem side of the poor man's OTA update.
+
+Files are uploaded one by one with receiveFile() or many at once as a tar archive with
+receiveBundle(). Both stream the request body through one reusable buffer, verify it if
+the client sent a checksum and only replace existing files once everything has been
+received. manifest() lists all files on the device with size and hash so a host tool can
+work out which files actually need to be sent. The hashes are cached, see fileHash().
+
+The network specifics are left to core0, it hands us a BodyReader for the request.
+'''
+
+upload_buffer_size = 4096
+upload_reserve_bytes = 16 * 1024 # Keep at least this much space free on the filesystem.
+fsstats_ttl_ms = 5 * 60 * 1000
+hash_settle_s = 2 # Don't cache the hash of a file modified less than this long ago.
+
+import os
+import time
+import hashlib
+import ubinascii
+import watchdog
+import logger
+
+_upload_buffer = None
+
+_fsstats = None
+_fsstats_ms = None
+
+_hashes = {} # path -> (size, mtime, hex digest)
+
+'''
+Filesystem statistics are expensive to query because os.statvfs() goes to flash. Cache them for
+a while and invalidate the cache when we know they have changed, i.e. after uploads and deletes.
+
+Returns a tuple (size_bytes, free_bytes).
+'''
+def fsStats():
+    global _fsstats
+    global _fsstats_ms
+
+    now_ms = time.ticks_ms()
+    if (_fsstats is None) or (time.ticks_diff(now_ms, _fsstats_ms) >= fsstats_ttl_ms):
+        v = os.statvfs('/')
+        _fsstats = (v[1]*v[2], v[0]*v[3])
+        _fsstats_ms = now_ms
+
+    return _fsstats
+
+def invalidateFSStats():
+    global _fsstats
+
+    _fsstats = None
+
+'''
+Raise the same error as the filesystem would if there is not enough room for size more bytes.
+'''
+def checkFreeSpace(size):
+    invalidateFSStats()
+    if size + upload_reserve_bytes > fsStats()[1]:
+        raise OSError(28)
+
+'''
+The buffer used for all transfers. Allocated once on first use and then kept around to avoid
+fragmenting the heap.
+'''
+def uploadBuffer():
+    global _upload_buffer
+
+    if _upload_buffer is None:
+        _upload_buffer = bytearray(upload_buffer_size)
+
+    return memoryview(_upload_buffer)
+
+'''
+Reads a request body of known length from a client socket. The part of the body that has
+already been received together with the headers is handed out first.
+
+If a SHA-256 or CRC32 (as hex digits) is given the data is hashed as it passes through and
+can be checked with verify() at the end.
+'''
+class BodyReader:
+
+    def __init__(self, cl, request_body, contentlength, sha256 = None, crc32 = None):
+        self.length = contentlength
+        self.remaining = contentlength
+
+        self._cl = cl
+        self._pending = request_body
+        self._sha256 = sha256
+        self._sha256_hash = hashlib.sha256() if sha256 else None
+        self._crc32 = crc32
+        self._crc32_value = 0
+
+    # Read up to len(buf) bytes into buf. Returns the number of bytes read, 0 at the end of
+    # the body. Raises if the client closes the connection early. The socket has a timeout
+    # set so a stalled client makes this raise as well.
+    def readinto(self, buf):
+        if self.remaining <= 0:
+            return 0
+
+        n = min(len(buf), self.remaining)
+
+        if self._pending:
+            n = min(n, len(self._pending))
+            buf[:n] = self._pending[:n]
+            self._pending = self._pending[n:]
+        else:
+            watchdog.feed()
+            n = self._cl.readinto(buf, n)
+            if not n:
+                raise RuntimeError('Connection closed after ' + str(self.length - self.remaining) + ' of ' + str(self.length) + ' bytes')
+
+        if self._sha256_hash:
+            self._sha256_hash.update(buf[:n])
+        if self._crc32:
+            self._crc32_value = ubinascii.crc32(buf[:n], self._crc32_value)
+
+        self.remaining -= n
+        return n
+
+    # Fill buf[:n] completely.
+    def readexactly(self, buf, n):
+        got = 0
+        while got < n:
+            r = self.readinto(buf[got:n])
+            if not r:
+                raise RuntimeError('Unexpected end of data')
+            got += r
+
+        return n
+
+    # Read and discard the rest of the body.
+    def drain(self, buf):
+        while self.readinto(buf):
+            pass
+
+    # Raise if the data received does not match the checksums given.
+    def verify(self):
+        if self._sha256_hash and (ubinascii.hexlify(self._sha256_hash.digest()).decode() != self._sha256.lower()):
+            raise RuntimeError('SHA-256 mismatch')
+        if self._crc32 and (self._crc32_value != int(self._crc32, 16)):
+            raise RuntimeError('CRC32 mismatch')
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+'''
+Create all folders leading up to path if they don't exist.
+'''
+def makeDirs(path):
+    folder = ''
+    for part in path.split('/')[1:-1]:
+        folder += '/' + part
+        try:
+            os.mkdir(folder)
+        except OSError:
+            pass
+
+'''
+Receive a single file. The data goes to a temporary file next to the destination which only
+replaces the destination when all data has been received and verified.
+
+Returns the number of bytes written and the time taken in ms.
+'''
+def receiveFile(body, path):
+    start_ms = time.ticks_ms()
+
+    # Check for free space before we start. The old file is only removed at the very end so we need
+    # room for the complete new file.
+    checkFreeSpace(body.length)
+
+    buf = uploadBuffer()
+    temppath = path + '.tmp'
+    try:
+        with open(temppath, 'wb') as dest:
+            while True:
+                n = body.readinto(buf)
+                if not n:
+                    break
+                dest.write(buf[:n])
+
+        body.verify()
+
+        # Rename over the destination. On littlefs this replaces an existing file atomically.
+        os.rename(temppath, path)
+
+    except:
+        _remove(temppath)
+        raise
+
+    finally:
+        invalidateFSStats()
+
+    return body.length, time.ticks_diff(time.ticks_ms(), start_ms)
+
+'''
+Receive a tar archive of many files and apply it as a whole.
+
+All files are first staged as <path>.new. Only when the complete archive has been received and
+verified are the staged files swapped in, keeping the previous versions as <path>.old. If any
+step fails everything is rolled back to the previous state. The .old files are removed at
+the very end.
+
+Member names are relative to the root folder. Only regular files are processed, folders are
+created as needed.
+
+Returns the number of files and bytes written and the time taken in ms.
+'''
+def receiveBundle(body):
+    start_ms = time.ticks_ms()
+
+    checkFreeSpace(body.length)
+
+    buf = uploadBuffer()
+    staged = []
+    written = 0
+    try:
+        # Stage.
+        while True:
+            body.readexactly(buf, 512)
+            if buf[0] == 0:
+                # End-of-archive marker. Ignore the rest.
+                body.drain(buf)
+                break
+
+            name = bytes(buf[0:100]).rstrip(b'\0').decode()
+            prefix = bytes(buf[345:500]).rstrip(b'\0').decode() # ustar
+            if prefix:
+                name = prefix + '/' + name
+            if name.startswith('./'):
+                name = name[2:]
+            size = int(bytes(buf[124:136]).rstrip(b'\0 ').decode() or '0', 8)
+            typeflag = buf[156]
+            padding = ((size + 511) & ~511) - size
+
+            if (typeflag == ord('0')) or (typeflag == 0):
+                path = '/' + name
+                makeDirs(path)
+                if not path in staged:
+                    staged.append(path)
+                with open(path + '.new', 'wb') as dest:
+                    remaining = size
+                    while remaining > 0:
+                        n = body.readexactly(buf, min(len(buf), remaining))
+                        dest.write(buf[:n])
+                        remaining -= n
+                written += size
+            else:
+                # Not a regular file. Skip its data.
+                padding += size
+
+            while padding > 0:
+                padding -= body.readexactly(buf, min(len(buf), padding))
+
+        body.verify()
+
+    except:
+        for path in staged:
+            _remove(path + '.new')
+        invalidateFSStats()
+        raise
+
+    # Swap in.
+    swapped = []
+    try:
+        for path in staged:
+            try:
+                os.rename(path, path + '.old')
+                hadold = True
+            except OSError:
+                hadold = False
+            swapped.append((path, hadold))
+
+            os.rename(path + '.new', path)
+
+    except:
+        # Roll back what we already swapped and drop the rest.
+        logger.write('Error applying bundle, rolling back')
+        for path, hadold in swapped:
+            if hadold:
+                os.rename(path + '.old', path)
+            else:
+                _remove(path)
+        for path in staged:
+            _remove(path + '.new')
+        invalidateFSStats()
+        raise
+
+    # Commit.
+    for path, hadold in swapped:
+        if hadold:
+            _remove(path + '.old')
+    invalidateFSStats()
+
+    return len(staged), written, time.ticks_diff(time.ticks_ms(), start_ms)
+
+'''
+Hash a file with SHA-256. Returns the hex digest.
+
+Hashes are cached by path along with the size and modification time of the file, so unchanged
+files are only hashed once. A file rewritten within the same second can keep both, so files
+modified within hash_settle_s of the clock are hashed every time, as are all files if the
+filesystem does not keep modification times.
+'''
+def fileHash(path):
+    st = os.stat(path)
+    size = st[6]
+    mtime = st[8]
+    cached = _hashes.get(path)
+    if cached and (cached[0] == size) and (cached[1] == mtime):
+        return cached[2]
+
+    buf = uploadBuffer()
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(buf[:n])
+            watchdog.feed()
+
+    digest = ubinascii.hexlify(h.digest()).decode()
+    if mtime and (abs(time.time() - mtime) >= hash_settle_s):
+        _hashes[path] = (size, mtime, digest)
+    else:
+        _hashes.pop(path, None)
+
+    return digest
+
+'''
+Iterate over the entries of folder without building a list of them. Yields tuples of
+(name, type, size) where type is 'd' for folders and 'f' for files. Names are relative
+to folder. If recursive the contents of subfolders follow each folder entry. A subfolder that
+cannot be listed, e.g. because it was deleted in the meantime, is skipped.
+'''
+def iterDir(folder, recursive = False, prefix = ''):
+    folder = folder.rstrip('/')
+    try:
+        entries = os.ilistdir(folder or '/')
+    except OSError:
+        if prefix:
+            return
+        raise
+    
+    for entry in entries:
+        name = prefix + entry[0]
+        if entry[1] == 0x4000:
+            yield (name, 'd', 0)
+            if recursive:
+                yield from iterDir(folder + '/' + entry[0], True, name + '/')
+        else:
+            yield (name, 'f', entry[3] if len(entry) > 3 else os.stat(folder + '/' + entry[0])[6])
+
+'''
+Yield all files recursively with their size and SHA-256 as dicts, one at a time so the caller
+can stream them out. Paths are relative to the root folder.
+'''
+def manifest():
+    seen = set()
+    for name, type, size in iterDir('/', True):
+        if type == 'f':
+            seen.add('/' + name)
+            yield {'path': name, 'size': size, 'sha256': fileHash('/' + name)}
+
+    # Forget the files that are gone.
+    for path in [path for path in _hashes if path not in seen]:
+        del _hashes[path]
+
+if __name__ == '__main__':
+
+    for entry in manifest():
+        logger.write(entry['sha256'] + ' ' + str(entry['size']) + ' ' + entry['path'])
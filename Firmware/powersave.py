@@ -0,0 +1,121 @@
+'''
+This module implements adaptive power management for the WiFi chip.
+
+With power saving off the chip is always listening, which costs power but gives the
+lowest latency. That is what a server wants while it is being used. But the status page
+is idle almost all day, so after a configurable time without requests power saving is
+turned on. The first request after that wakes it up again immediately.
+
+Anything holding a long-lived connection can call hold() and release() to keep power
+saving off in between.
+
+Every switch is timed so we know what it costs, see stats().
+'''
+
+PM_PERFORMANCE = 0xa11140 # Power saving off.
+PM_POWERSAVE = 0xa11142 # The default of the driver.
+
+import time
+import logger
+
+_wlan = None
+_idle_ms = None
+_holds = 0
+
+_last_activity_ms = None
+_powersave = False
+_powersave_since_ms = None
+
+# Results. See stats().
+transitions = 0
+last_switch_us = None
+max_switch_us = 0
+powersave_ms = 0 # Total time spent in power saving mode, not counting the current period.
+
+'''
+Switch power saving on or off. Counts as a transition unless it sets the initial mode.
+'''
+def _switch(powersave, transition = True):
+    global _powersave
+    global _powersave_since_ms
+    global transitions
+    global last_switch_us
+    global max_switch_us
+    global powersave_ms
+
+    start_us = time.ticks_us()
+    _wlan.config(pm = PM_POWERSAVE if powersave else PM_PERFORMANCE)
+    last_switch_us = time.ticks_diff(time.ticks_us(), start_us)
+    max_switch_us = max(max_switch_us, last_switch_us)
+
+    now_ms = time.ticks_ms()
+    if powersave:
+        _powersave_since_ms = now_ms
+    elif _powersave_since_ms is not None:
+        powersave_ms += time.ticks_diff(now_ms, _powersave_since_ms)
+        _powersave_since_ms = None
+
+    _powersave = powersave
+    if transition:
+        transitions += 1
+
+'''
+Take control of the power management of wlan. Power saving is turned on after idle_s seconds
+without activity. With idle_s 0 it stays off for good.
+'''
+def setup(wlan, idle_s):
+    global _wlan
+    global _idle_ms
+    global _last_activity_ms
+
+    _wlan = wlan
+    _idle_ms = idle_s * 1000
+    _last_activity_ms = time.ticks_ms()
+
+    _switch(False, False)
+
+'''
+Report incoming traffic. Turns power saving off right away if it was on.
+'''
+def activity():
+    global _last_activity_ms
+
+    _last_activity_ms = time.ticks_ms()
+    if _powersave:
+        _switch(False)
+
+'''
+Keep power saving off until a matching call to release().
+'''
+def hold():
+    global _holds
+
+    _holds += 1
+    activity()
+
+def release():
+    global _holds
+    global _last_activity_ms
+
+    _holds -= 1
+    _last_activity_ms = time.ticks_ms()
+
+'''
+Turn power saving on once we have been idle long enough. Call on every pass of the main loop.
+'''
+def poll():
+    if (not _wlan) or _powersave or (not _idle_ms) or _holds:
+        return
+
+    if time.ticks_diff(time.ticks_ms(), _last_activity_ms) >= _idle_ms:
+        logger.write('Idle, enabling WiFi power saving')
+        _switch(True)
+
+def stats():
+    return {
+        'powersave': _powersave,
+        'transitions': transitions,
+        'last_switch_us': last_switch_us,
+        'max_switch_us': max_switch_us,
+        'powersave_s': (powersave_ms + (time.ticks_diff(time.ticks_ms(), _powersave_since_ms) if _powersave else 0)) // 1000
+    }
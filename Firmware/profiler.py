@@ -0,0 +1,142 @@
+'''
+This module accounts for the time the animation task spends on each stage of a frame and on
+each animation.
+
+core1 calls enter() whenever it moves on to another stage, naming the animation for the stages
+that render one. The time since the previous call is added to the previous stage and animation:
+Number of calls, total and worst case. Sleeping is not a cost and only shows up in the samples.
+
+In sampling mode a timer on the network core looks at the stage core1 is in every
+sample_period_ms and counts it, a statistical profile that includes the sleep and whatever
+enter() does not see on its own.
+
+Both are off by default and switched on and off at runtime via /api/profile. While both are off
+core1 does not call enter() at all. Totals are in microseconds. On the doorsign numbers past 2**30
+are long integers that allocate, so reset the profile now and then when leaving it on.
+'''
+
+sample_period_ms = 10
+
+import time
+import array
+import machine
+import doorsign
+
+# Stages of a frame.
+SCHEDULE = 0 # Door bell, picking animations and bookkeeping.
+RENDER = 1 # Rendering the active and next animations.
+BLEND = 2 # Blending between them.
+LAYERS = 3 # Rendering the layers.
+COMPOSITE = 4 # Compositing and dimming.
+OUTPUT = 5 # Sending the pixels out.
+SENSORS = 6 # Sampling the sensors.
+GC = 7 # Collecting garbage.
+SLEEP = 8 # Waiting for the next frame.
+
+STAGES = ('schedule', 'render', 'blend', 'layers', 'composite', 'output', 'sensors', 'gc', 'sleep')
+
+enabled = False
+sampling = False
+
+_stages = [array.array('Q', [0, 0, 0]) for stage in STAGES] # calls, total_us, max_us
+_animations = {} # By name, like _stages.
+_samples = array.array('L', [0] * len(STAGES))
+_timer = None
+
+_stage = None # The stage core1 is in, None if unknown.
+_name = None # The animation it is rendering in that stage.
+_since_us = 0 # Since when.
+
+'''
+Prepare the entries for the animations with names, so enter() never has to allocate.
+'''
+def setup(names):
+    for name in names:
+        _animations[name] = array.array('Q', [0, 0, 0])
+
+def _account(entry, us):
+    entry[0] += 1
+    entry[1] += us
+    if us > entry[2]:
+        entry[2] = us
+
+'''
+core1 moves on to stage, rendering the animation name if given.
+'''
+def enter(stage, name = None):
+    global _stage
+    global _name
+    global _since_us
+
+    now_us = time.ticks_us()
+    if enabled and (_stage is not None) and (_stage != SLEEP):
+        us = time.ticks_diff(now_us, _since_us)
+        _account(_stages[_stage], us)
+        if _name is not None:
+            entry = _animations.get(_name)
+            if entry is not None:
+                _account(entry, us)
+
+    _stage = stage
+    _name = name
+    _since_us = now_us
+
+def _sample(timer):
+    stage = _stage
+    if stage is not None:
+        _samples[stage] += 1
+
+'''
+Switch accounting and sampling on or off. The next stage core1 enters starts afresh.
+'''
+def enable(on, sample = None):
+    global enabled
+    global sampling
+    global _stage
+    global _timer
+
+    if on and not enabled:
+        _stage = None
+    enabled = on
+
+    if sample is not None:
+        if sample and (_timer is None):
+            _timer = machine.Timer(period = sample_period_ms, mode = machine.Timer.PERIODIC, callback = _sample)
+        elif (not sample) and _timer:
+            _timer.deinit()
+            _timer = None
+        sampling = sample
+
+'''
+Start over, keeping the switches as they are.
+'''
+def reset():
+    for entry in _stages + list(_animations.values()):
+        entry[0] = 0
+        entry[1] = 0
+        entry[2] = 0
+    for i in range(len(STAGES)):
+        _samples[i] = 0
+
+def _entry(entry):
+    return {
+        'calls': entry[0],
+        'total_us': entry[1],
+        'max_us': entry[2],
+        'mean_us': (entry[1] // entry[0]) if entry[0] else None
+    }
+
+'''
+The profile: Per stage and per animation the calls, total, worst and mean time, per stage the
+samples. Stages share the frame budget, see frame_budget_us, animations are part of the render
+and layers stages.
+'''
+def stats():
+    return {
+        'enabled': enabled,
+        'sampling': sampling,
+        'frame_budget_us': doorsign.frame_intervall_ms * 1000,
+        'stages': {STAGES[i]: _entry(_stages[i]) for i in range(len(STAGES)) if i != SLEEP},
+        'animations': {name: _entry(entry) for name, entry in _animations.items() if entry[0]},
+        'samples': {STAGES[i]: _samples[i] for i in range(len(STAGES))}
+    }
@@ -0,0 +1,146 @@
+'''
+This module samples the analog inputs in the background.
+
+core1 calls poll() in the idle time of its frames. Every sample_interval_ms it reads all ADC
+channels into a small ring buffer per channel. The filtered value of a channel is the median of
+the ring, to drop single spikes, smoothed further with an exponential moving average. The API is
+served from these cached values and never waits for a conversion.
+
+Optionally the light level measured by the LDR drives the dimmer of the animations. Configured
+in the SENSORS section of config.json:
+
+    "SENSORS": {
+        "auto_dimmer": {"dark": 2000, "bright": 20000, "min": 0.1, "max": 1.0, "hysteresis": 1000}
+    }
+
+At or below the dark reading the dimmer is at min, at or above bright at max, in between it is
+interpolated. It only changes once the light level has moved by more than hysteresis since the
+last change, so the pixels do not flicker with noise around a threshold.
+'''
+
+sample_interval_ms = 200
+window = 5 # Samples kept per channel for the median. Odd.
+ema_shift = 2 # Weight of a new median in the average is 1/2**ema_shift.
+light_channel = 0 # The ADC channel of the LDR.
+
+import time
+import array
+import doorsign
+import logger
+
+_raw = array.array('H', [0] * doorsign.adc_count)
+_filtered = array.array('H', [0] * doorsign.adc_count)
+_rings = [array.array('H', [0] * window) for channel in range(doorsign.adc_count)]
+_scratch = array.array('H', [0] * window)
+_index = 0 # Next position in the rings.
+_filled = 0 # Number of valid samples in the rings.
+_last_sample_ms = None
+
+_auto_dimmer = None
+_dimmer_light = None # The light level at the last change of the dimmer.
+
+# Results. See stats().
+samples = 0
+dimmer = 1.0
+dimmer_changes = 0
+
+'''
+Configure from the SENSORS section of config.json.
+'''
+def setup(config):
+    global _auto_dimmer
+
+    _auto_dimmer = config.get('auto_dimmer')
+    if _auto_dimmer:
+        logger.write('Dimming automatically with ambient light')
+
+# Median of the first count samples in ring. Sorts a copy in _scratch so nothing is allocated.
+def _median(ring, count):
+    for i in range(count):
+        value = ring[i]
+        j = i
+        while (j > 0) and (_scratch[j - 1] > value):
+            _scratch[j] = _scratch[j - 1]
+            j -= 1
+        _scratch[j] = value
+
+    return _scratch[count // 2]
+
+def _updateDimmer():
+    global _dimmer_light
+    global dimmer
+    global dimmer_changes
+
+    light = _filtered[light_channel]
+    if (_dimmer_light is not None) and (abs(light - _dimmer_light) <= _auto_dimmer.get('hysteresis', 1000)):
+        return False
+
+    dark = _auto_dimmer.get('dark', 0)
+    bright = _auto_dimmer.get('bright', 65535)
+    low = _auto_dimmer.get('min', 0.1)
+    high = _auto_dimmer.get('max', 1.0)
+
+    if light <= dark:
+        value = low
+    elif light >= bright:
+        value = high
+    else:
+        value = low + (high - low) * (light - dark) / (bright - dark)
+
+    _dimmer_light = light
+    if value == dimmer:
+        return False
+
+    logger.write('Light level ' + str(light) + ', dimmer ' + str(dimmer) + ' -> ' + str(value))
+    dimmer = value
+    dimmer_changes += 1
+    return True
+
+'''
+Take a sample if one is due. Returns True if the automatic dimmer has changed, see dimmer.
+'''
+def poll():
+    global _index
+    global _filled
+    global _last_sample_ms
+    global samples
+
+    now_ms = time.ticks_ms()
+    if (_last_sample_ms is not None) and (time.ticks_diff(now_ms, _last_sample_ms) < sample_interval_ms):
+        return False
+    _last_sample_ms = now_ms
+
+    doorsign.readADCInto(_raw)
+
+    if _filled < window:
+        _filled += 1
+    for channel in range(doorsign.adc_count):
+        ring = _rings[channel]
+        ring[_index] = _raw[channel]
+        median = _median(ring, _filled)
+        if samples == 0:
+            _filtered[channel] = median
+        else:
+            _filtered[channel] += (median - _filtered[channel]) >> ema_shift
+    _index = (_index + 1) % window
+    samples += 1
+
+    if _auto_dimmer:
+        return _updateDimmer()
+    return False
+
+'''
+The filtered values of all channels.
+'''
+def values():
+    return list(_filtered)
+
+def stats():
+    return {
+        'raw': list(_raw),
+        'filtered': list(_filtered),
+        'samples': samples,
+        'auto_dimmer': bool(_auto_dimmer),
+        'dimmer': dimmer,
+        'dimmer_changes': dimmer_changes
+    }
@@ -9,6 +9,9 @@ rem NOTE: Requests for static resources go to /www implicitly. To access root fo
 rem Timing:
 rem curl --verbose --silent --output NUL --write-out "\nEstablish Connection: %%{time_connect}s\nTTFB: %%{time_starttransfer}s\nTotal: %%{time_total}s\n" --path-as-is %host%
 
+rem Timing under load, many requests of different kinds: See host/loadtest.py.
+rem python host\loadtest.py --mix mixed --concurrency 2 --duration 30 --output loadtest.json %host%
+
 rem Static: Fetch the index page without naming it.
 rem curl --verbose --silent --output NUL --path-as-is %host%
 
@@ -18,15 +21,18 @@ rem curl --verbose --silent --output NUL --path-as-is %host%/index.html
 rem Static: Fetch favicon.
 rem curl --verbose --silent --output NUL --path-as-is %host%/favicon.ico
 
-rem Debug: Get "core dump" file.
-curl --verbose --path-as-is --path-as-is %host%/../core.txt
+rem Debug: Get the crash and reset records.
+rem curl --verbose --path-as-is %host%/api/crashes
 
-rem Debug: Delete "core dump" file. 
-rem curl --verbose --request DELETE --path-as-is %host%/../core.txt 
+rem Debug: Clear the crash and reset records.
+rem curl --verbose --request DELETE --path-as-is %host%/api/crashes
 
 rem API: Fetch the data object.
 rem curl --verbose --silent --output NUL --path-as-is %host%/api
 
+rem API: Fetch only selected fields of the data object. Includes frame overruns and the time spent building the previous response.
+rem curl --verbose --path-as-is "%host%/api?fields=uptime,frames,api_us"
+
 rem API: Set RGB on pixel #0.
 rem curl --verbose --request POST --path-as-is %host%/api?manual=1^&r0=255^&g0=255^&b0=0 
 
@@ -34,12 +40,44 @@ rem API: Set all four backside pixels (#1, #3, #5 and #7):
 set b=40
 curl --verbose --request POST --path-as-is %host%/api?manual=1^&r1=%b%^&g1=%b%^&b1=%b%^&r3=%b%^&g3=%b%^&b3=%b%^&r5=%b%^&g5=%b%^&b5=%b%^&r7=%b%^&g7=%b%^&b7=%b%
 
+rem API: Fetch all pixels as hex digits, six per pixel.
+rem curl --verbose --path-as-is %host%/api/pixels?format=hex
+
+rem API: Set all four backside pixels (#1, #3, #5 and #7) in one compact request:
+rem curl --verbose --request POST --path-as-is %host%/api/pixels?index=1,3,5,7^&color=282828
+
+rem API: Set all pixels at once from hex data in the body.
+rem curl --verbose --data-binary "ff0000282828ff0000282828ff0000282828ff0000282828" --path-as-is %host%/api/pixels?format=hex
+
+rem API: Turn off all pixels but leave them under manual control.
+rem curl --verbose --request POST --path-as-is %host%/api/pixels?fill=000000
+
+rem API: Events from the journal since a time in seconds, fifty at a time. Continue after the seq of the last one.
+rem curl --verbose --path-as-is "%host%/api/events?since=0&limit=50"
+rem curl --verbose --path-as-is "%host%/api/events?after=49&limit=50"
+
+rem Metrics in the Prometheus text format.
+rem curl --verbose --path-as-is %host%/metrics
+
+rem Profile the animation task: Switch on accounting and sampling, then read the profile.
+rem curl --verbose --request POST --path-as-is "%host%/api/profile?enabled=1&sampling=1&reset=1"
+rem curl --verbose --path-as-is %host%/api/profile
+
 rem API: Trigger a reset. No response expected.
 rem curl --verbose --request POST --path-as-is %host%/reset 
 
 rem OTA: Upload a largish binary file to /www subdirectory.
 rem curl --verbose --data-binary "@www\android-chrome-512x512.png" --path-as-is %host%/test.data
 
+rem OTA: Upload with verification. The file is only replaced if the SHA-256 (or X-Content-CRC32) matches. Get the hash with: certutil -hashfile test.data SHA256
+rem curl --verbose --header "X-Content-SHA256: <hex digest>" --data-binary "@test.data" --path-as-is %host%/test.data
+
+rem OTA: List all files on the device with size and SHA-256.
+rem curl --verbose --path-as-is %host%/manifest
+
+rem OTA: Upload a tar archive of files relative to the root folder, applied all or nothing. See upload.py.
+rem curl --verbose --data-binary "@bundle.tar" --path-as-is %host%/bundle
+
 rem OTA: Delete a file from /www subdirectory
 rem curl --verbose --request DELETE --path-as-is %host%/test.data 
 
@@ -49,6 +87,9 @@ rem curl --verbose --data-binary "@test.data" --path-as-is %host%/../test.data
 rem OTA: Delete a file from root folder.
 rem curl --verbose --request DELETE --path-as-is %host%/../test.data 
 
+rem OTA: List root folder recursively with sizes, twenty entries at a time.
+rem curl --verbose --path-as-is "%host%/../?recursive=1&offset=0&limit=20"
+
 rem OTA: List root folder requires trickery because root is mappped to wwww.
 rem curl --verbose --path-as-is %host%/../
 
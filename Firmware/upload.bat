@@ -1,6 +1,8 @@
 @echo off
 rem Batch file to upload all the files named in filelist.txt to the doorsign by POSTing them
 rem to the webserver on the board.
+rem
+rem See upload.py for a faster alternative that only sends changed files in a single request.
 
 set host=192.168.0.113
 
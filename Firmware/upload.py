@@ -0,0 +1,108 @@
+'''
+Host-side tool to update the doorsign firmware over the network. Runs on the PC, not on the Pico.
+
+Reads the files named in filelist.txt, fetches the manifest of the files on the doorsign and
+compares sizes and hashes. All files that differ are packed into a single tar archive which is
+POSTed to /bundle and applied on the device all or nothing. Then the doorsign is reset to run
+the new firmware.
+
+Usage: python upload.py [--all] [--dry-run] [--no-reset] [host]
+'''
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import urllib.request
+
+default_host = '192.168.0.113'
+
+def readFilelist(filename):
+    files = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                files.append(line)
+
+    return files
+
+def fileHash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def fetchManifest(host):
+    with urllib.request.urlopen('http://' + host + '/manifest', timeout = 60) as response:
+        return {entry['path']: entry for entry in json.load(response)}
+
+def buildBundle(files):
+    data = io.BytesIO()
+    with tarfile.open(fileobj = data, mode = 'w', format = tarfile.USTAR_FORMAT) as tar:
+        for filename in files:
+            tar.add(filename, arcname = filename, recursive = False)
+
+    return data.getvalue()
+
+def postBundle(host, bundle):
+    request = urllib.request.Request('http://' + host + '/bundle', data = bundle, method = 'POST')
+    request.add_header('Content-Type', 'application/x-tar')
+    request.add_header('X-Content-SHA256', hashlib.sha256(bundle).hexdigest())
+    with urllib.request.urlopen(request, timeout = 120) as response:
+        return response.status, response.reason
+
+def reset(host):
+    request = urllib.request.Request('http://' + host + '/reset', method = 'POST')
+    try:
+        urllib.request.urlopen(request, timeout = 5)
+    except Exception:
+        pass # No response expected.
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Upload changed firmware files to the doorsign in one bundle.')
+    parser.add_argument('host', nargs = '?', default = default_host)
+    parser.add_argument('--filelist', default = 'filelist.txt')
+    parser.add_argument('--all', action = 'store_true', help = 'Upload all files, not only the changed ones.')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'Only list the files that would be uploaded.')
+    parser.add_argument('--no-reset', action = 'store_true', help = 'Do not reset the doorsign after uploading.')
+    args = parser.parse_args()
+
+    # Paths in filelist.txt are relative to the folder it is in.
+    os.chdir(os.path.dirname(os.path.abspath(args.filelist)))
+    files = readFilelist(os.path.basename(args.filelist))
+
+    if args.all:
+        changed = files
+    else:
+        manifest = fetchManifest(args.host)
+        changed = []
+        for filename in files:
+            entry = manifest.get(filename)
+            if (not entry) or (entry['size'] != os.path.getsize(filename)) or (entry['sha256'] != fileHash(filename)):
+                changed.append(filename)
+
+    for filename in changed:
+        print('! ' + filename)
+
+    if not changed:
+        print('! Doorsign is up to date')
+        return 0
+
+    if args.dry_run:
+        return 0
+
+    bundle = buildBundle(changed)
+    print('! Uploading {} files in {} bytes to {}'.format(len(changed), len(bundle), args.host))
+    status, reason = postBundle(args.host, bundle)
+    print('! {} {}'.format(status, reason))
+
+    if not args.no_reset:
+        print('! Triggering reset')
+        reset(args.host)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,18 +13,23 @@ timer (see enable_wdt(), there are hardware limits) to avoid spurious activation
 '''
 
 watchdog_interval_ms = 5000 
+near_miss_ms = watchdog_interval_ms // 2 # A heartbeat older than this counts as a near miss.
  
 import machine
 import _thread
 import time
 import logger
 import lock
+import metrics
 
 wdt = None
 wdt_simulated_reset_occured = False
 wdt_lock = lock.RecursiveLock()
         
 thread_feed_ms = {}
+
+_near_misses = metrics.counter('watchdog_near_misses_total', 'Heartbeats that came more than half the watchdog interval after the previous one of the thread.')
+_timeouts = metrics.counter('watchdog_timeouts_total', 'Heartbeats that came too late, the watchdog would have fired.')
     
 def enable():
     global wdt
@@ -42,7 +47,15 @@ def feed():
     wdt_lock.acquire()
     try:
         # Record ticks for the calling thread.
-        thread_feed_ms[logger.get_thread_id()] = time.ticks_ms()
+        id = logger.get_thread_id()
+        now = time.ticks_ms()
+        if id in thread_feed_ms:
+            age = time.ticks_diff(now, thread_feed_ms[id])
+            if age > watchdog_interval_ms:
+                metrics.inc(_timeouts)
+            elif age > near_miss_ms:
+                metrics.inc(_near_misses)
+        thread_feed_ms[id] = now
         
         # Now check the heartbeats of all threads and only feed
         # the watchdog if they are all fresh enough.
@@ -0,0 +1,152 @@
+'''
+This module supervises the WiFi link in STA (client) mode.
+
+It is a state machine advanced by calling poll() from the network task's main loop, so it never
+blocks: It starts connecting, watches for the link to come up, notices when it is lost and then
+reconnects. Failed attempts are retried with exponential backoff.
+
+poll() returns UP when the link has just come up and DOWN when it has just been lost so the
+caller can set up or tear down whatever depends on it.
+'''
+
+connect_timeout_ms = 30 * 1000
+min_backoff_ms = 2 * 1000
+max_backoff_ms = 5 * 60 * 1000
+
+UP = 'up'
+DOWN = 'down'
+
+import time
+import logger
+
+# Link status codes as returned by wlan.status():
+# 0  Link Down
+# 1  Link Join
+# 2  Link NoIp
+# 3  Link Up
+# -1 Link Fail
+# -2 Link NoNet
+# -3 Link BadAuth
+STAT_GOT_IP = 3
+
+_wlan = None
+_ssid = None
+_pw = None
+
+_state = None # 'connecting', 'up' or 'waiting'
+_state_ms = None
+_wait_ms = 0 # How long to stay in 'waiting'.
+_backoff_ms = min_backoff_ms # The wait after the next failure.
+
+# Results. See stats().
+up_since_ms = None
+connects = 0
+losses = 0
+failures = 0
+last_status = None
+
+def setup(wlan, ssid, pw):
+    global _wlan
+    global _ssid
+    global _pw
+    global _state
+    global _state_ms
+    global _wait_ms
+
+    _wlan = wlan
+    _ssid = ssid
+    _pw = pw
+
+    # Start connecting on the first poll().
+    _state = 'waiting'
+    _state_ms = time.ticks_ms()
+    _wait_ms = 0
+
+def _enter(state, now_ms):
+    global _state
+    global _state_ms
+
+    _state = state
+    _state_ms = now_ms
+
+def _connect(now_ms):
+    logger.write('Connecting to: ' + _ssid + (' /w password' if _pw else ''))
+    _wlan.connect(_ssid, _pw)
+    _enter('connecting', now_ms)
+
+'''
+Wait _backoff_ms before the next attempt, and twice as long after the next failure.
+'''
+def _retry(now_ms):
+    global _wait_ms
+    global _backoff_ms
+
+    _enter('waiting', now_ms)
+    _wait_ms = _backoff_ms
+    _backoff_ms = min(_backoff_ms * 2, max_backoff_ms)
+
+'''
+Advance the state machine. Returns UP or DOWN on a change of the link state, None otherwise.
+'''
+def poll():
+    global _wait_ms
+    global _backoff_ms
+    global up_since_ms
+    global connects
+    global losses
+    global failures
+    global last_status
+
+    if _wlan is None:
+        return None
+
+    now_ms = time.ticks_ms()
+
+    if _state == 'up':
+        last_status = _wlan.status()
+        if (last_status != STAT_GOT_IP) or not _wlan.isconnected():
+            logger.write('Wi-Fi connection lost, status = ' + str(last_status))
+            losses += 1
+            up_since_ms = None
+            _wlan.disconnect()
+
+            # Try again right away.
+            _backoff_ms = min_backoff_ms
+            _wait_ms = 0
+            _enter('waiting', now_ms)
+            return DOWN
+
+    elif _state == 'connecting':
+        last_status = _wlan.status()
+        if last_status == STAT_GOT_IP:
+            logger.write('Connected')
+            connects += 1
+            up_since_ms = now_ms
+            _backoff_ms = min_backoff_ms
+            _enter('up', now_ms)
+            return UP
+        elif (last_status < 0) or (time.ticks_diff(now_ms, _state_ms) >= connect_timeout_ms):
+            failures += 1
+            logger.write('Wi-Fi connection failed status = ' + str(last_status) + ', retrying in ' + str(_backoff_ms // 1000) + ' s')
+            _wlan.disconnect()
+            _retry(now_ms)
+
+    elif _state == 'waiting':
+        if time.ticks_diff(now_ms, _state_ms) >= _wait_ms:
+            _connect(now_ms)
+
+    return None
+
+def isUp():
+    return _state == 'up'
+
+def stats():
+    return {
+        'state': _state,
+        'status': last_status,
+        'link_uptime_s': (time.ticks_diff(time.ticks_ms(), up_since_ms) // 1000) if up_since_ms is not None else None,
+        'connects': connects,
+        'reconnects': max(connects - 1, 0),
+        'losses': losses,
+        'failures': failures
+    }